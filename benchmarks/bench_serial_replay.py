@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Replay captured serial logs through the plugin's comm hooks and report what they cost.
+
+Every "Send:" line goes through ``comm_protocol_gcode_sent``, every "Recv:"
+line through ``comm_protocol_gcode_received``, and the lines the hooks
+queued are then processed synchronously (what the ingestion worker does).
+Temperature reports are also turned into add-temperature payloads for
+``process_temp_data``. The printer, printer profile, settings and plugin
+manager are the stubs of plugin_stubs.py, so no OctoPrint server is needed,
+but OctoPrint itself must be importable (pip install -e .):
+
+    python benchmarks/bench_serial_replay.py [--repeat N] [--no-alloc] [LOG ...]
+
+Without LOG, the bundled fixtures (idle printer, print streaming G1, dual
+hotend autotune) are replayed; see fixtures/make_fixtures.py.
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import gc
+import glob
+import logging
+import os
+import re
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import plugin_stubs
+from octoprint_pidtune.ingest import IngestionQueue
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+_RE_LOG_LINE = re.compile(r"^(?:(?P<stamp>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - )?(?P<dir>Send|Recv): ?(?P<line>.*)$")
+_RE_LINE_NUMBER = re.compile(r"^N\d+\s+(?P<cmd>.*?)\*\d+$")
+_RE_GCODE = re.compile(r"^\s*(?P<gcode>[GMT]\d+)")
+_RE_TEMP = re.compile(r"(?P<key>B|T\d*):\s*(?P<actual>-?\d+\.?\d*)\s*/\s*(?P<target>-?\d+\.?\d*)")
+
+
+def read_log(path: str) -> list:
+    """(direction, epoch seconds, line) of every Send/Recv line of a serial log."""
+    entries = []
+    with open(path) as handle:
+        for raw in handle:
+            match = _RE_LOG_LINE.match(raw.rstrip("\r\n"))
+            if not match:
+                continue
+            stamp = match.group("stamp")
+            seconds = datetime.strptime(stamp, "%Y-%m-%d %H:%M:%S,%f").timestamp() if stamp else 0.0
+            entries.append((match.group("dir"), seconds, match.group("line")))
+    return entries
+
+
+def count_extruders(entries: list) -> int:
+    count = 1
+    for _, _, line in entries:
+        for match in _RE_TEMP.finditer(line):
+            key = match.group("key")
+            if len(key) > 1:
+                count = max(count, int(key[1:]) + 1)
+    return count
+
+
+def temperature_payload(line: str, seconds: float):
+    """add-temperature callback payload of a temperature report, or None."""
+    temps = {}
+    current = None
+    for match in _RE_TEMP.finditer(line):
+        key = match.group("key")
+        value = {"actual": float(match.group("actual")), "target": float(match.group("target"))}
+        if key == "B":
+            temps["bed"] = value
+        elif key == "T":
+            current = value
+        else:
+            temps["tool" + key[1:]] = value
+    if current is not None and "tool0" not in temps:
+        temps["tool0"] = current
+    if not temps:
+        return None
+    temps["time"] = int(seconds)
+    return {"data": {"serverTime": seconds, "temps": [temps]}}
+
+
+def make_plugin(extruders: int):
+    logger = logging.getLogger("bench.pidtune")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    plugin = plugin_stubs.make_plugin(extruders)
+    plugin._logger = plugin.logger = logger
+    plugin.get_printer_profile()
+    plugin._ingest = IngestionQueue(logger, plugin.process_ingested_line, maxlen=1 << 20, batch_size=1 << 20)
+    plugin.started = True
+    return plugin
+
+
+def replay(plugin, entries: list, repeat: int, timings=None):
+    """Push every entry through the hooks, ``timings`` collecting ns per hook."""
+    clock = time.perf_counter_ns
+    ingest = plugin._ingest
+    span = (entries[-1][1] - entries[0][1] + 1) if entries else 0
+    # log times are moved to now so that the history window keeps them
+    offset = time.time() - entries[0][1] if entries else 0
+
+    def timed(name, func, *args):
+        start = clock()
+        func(*args)
+        if timings is not None:
+            timings.setdefault(name, []).append(clock() - start)
+
+    for round_ in range(repeat):
+        shift = offset + round_ * span
+        for direction, seconds, line in entries:
+            if direction == "Send":
+                numbered = _RE_LINE_NUMBER.match(line)
+                cmd = numbered.group("cmd") if numbered else line
+                gcode = _RE_GCODE.match(cmd)
+                timed("gcode_sent", plugin.comm_protocol_gcode_sent, None, "sent", cmd, None, gcode.group("gcode") if gcode else None)
+                timed("process sent", ingest.drain)
+            else:
+                timed("gcode_received", plugin.comm_protocol_gcode_received, None, line)
+                timed("process received", ingest.drain)
+                payload = temperature_payload(line, seconds + shift)
+                if payload:
+                    timed("process_temp_data", plugin.process_temp_data, payload)
+
+
+def percentile(values: list, fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench(path: str, repeat: int, allocations: bool):
+    entries = read_log(path)
+    extruders = count_extruders(entries)
+    print("%s: %d lines, %d extruder(s), x%d" % (os.path.basename(path), len(entries), extruders, repeat))
+
+    plugin = make_plugin(extruders)
+    timings = {}
+    gc.collect()
+    replay(plugin, entries, repeat, timings)
+
+    total_ns = sum(sum(v) for v in timings.values())
+    lines = len(entries) * repeat
+    print("  %-18s %8s %10s %10s %10s" % ("hook", "calls", "p50 us", "p99 us", "total ms"))
+    for name in ("gcode_sent", "process sent", "gcode_received", "process received", "process_temp_data"):
+        values = sorted(timings.get(name, ()))
+        if not values:
+            continue
+        print("  %-18s %8d %10.2f %10.2f %10.2f" % (
+            name, len(values), percentile(values, 0.5) / 1e3, percentile(values, 0.99) / 1e3, sum(values) / 1e6
+        ))
+    print("  lines/sec: %.0f" % (lines / (total_ns / 1e9) if total_ns else 0))
+    manager = plugin._plugin_manager
+    print("  plugin messages: %d (%.1f KiB)" % (len(manager.messages), manager.payload_bytes / 1024))
+    print("  parser: %s, history: %d samples" % (plugin._parser.classifier.stats(), plugin.history.memory_usage()["samples"]))
+
+    if allocations:
+        plugin = make_plugin(extruders)
+        gc.collect()
+        blocks = sys.getallocatedblocks()
+        tracemalloc.start()
+        replay(plugin, entries, repeat)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        gc.collect()
+        print("  allocations: %.1f KiB retained, %.1f KiB peak, %+d blocks" % (
+            current / 1024, peak / 1024, sys.getallocatedblocks() - blocks
+        ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("logs", nargs="*", help="serial.log files (default: the bundled fixtures)")
+    parser.add_argument("--repeat", type=int, default=1, help="replay every log this many times")
+    parser.add_argument("--no-alloc", action="store_true", help="skip the tracemalloc pass")
+    args = parser.parse_args()
+    for log in args.logs or sorted(glob.glob(os.path.join(HERE, "fixtures", "*.log"))):
+        bench(log, args.repeat, not args.no_alloc)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare the JSON round-trip ``unfreeze`` with the direct ``thaw_*`` converters
+on payloads shaped like OctoPrint's current-data and add-temperature callbacks.
+
+Run from an environment where the plugin is installed (pip install -e .):
+
+    python benchmarks/bench_unfreeze.py [--number N]
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import timeit
+
+from frozendict import frozendict
+
+from octoprint_pidtune.plugin_callbacks import thaw_current_data, thaw_temperature, unfreeze
+
+
+def make_temperature(t: float) -> frozendict:
+    return frozendict({
+        "time" : t,
+        "tool0": frozendict({"actual": 210.3, "target": 210.0}),
+        "tool1": frozendict({"actual": 24.8, "target": 0.0}),
+        "bed"  : frozendict({"actual": 60.1, "target": 60.0}),
+    })
+
+
+def make_current_data(log_lines: int = 300) -> frozendict:
+    flags = frozendict({
+        "cancelling": False, "closedOrError": False, "error": False, "finishing": False,
+        "operational": True, "paused": False, "pausing": False, "printing": True,
+        "ready": False, "resuming": False, "sdReady": True,
+    })
+    return frozendict({
+        "state"     : frozendict({"text": "Printing", "error": "", "flags": flags}),
+        "job"       : frozendict({
+            "file": frozendict({"name": "part.gcode", "path": "part.gcode", "origin": "local", "size": 123456}),
+            "estimatedPrintTime": 3600.0, "lastPrintTime": None, "user": "admin",
+            "filament": frozendict({"tool0": frozendict({"length": 1234.5, "volume": 2.9})}),
+        }),
+        "progress"  : frozendict({"completion": 12.5, "filepos": 15432, "printTime": 450, "printTimeLeft": 3150}),
+        "currentZ"  : 0.4,
+        "offsets"   : frozendict(),
+        "resends"   : frozendict({"count": 0, "transmitted": 1000, "ratio": 0}),
+        "serverTime": 1668541147.58,
+        "temps"     : (make_temperature(1668541147.0),),
+        "logs"      : tuple("Send: N%d G1 X10.0 Y20.0 E0.5 F1800*42" % i for i in range(log_lines)),
+        "messages"  : tuple("ok" for _ in range(log_lines)),
+        "markings"  : (),
+        "busyFiles" : (),
+    })
+
+
+def run(number: int):
+    current = make_current_data()
+    temperature = make_temperature(1668541147.0)
+    cases = (
+        ("current data    unfreeze", lambda: unfreeze(current)),
+        ("current data    thaw    ", lambda: thaw_current_data(current)),
+        ("add temperature unfreeze", lambda: unfreeze(temperature)),
+        ("add temperature thaw    ", lambda: thaw_temperature(temperature)),
+    )
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print("%s: %8.2f us/call" % (name, best / number * 1e6))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=2000)
+    run(parser.parse_args().number)
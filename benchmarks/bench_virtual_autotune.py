@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Run a full multi-heater autotune against a simulated Marlin printer.
+
+The plugin is wired as in bench_serial_replay.py, but the printer stub
+forwards the commands the plugin sends to a VirtualMarlin (see
+virtual_marlin.py), whose output goes back through the comm hooks and the
+temperature callback. The printer clock only moves in simulation steps, so
+an autotune of every heater runs in seconds:
+
+    python benchmarks/bench_virtual_autotune.py [--mode queue|relay] [--extruders N] [--no-bed]
+
+"queue" runs the firmware M303 of each heater back to back (Autotune All
+Heaters), "relay" the plugin-driven relay autotune of all heaters at once.
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import collections
+import time
+
+from bench_serial_replay import make_plugin, temperature_payload, _RE_GCODE
+from plugin_stubs import StubPrinter
+from virtual_marlin import VirtualMarlin
+
+
+class VirtualPrinter(StubPrinter):
+    """Queues the commands the plugin sends until the driver delivers them."""
+
+    def __init__(self):
+        super(VirtualPrinter, self).__init__()
+        self.pending = collections.deque()
+
+    def commands(self, commands, *args, **kwargs):
+        commands = [commands] if isinstance(commands, str) else list(commands)
+        self.sent.extend(commands)
+        self.pending.extend((command, kwargs.get("tags")) for command in commands)
+
+
+def heater_jobs(extruders: int, heated_bed: bool, hotend: float, bed: float, cycles: int) -> list:
+    jobs = [{"heater": i, "target": hotend, "cycles": cycles} for i in range(extruders)]
+    if heated_bed:
+        jobs.append({"heater": -1, "target": bed, "cycles": cycles})
+    return jobs
+
+
+def run(plugin, marlin: VirtualMarlin, done, step: float, limit: float) -> dict:
+    """Step the printer until ``done()`` or ``limit`` printer seconds; returns counters."""
+    printer = plugin._printer
+    ingest = plugin._ingest
+    # printer time is laid on the wall clock so the plugin's time windows apply
+    epoch = time.time()
+    counters = collections.Counter()
+    while marlin.ms < limit * 1000 and not done():
+        while printer.pending:
+            command, tags = printer.pending.popleft()
+            gcode = _RE_GCODE.match(command)
+            plugin.comm_protocol_gcode_sent(None, "sent", command, None, gcode.group("gcode") if gcode else None, tags=tags)
+            ingest.drain()
+            marlin.send(command)
+            counters["sent"] += 1
+        marlin.advance(step)
+        for ms, line in marlin.read():
+            plugin.comm_protocol_gcode_received(None, line)
+            ingest.drain()
+            counters["received"] += 1
+            payload = temperature_payload(line, epoch + ms / 1000)
+            if payload:
+                plugin.process_temp_data(payload)
+                counters["temperatures"] += 1
+    return counters
+
+
+def report_jobs(jobs: list, marlin: VirtualMarlin):
+    for job in jobs:
+        heater = job["heater"]
+        model = marlin.heater(heater)
+        result = job.get("result") or {}
+        gains = " ".join("%s=%.3f" % (k, result[k]) for k in ("kp", "ki", "kd", "ku", "tu") if result.get(k) is not None)
+        print("  %-4s %-10s cycles %2d  %s" % (model.name, job["state"], job.get("cycles_done") or job.get("cycles") or 0, gains))
+
+
+def autotune(mode: str, extruders: int = 2, heated_bed: bool = True, hotend: float = 220, bed: float = 60,
+             cycles: int = 8, step: float = 0.1, limit: float = 4 * 3600) -> dict:
+    """Run one autotune of every heater; returns the plugin, the VirtualMarlin, the job results, the counters and the wall time."""
+    plugin = make_plugin(extruders)
+    plugin._printer = VirtualPrinter()
+    plugin._printer_profile_manager.profile["heatedBed"] = heated_bed
+    plugin.get_printer_profile()
+    marlin = VirtualMarlin(extruders=extruders, heated_bed=heated_bed, step=step)
+    jobs = heater_jobs(extruders, heated_bed, hotend, bed, cycles)
+
+    start = time.perf_counter()
+    if mode == "relay":
+        plugin.start_relay_autotune(jobs)
+        counters = run(plugin, marlin, lambda: plugin._relay.done, step, limit)
+        summary = plugin._relay.summary()
+        results = [dict(t, cycles_done=t["cycles"]) for t in summary["heaters"]]
+    else:
+        plugin.start_autotune_queue(jobs)
+        counters = run(plugin, marlin, lambda: plugin._scheduler.done, step, limit)
+        results = plugin._scheduler.summary()["jobs"]
+    wall = time.perf_counter() - start
+    return {"plugin": plugin, "marlin": marlin, "results": results, "counters": counters, "wall": wall}
+
+
+def bench(mode: str, extruders: int, heated_bed: bool, hotend: float, bed: float, cycles: int, step: float, limit: float):
+    outcome = autotune(mode, extruders, heated_bed, hotend, bed, cycles, step, limit)
+    marlin, counters, wall = outcome["marlin"], outcome["counters"], outcome["wall"]
+    sim = marlin.ms / 1000
+    print("%s autotune, %d extruder(s)%s, %d cycles" % (mode, extruders, " + bed" if heated_bed else "", cycles))
+    print("  printer time %.0f s in %.2f s wall (x%.0f)" % (sim, wall, sim / wall if wall else 0))
+    print("  %d commands sent, %d lines received, %d temperature reports" % (
+        counters["sent"], counters["received"], counters["temperatures"]
+    ))
+    report_jobs(outcome["results"], marlin)
+    manager = outcome["plugin"]._plugin_manager
+    print("  plugin messages: %d (%.1f KiB)" % (len(manager.messages), manager.payload_bytes / 1024))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mode", choices=("queue", "relay"), default="queue")
+    parser.add_argument("--extruders", type=int, default=2)
+    parser.add_argument("--no-bed", action="store_true", help="printer without heated bed")
+    parser.add_argument("--hotend", type=float, default=220, help="hotend autotune target")
+    parser.add_argument("--bed", type=float, default=60, help="bed autotune target")
+    parser.add_argument("--cycles", type=int, default=8)
+    parser.add_argument("--step", type=float, default=0.1, help="simulation step in printer seconds")
+    parser.add_argument("--limit", type=float, default=4 * 3600, help="give up after this many printer seconds")
+    args = parser.parse_args()
+    bench(args.mode, args.extruders, not args.no_bed, args.hotend, args.bed, args.cycles, args.step, args.limit)
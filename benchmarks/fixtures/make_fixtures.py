@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Regenerate the serial log fixtures used by bench_serial_replay.py.
+
+The logs follow OctoPrint's serial.log format ("<date> <time> - Send: ..."
+and "... - Recv: ...") and are deterministic, so numbers stay comparable
+between runs:
+
+    python benchmarks/fixtures/make_fixtures.py
+"""
+from __future__ import absolute_import, division, print_function
+
+import datetime
+import os
+import random
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+START = datetime.datetime(2022, 11, 15, 20, 0, 0)
+
+
+class Log:
+    def __init__(self):
+        self.lines = []
+        self.now = 0.0
+        self.line_number = 0
+
+    def stamp(self) -> str:
+        t = START + datetime.timedelta(seconds=self.now)
+        return t.strftime("%Y-%m-%d %H:%M:%S,") + "%03d" % (t.microsecond // 1000)
+
+    def send(self, command: str, numbered: bool = False):
+        if numbered:
+            self.line_number += 1
+            body = "N%d %s" % (self.line_number, command)
+            checksum = 0
+            for c in body:
+                checksum ^= ord(c)
+            command = "%s*%d" % (body, checksum)
+        self.lines.append("%s - Send: %s" % (self.stamp(), command))
+
+    def recv(self, line: str):
+        self.lines.append("%s - Recv: %s" % (self.stamp(), line))
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+    def save(self, name: str):
+        with open(os.path.join(HERE, name), "w") as handle:
+            handle.write("\n".join(self.lines) + "\n")
+        print("%s: %d lines" % (name, len(self.lines)))
+
+
+def temps(tools, bed, prefix: str = "ok") -> str:
+    parts = []
+    if len(tools) == 1:
+        parts.append("T:%.2f /%.2f" % tools[0])
+    else:
+        parts.append("T:%.2f /%.2f" % tools[0])
+        parts.extend("T%d:%.2f /%.2f" % (i, a, t) for i, (a, t) in enumerate(tools))
+    parts.append("B:%.2f /%.2f" % bed)
+    parts.append("@:0 B@:0")
+    return ("%s " % prefix if prefix else " ") + " ".join(parts)
+
+
+def idle(rng: random.Random):
+    log = Log()
+    for _ in range(600):
+        log.send("M105")
+        log.advance(0.02)
+        log.recv(temps([(24.5 + rng.gauss(0, 0.1), 0.0)], (23.9 + rng.gauss(0, 0.05), 0.0)))
+        log.advance(1.98)
+    log.save("idle.log")
+
+
+def printing(rng: random.Random):
+    log = Log()
+    x = y = 100.0
+    e = 0.0
+    next_report = 0.0
+    for _ in range(2500):
+        x += rng.uniform(-2, 2)
+        y += rng.uniform(-2, 2)
+        e += 0.05
+        log.send("G1 X%.3f Y%.3f E%.5f" % (x, y, e), numbered=True)
+        log.advance(0.004)
+        log.recv("ok")
+        log.advance(0.004)
+        if log.now >= next_report:
+            next_report = log.now + 2.0
+            log.send("M105", numbered=True)
+            log.recv(temps([(210 + rng.gauss(0, 0.4), 210.0)], (60 + rng.gauss(0, 0.1), 60.0)))
+    log.save("printing_g1.log")
+
+
+def autotune(log: Log, rng: random.Random, heater: int, target: float, cycles: int, others):
+    log.send("M303 E%d S%d C%d" % (heater, target, cycles))
+    log.recv("PID Autotune start")
+    actual = others[heater][0]
+    rate = 2.0
+    period = 20.0
+    for cycle in range(cycles + 1):
+        for phase in range(int(period / 2)):
+            if cycle == 0:
+                actual = min(target + 4, actual + rate * 2)
+            else:
+                actual = target + 4 * (1 if phase < period / 4 else -1) * (1 - abs(phase - period / 4) / (period / 4))
+            others[heater] = (actual + rng.gauss(0, 0.1), 0.0)
+            log.recv(temps(others[:-1], others[-1], prefix=""))
+            log.advance(1.0)
+        if cycle >= 1:
+            bias = 92 - cycle
+            log.recv(" bias: %d d: %d min: %.2f max: %.2f" % (bias, bias, target - 4 - rng.random(), target + 4 + rng.random()))
+        if cycle > 2:
+            ku = 27.7 + rng.gauss(0, 0.2)
+            tu = 19.3 + rng.gauss(0, 0.1)
+            log.recv(" Ku: %.2f Tu: %.2f" % (ku, tu))
+            log.recv(" Classic PID ")
+            kp = 0.6 * ku
+            log.recv(" Kp: %.2f Ki: %.2f Kd: %.2f" % (kp, 2 * kp / tu, kp * tu / 8))
+    log.recv("PID Autotune finished! Put the last Kp, Ki and Kd constants from below into Configuration.h")
+    log.recv("#define DEFAULT_Kp %.2f" % kp)
+    log.recv("#define DEFAULT_Ki %.2f" % (2 * kp / tu))
+    log.recv("#define DEFAULT_Kd %.2f" % (kp * tu / 8))
+    log.recv("ok")
+    others[heater] = (others[heater][0], 0.0)
+
+
+def dual_autotune(rng: random.Random):
+    log = Log()
+    heaters = [(24.5, 0.0), (24.8, 0.0), (23.9, 0.0)]
+    autotune(log, rng, 0, 240, 8, heaters)
+    for _ in range(30):
+        log.send("M105")
+        log.recv(temps(heaters[:-1], heaters[-1]))
+        log.advance(2.0)
+    autotune(log, rng, 1, 240, 8, heaters)
+    log.save("dual_autotune.log")
+
+
+if __name__ == "__main__":
+    idle(random.Random(1))
+    printing(random.Random(2))
+    dual_autotune(random.Random(3))
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-ins for the OctoPrint objects the plugin talks to.
+
+The benchmarks and the tests build the plugin with these instead of a
+running OctoPrint server; OctoPrint itself must still be importable.
+"""
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+from typing import Optional
+
+from octoprint_pidtune import PidtunePlugin
+
+
+class StubPrinter:
+    def __init__(self):
+        self.callbacks = []
+        self.sent = []
+
+    def commands(self, commands, *args, **kwargs):
+        self.sent.extend([commands] if isinstance(commands, str) else commands)
+
+    def register_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def is_operational(self):
+        return True
+
+    def is_printing(self):
+        return False
+
+    def is_paused(self):
+        return False
+
+
+class StubProfileManager:
+    def __init__(self, extruders: int = 2, heated_bed: bool = True):
+        self.profile = {"heatedBed": heated_bed, "extruder": {"count": extruders}}
+
+    def get_current(self):
+        return self.profile
+
+    get_current_or_default = get_current
+
+
+class StubSettings:
+    def __init__(self, defaults: dict, log_path: Optional[str] = None):
+        self.values = dict(defaults)
+        self.log_path = log_path
+
+    def get(self, path, *args, **kwargs):
+        return self.values.get(path[0])
+
+    def get_float(self, path, *args, **kwargs):
+        value = self.get(path)
+        return float(value) if value is not None else None
+
+    def get_int(self, path, *args, **kwargs):
+        value = self.get(path)
+        return int(value) if value is not None else None
+
+    def get_boolean(self, path, *args, **kwargs):
+        return bool(self.get(path))
+
+    def get_plugin_logfile_path(self, postfix=None):
+        return self.log_path
+
+
+class StubPluginManager:
+    """Keeps the plugin messages and counts their JSON size instead of sending them."""
+
+    def __init__(self):
+        self.messages = []
+        self.payload_bytes = 0
+
+    def send_plugin_message(self, identifier, data):
+        self.messages.append(data)
+        self.payload_bytes += len(json.dumps(data))
+
+
+def make_plugin(extruders: int = 2, heated_bed: bool = True, data_folder: Optional[str] = None) -> PidtunePlugin:
+    """A plugin wired to the stubs, not started yet.
+
+    With ``data_folder``, history segments, sessions and the debug log go
+    there, so ``on_after_startup`` can run.
+    """
+    plugin = PidtunePlugin()
+    plugin._identifier = "pidtune"
+    log_path = os.path.join(data_folder, "plugin_pidtune_debug.log") if data_folder else None
+    plugin._settings = StubSettings(plugin.setting_defaut, log_path)
+    plugin._printer = StubPrinter()
+    plugin._printer_profile_manager = StubProfileManager(extruders, heated_bed)
+    plugin._plugin_manager = StubPluginManager()
+    if data_folder:
+        plugin.get_plugin_data_folder = lambda: data_folder
+    return plugin
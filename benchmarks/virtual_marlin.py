@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Simulated Marlin printer for exercising the autotune flow without hardware.
+
+Heaters follow a first-order-plus-dead-time thermal model and are driven
+either by a Marlin-like PID loop (M104/M140 targets) or by a port of
+Marlin's M303 relay autotune, which prints the same "bias:/d:/min:/max:",
+"Ku:/Tu:", "Classic PID" and "PID Autotune finished!" lines. Time only
+advances through ``advance()``, so an autotune that takes ten minutes on a
+printer runs in a fraction of a second.
+"""
+from __future__ import absolute_import, division, print_function
+
+import collections
+import math
+import re
+
+PID_MAX = 255
+PID_FUNCTIONAL_RANGE = 10
+MAX_OVERSHOOT_PID_AUTOTUNE = 30
+AMBIENT = 25.0
+
+_RE_PARAM = re.compile(r"([A-Z])\s*(-?\d+\.?\d*)")
+
+
+def parse_params(command: str) -> dict:
+    return {letter: float(value) for letter, value in _RE_PARAM.findall(command.upper().split(None, 1)[1] if " " in command else "")}
+
+
+class Heater:
+    """First-order-plus-dead-time heater: ``tau dT/dt = gain * power - (T - ambient)``.
+
+    ``power`` is 0-1 and reaches the heater after ``dead_time`` seconds;
+    ``fan_loss`` adds cooling proportional to the part fan speed.
+    """
+
+    def __init__(self, name: str, gain: float, tau: float, dead_time: float, kp: float, ki: float, kd: float,
+                 max_temp: float, fan_loss: float = 0.0):
+        self.name = name
+        self.gain = gain
+        self.tau = tau
+        self.dead_time = dead_time
+        self.kp, self.ki, self.kd = kp, ki, kd
+        self.max_temp = max_temp
+        self.fan_loss = fan_loss
+        self.temperature = AMBIENT
+        self.target = 0.0
+        self.output = 0
+        self._integral = 0.0
+        self._last_error = None
+        self._delay = collections.deque()
+
+    def control(self, dt: float):
+        """Marlin's PID: full power or off outside PID_FUNCTIONAL_RANGE."""
+        if self.target <= 0:
+            self.output = 0
+            self._integral = 0.0
+            return
+        error = self.target - self.temperature
+        if error > PID_FUNCTIONAL_RANGE:
+            self.output = PID_MAX
+            self._integral = 0.0
+        elif error < -PID_FUNCTIONAL_RANGE:
+            self.output = 0
+            self._integral = 0.0
+        else:
+            self._integral += error * dt
+            derivative = 0.0 if self._last_error is None else (error - self._last_error) / dt
+            raw = self.kp * error + self.ki * self._integral + self.kd * derivative
+            if raw > PID_MAX or raw < 0:
+                self._integral -= error * dt
+            self.output = int(max(0, min(PID_MAX, raw)))
+        self._last_error = error
+
+    def step(self, dt: float, fan: float):
+        self._delay.append(self.output / PID_MAX)
+        delayed = self._delay.popleft() if len(self._delay) > max(1, int(self.dead_time / dt)) else 0.0
+        loss = (self.temperature - AMBIENT) * (1 + self.fan_loss * fan)
+        self.temperature += dt * (self.gain * delayed - loss) / self.tau
+
+
+class Autotune:
+    """Port of Marlin's PID_autotune() relay loop for one heater."""
+
+    def __init__(self, marlin, heater: int, target: float, ncycles: int):
+        self.marlin = marlin
+        self.heater = heater
+        self.target = target
+        self.ncycles = ncycles
+        self.bias = self.d = PID_MAX >> 1
+        self.heating = True
+        self.cycles = 0
+        self.t1 = self.t2 = marlin.ms
+        self.t_high = self.t_low = 0
+        self.max = 0.0
+        self.min = 10000.0
+        self.next_report = marlin.ms
+        self.started = marlin.ms
+        self.done = False
+        self.kp = self.ki = self.kd = 0.0
+        marlin.heater(heater).output = self.bias + self.d
+
+    def _emit(self, line: str):
+        self.marlin.emit(line)
+
+    def _finish(self, line: str):
+        self.done = True
+        self.marlin.heater(self.heater).output = 0
+        self.marlin.heater(self.heater).target = 0
+        self._emit(line)
+
+    def update(self):
+        marlin = self.marlin
+        ms = marlin.ms
+        heater = marlin.heater(self.heater)
+        current = heater.temperature
+        self.max = max(self.max, current)
+        self.min = min(self.min, current)
+
+        if self.heating and current > self.target and ms - self.t2 > 5000:
+            self.heating = False
+            heater.output = self.bias - self.d
+            self.t1 = ms
+            self.t_high = self.t1 - self.t2
+            self.max = self.target
+        if not self.heating and current < self.target and ms - self.t1 > 5000:
+            self.heating = True
+            self.t2 = ms
+            self.t_low = self.t2 - self.t1
+            if self.cycles > 0:
+                self.bias += int(self.d * (self.t_high - self.t_low) / (self.t_low + self.t_high))
+                self.bias = max(20, min(PID_MAX - 20, self.bias))
+                self.d = PID_MAX - 1 - self.bias if self.bias > PID_MAX // 2 else self.bias
+                self._emit(" bias: %d d: %d min: %.2f max: %.2f" % (self.bias, self.d, self.min, self.max))
+                if self.cycles > 2:
+                    ku = (4.0 * self.d) / (math.pi * (self.max - self.min) * 0.5)
+                    tu = (self.t_low + self.t_high) * 0.001
+                    self._emit(" Ku: %.2f Tu: %.2f" % (ku, tu))
+                    self.kp = 0.6 * ku
+                    self.ki = 2 * self.kp / tu
+                    self.kd = self.kp * tu * 0.125
+                    self._emit(" Classic PID ")
+                    self._emit(" Kp: %.2f Ki: %.2f Kd: %.2f" % (self.kp, self.ki, self.kd))
+            heater.output = self.bias + self.d
+            self.cycles += 1
+            self.min = self.target
+
+        if ms >= self.next_report:
+            self.next_report = ms + 2000
+            self._emit(marlin.temperature_report(prefix=""))
+        if current > self.target + MAX_OVERSHOOT_PID_AUTOTUNE:
+            self._finish("PID Autotune failed! Temperature too high")
+        elif ms - self.started > 20 * 60 * 1000 and self.cycles < 1:
+            self._finish("PID Autotune failed! timeout")
+        elif self.cycles > self.ncycles and self.cycles > 2:
+            self._finish("PID Autotune finished! Put the last Kp, Ki and Kd constants from below into Configuration.h")
+            prefix = "DEFAULT_bed" if self.heater == -1 else "DEFAULT_"
+            self._emit("#define %sKp %.2f" % (prefix, self.kp))
+            self._emit("#define %sKi %.2f" % (prefix, self.ki))
+            self._emit("#define %sKd %.2f" % (prefix, self.kd))
+
+
+class VirtualMarlin:
+    """Answers G-code like a Marlin printer; lines come out of ``output``.
+
+    While M303 runs, other commands wait for it to end like on the real
+    firmware, except M108 (as with EMERGENCY_PARSER), which aborts it.
+    ``autoreport`` seconds is the M155 temperature auto-report interval.
+    """
+
+    def __init__(self, extruders: int = 1, heated_bed: bool = True, autoreport: float = 1.0, step: float = 0.1):
+        self.ms = 0
+        self.step_ms = int(step * 1000)
+        self.autoreport_ms = int(autoreport * 1000) if autoreport else 0
+        self._next_autoreport = 0
+        self.hotends = [
+            Heater("T%d" % i, gain=300.0 + 15 * i, tau=110.0 + 10 * i, dead_time=6.0 + i, kp=22.2, ki=1.08, kd=114.0,
+                   max_temp=285, fan_loss=0.25)
+            for i in range(extruders)
+        ]
+        self.bed = Heater("B", gain=120.0, tau=420.0, dead_time=15.0, kp=10.0, ki=0.023, kd=305.4, max_temp=125) if heated_bed else None
+        self.fan = 0.0
+        self.output = collections.deque()
+        self.autotune = None
+        self._waiting = collections.deque()
+
+    def heater(self, index: int) -> Heater:
+        return self.bed if index == -1 else self.hotends[index]
+
+    def emit(self, line: str):
+        self.output.append((self.ms, line))
+
+    def temperature_report(self, prefix: str = "ok") -> str:
+        parts = []
+        first = self.hotends[0] if self.hotends else None
+        if first:
+            parts.append("T:%.2f /%.2f" % (first.temperature, first.target))
+        if len(self.hotends) > 1:
+            parts.extend("T%d:%.2f /%.2f" % (i, h.temperature, h.target) for i, h in enumerate(self.hotends))
+        if self.bed:
+            parts.append("B:%.2f /%.2f" % (self.bed.temperature, self.bed.target))
+        if first:
+            parts.append("@:%d" % first.output)
+        if self.bed:
+            parts.append("B@:%d" % self.bed.output)
+        return ("%s " % prefix if prefix else " ") + " ".join(parts)
+
+    def send(self, command: str):
+        command = command.strip()
+        gcode = command.split(None, 1)[0].upper() if command else ""
+        if gcode == "M108":
+            if self.autotune and not self.autotune.done:
+                self.autotune.done = True
+                self.heater(self.autotune.heater).output = 0
+            self.emit("ok")
+            return
+        if self.autotune and not self.autotune.done:
+            self._waiting.append(command)
+            return
+        self._execute(gcode, command)
+
+    def _execute(self, gcode: str, command: str):
+        params = parse_params(command)
+        if gcode == "M105":
+            self.emit(self.temperature_report())
+            return
+        if gcode in ("M104", "M109"):
+            self.heater(int(params.get("T", 0))).target = params.get("S", 0)
+        elif gcode in ("M140", "M190"):
+            if self.bed:
+                self.bed.target = params.get("S", 0)
+        elif gcode == "M106":
+            self.fan = params.get("S", 255) / 255
+        elif gcode == "M107":
+            self.fan = 0.0
+        elif gcode == "M155":
+            self.autoreport_ms = int(params.get("S", 0) * 1000)
+        elif gcode == "M301":
+            heater = self.heater(int(params.get("E", 0)))
+            if "P" in params or "I" in params or "D" in params:
+                heater.kp = params.get("P", heater.kp)
+                heater.ki = params.get("I", heater.ki)
+                heater.kd = params.get("D", heater.kd)
+            else:
+                self.emit("echo: e:%d p:%.2f i:%.2f d:%.2f" % (int(params.get("E", 0)), heater.kp, heater.ki, heater.kd))
+        elif gcode == "M304" and self.bed:
+            if "P" in params or "I" in params or "D" in params:
+                self.bed.kp = params.get("P", self.bed.kp)
+                self.bed.ki = params.get("I", self.bed.ki)
+                self.bed.kd = params.get("D", self.bed.kd)
+            else:
+                self.emit("echo: M304 P%.2f I%.2f D%.2f " % (self.bed.kp, self.bed.ki, self.bed.kd))
+        elif gcode == "M303":
+            heater = int(params.get("E", 0))
+            self.emit("PID Autotune start")
+            self.autotune = Autotune(self, heater, params.get("S", 150 if heater != -1 else 70), int(params.get("C", 5)))
+            return
+        self.emit("ok")
+
+    def advance(self, seconds: float):
+        """Run the simulation for ``seconds`` of printer time."""
+        end = self.ms + int(seconds * 1000)
+        dt = self.step_ms / 1000
+        heaters = self.hotends + ([self.bed] if self.bed else [])
+        while self.ms < end:
+            self.ms += self.step_ms
+            tuning = self.autotune.heater if self.autotune and not self.autotune.done else None
+            for index, heater in zip(list(range(len(self.hotends))) + [-1], heaters):
+                if index != tuning:
+                    heater.control(dt)
+                heater.step(dt, self.fan if index != -1 else 0.0)
+            if tuning is not None:
+                self.autotune.update()
+                if self.autotune.done:
+                    self.emit("ok")
+            elif self._waiting:
+                while self._waiting and not (self.autotune and not self.autotune.done):
+                    command = self._waiting.popleft()
+                    self.send(command)
+            # M303 prints its own temperature lines
+            if self.autoreport_ms and tuning is None and self.ms >= self._next_autoreport:
+                self._next_autoreport = self.ms + self.autoreport_ms
+                self.emit(self.temperature_report(prefix=""))
+
+    def read(self) -> list:
+        """(printer ms, line) of everything printed since the last read."""
+        lines = list(self.output)
+        self.output.clear()
+        return lines
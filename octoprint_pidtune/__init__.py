@@ -3,7 +3,10 @@ from __future__ import absolute_import
 
 import json
 import logging
+import math
+import os
 import re
+import time
 import traceback
 from datetime import datetime
 from typing import Optional
@@ -13,22 +16,32 @@ import octoprint.plugin
 import octoprint.settings
 from octoprint.events import Events
 from octoprint.logging.handlers import CleaningTimedRotatingFileHandler
-from octoprint.util.json import JsonEncoding
-
-
-from octoprint_pidtune.parser import Parser
-from octoprint_pidtune.plugin_callbacks import PrinterDataCallBack
+from octoprint.util import RepeatedTimer
+
+
+from octoprint_pidtune.history import ROLLUP_TIERS, HistoryStore, HistoryView, RollupSeries
+from octoprint_pidtune.identify import identify, marlin_gains, pid_command
+from octoprint_pidtune.ingest import LINE_RECEIVED, LINE_SENT, IngestionQueue
+from octoprint_pidtune.logs import log_level, queue_logging, stop_queue_logging
+from octoprint_pidtune.metrics import Metrics, prometheus_text, timed
+from octoprint_pidtune.parser import TUNE_PARAM, TUNE_RESULT, TUNE_STAT, Parser
+from octoprint_pidtune.responses import bad_request, is_not_modified, json_response, make_etag, not_modified
+from octoprint_pidtune.relay import RelayAutotune, RelayTuner
+from octoprint_pidtune.scheduler import AutotuneJob, AutotuneScheduler
+from octoprint_pidtune.plugin_callbacks import PrinterDataCallBack, thaw
+from octoprint_pidtune.sessions import SessionRecorder, SessionReplay, parse_m303
+from octoprint_pidtune.storage import KIND_ACTUAL, KIND_TARGET, SegmentStore, series_id
 from octoprint_pidtune.utils import PidTuneUtils
+from octoprint_pidtune.wire import FORMAT_B64, FORMAT_JSON, encode_columns, encode_points
 
 pidtune_plugin_name = "pidtune"
 
-
-def unfreeze(frozen) -> dict:
-    return json.loads(
-        json.dumps(frozen, default=JsonEncoding.encode, allow_nan=False).replace(
-            "</", "<\\/"
-        )
-    )
+_RE_COMMAND = re.compile(Parser.regex_command)
+_RE_LOAD_TOOL_PID = re.compile(Parser.reLoadToolPid)
+_RE_FAN_SPEED_CMD = re.compile(r"M106\s+(P(?P<index>\d*)\s+)?S(?P<value>\d*)")
+_RE_TOOL_KEY = re.compile(r"^(tool)(?P<tool_index>\d+)")
+# tags of the commands the plugin sends itself, seen again in the sent hook
+COMMAND_TAGS = frozenset(("source:plugin", "plugin:pidtune"))
 
 
 class PidtunePlugin(
@@ -60,15 +73,12 @@ class PidtunePlugin(
 
         self.collecting_data: bool = False
 
-        self.act_temps = None
-        self.target_temps = None
-
-        self.min_temp = {}
-        self.max_temp = {}
-        self.max_target_temp = {}
+        self.metrics = Metrics()
+        self.history = HistoryStore()
+        self.segment_store: Optional[SegmentStore] = None
+        self.sessions: Optional[SessionRecorder] = None
+        self._replay: Optional[SessionReplay] = None
 
-        self.max_fan_speed = 0
-        self.fans_speeds = None
         self.fans_values: Optional[dict] = {}
 
         self.has_heatedbed: bool = False
@@ -76,6 +86,7 @@ class PidtunePlugin(
         self.tempControllers = {}
 
         self._parser: Optional[Parser] = None
+        self._ingest: Optional[IngestionQueue] = None
 
         self._printer_locked: bool = False
         self.isError: bool = False
@@ -95,6 +106,19 @@ class PidtunePlugin(
 
         self.h_tm: int = 284
         self.b_tm: int = 110
+        self.relay_hysteresis: float = 1.0
+        self.early_stop: bool = False
+        self.early_stop_tolerance: float = 0.05
+        self.early_stop_cycles: int = 3
+        self.early_stop_apply: bool = False
+        self._relay: Optional[RelayAutotune] = None
+        self._scheduler: Optional[AutotuneScheduler] = None
+        # whether the running M303 was sent by the plugin, only those are stopped early
+        self._own_autotune = False
+
+        self.stream_interval: float = 1.0
+        self._stream_timer: Optional[RepeatedTimer] = None
+        self._stream_cursor: dict = {}
 
         self.setting_defaut = dict(
             discord=dict(
@@ -105,7 +129,18 @@ class PidtunePlugin(
             ),
             temperature_cutoff=30,
             h_tm=284,
-            b_tm=110
+            b_tm=110,
+            relay_hysteresis=1.0,
+            early_stop=False,
+            early_stop_tolerance=5.0,
+            early_stop_cycles=3,
+            early_stop_apply=False,
+            stream_interval=1.0,
+            persist_history=True,
+            history_retention_days=7,
+            history_memory_mb=8,
+            metrics_enabled=False,
+            log_level="INFO"
         )
 
         self.logger = self._logger
@@ -118,7 +153,14 @@ class PidtunePlugin(
         else:
             if not self.plugin_name:
                 self.plugin_name = "pidtune"
-        self.logger = logging.getLogger("octoprint.plugins.%s" % self.plugin_name)
+        self.logger = queue_logging(
+            logging.getLogger("octoprint.plugins.%s" % self.plugin_name),
+            self._debug_log_handler,
+            log_level(self._settings.get(["log_level"]))
+        )
+        return self.logger
+
+    def _debug_log_handler(self) -> logging.Handler:
         hdlr = CleaningTimedRotatingFileHandler(
             self._settings.get_plugin_logfile_path(postfix="debug"),
             when="D",
@@ -126,12 +168,7 @@ class PidtunePlugin(
         )
         formater = logging.Formatter("[%(asctime)s] %(levelname)s: %(message)s")
         hdlr.setFormatter(formater)
-        self.logger.addHandler(hdlr)
-        self.logger.setLevel(
-            logging.DEBUG
-        )
-        self.logger.propagate = False
-        return self.logger
+        return hdlr
 
     def get_template_configs(self):
         return [
@@ -157,7 +194,7 @@ class PidtunePlugin(
             temp_dict = {}
             self.has_heatedbed = self.printer_profile["heatedBed"]
             self.hotend_count = self.printer_profile["extruder"]["count"]
-            self._parser = Parser(self.logger, self.has_heatedbed, self.hotend_count)
+            self._parser = Parser(self.logger, self.has_heatedbed, self.hotend_count, self.metrics)
             self.getCurrentSettings()
             if self.hotend_count > 0:
                 for extruder in range(0, self.hotend_count):
@@ -165,13 +202,8 @@ class PidtunePlugin(
             if self.has_heatedbed:
                 temp_dict.update({-1: "Bed"})
             self.tempControllers = temp_dict
-            self.act_temps = {}
-            self.target_temps = {}
-            self.fans_speeds = {}
-            for t in temp_dict:
-                self.act_temps.update({t: []})
-                self.target_temps.update({t: []})
-            self.fans_values = {0: 0}
+            self.history.reset(temp_dict)
+            self.set_fans_values({0: 0})
 
     def get_setting(self, setting_k):
         return octoprint.settings.settings().get(["discordbot", setting_k])
@@ -201,6 +233,7 @@ class PidtunePlugin(
             "pid_autotune"           : ["data"],
             "update"                 : ["data"],
             "getpid"                 : ["tool"],
+            "pid_snapshot"           : [],
             "loadbackup"             : ["bckp_file"],
             "getbackup"              : ["bckp_file"],
             "printer_profile_updated": [],
@@ -208,7 +241,24 @@ class PidtunePlugin(
             "process_logs_data"      : ["data"],
             "process_temp_data"      : [],
             "process_data"           : [],
-            "getbackuplist"          : []
+            "getbackuplist"          : [],
+            "parser_stats"           : [],
+            "history_stats"          : [],
+            "stats"                  : [],
+            "history_range"          : ["data"],
+            "identify"               : ["data"],
+            "relay_autotune"         : ["data"],
+            "queue_autotune"         : ["data"],
+            "cancel_autotune_queue"  : [],
+            "autotune_queue"         : [],
+            "stop_relay_autotune"    : [],
+            "sessions"               : [],
+            "session"                : ["data"],
+            "replay_session"         : ["data"],
+            "stop_replay"            : [],
+            "reset_stats"            : [],
+            "ingest_stats"           : [],
+            "metrics"                : []
         }
 
     def get_settings_defaults(self):
@@ -219,7 +269,7 @@ class PidtunePlugin(
         return False
 
     def on_event(self, event, payload):
-        self.logger.debug("event", event, payload)
+        self.logger.debug("Event %s: %s", event, payload)
         try:
             if event == Events.PRINTER_STATE_CHANGED:
                 self.logger.debug("payload")
@@ -249,21 +299,19 @@ class PidtunePlugin(
             settings[index] = self._settings.get([index])
             self.logger.debug("Settings for {}: {}".format(index, settings[index]))
 
-        self._parser = Parser(self.logger, self.has_heatedbed, self.hotend_count)
-
-        self._js_logger = logging.getLogger("octoprint.JsFrontendErrors(PIDTune)")
-        hdlr = CleaningTimedRotatingFileHandler(
-            self._settings.get_plugin_logfile_path(postfix="debug"),
-            when="D",
-            backupCount=3,
-        )
-        formater = logging.Formatter("[%(asctime)s] %(levelname)s: %(message)s")
-        hdlr.setFormatter(formater)
-        self._js_logger.addHandler(hdlr)
-        self._js_logger.setLevel(
+        self._parser = Parser(self.logger, self.has_heatedbed, self.hotend_count, self.metrics)
+        if not self._ingest:
+            self._ingest = IngestionQueue(self.logger, self.process_ingested_line)
+        self._ingest.start()
+        self.start_history_stream()
+        self.start_segment_store()
+        self.start_session_recorder()
+
+        self._js_logger = queue_logging(
+            logging.getLogger("octoprint.JsFrontendErrors(PIDTune)"),
+            self._debug_log_handler,
             logging.DEBUG
         )
-        self._js_logger.propagate = False
         self._js_logger.info("Js Logger (PIDTune) started")
         self.logger.debug("JS Logger started")
 
@@ -272,24 +320,37 @@ class PidtunePlugin(
         self.started = True
 
     def on_shutdown(self):
+        self.stop_autotunes("OctoPrint is shutting down")
+        if self._ingest:
+            self._ingest.stop()
+        self.stop_history_stream()
+        if self._replay:
+            self._replay.stop()
+        if self.segment_store:
+            self.segment_store.stop()
         self.logger.info("PIDTune plugin stopped")
         self.logger.info("=========================")
-    def get_min_max_tools_value(self):
-        max_temp = 0.0
-        for _, temp in self.max_temp.items():
-            if max_temp == 0 or temp > max_temp:
-                max_temp = temp
-
-        max_t_temp = 0.0
-        for _, t_temp in self.max_target_temp.items():
-            if max_t_temp == 0 or t_temp > max_t_temp:
-                max_t_temp = t_temp
+        stop_queue_logging()
 
-        for _, speed in self.fans_values.items():
-            if self.max_fan_speed == 0 or int(speed) > self.max_fan_speed:
-                self.max_fan_speed = int(speed)
+    def get_min_max_tools_value(self, tier: Optional[int] = None):
+        return self.history.view().max_value(tier)
 
-        return max([max_temp, max_t_temp, self.max_fan_speed])
+    @staticmethod
+    def _number_field(query: dict, key: str, cast=float, default=None, minimum: Optional[float] = None):
+        """``query[key]`` as a finite ``cast`` number, ``default`` when missing or empty.
+
+        Raises ValueError naming the field otherwise, for a 400 response.
+        """
+        value = query.get(key)
+        if value is None or value == "":
+            return default
+        try:
+            number = cast(value)
+        except (ValueError, TypeError, OverflowError):
+            raise ValueError("Invalid {}: {!r}".format(key, value))
+        if isinstance(value, bool) or not math.isfinite(number) or (minimum is not None and number < minimum):
+            raise ValueError("Invalid {}: {!r}".format(key, value))
+        return number
 
     def on_api_command(self, command, data):
         if command == "js_error":
@@ -311,6 +372,47 @@ class PidtunePlugin(
             else:
                 return flask.jsonify({"success": False, "error": '{"data": "error"}'})
 
+        """Queue firmware autotunes of several heaters"""
+        if command == "queue_autotune":
+            jobs = data["data"].get("jobs") if isinstance(data["data"], dict) else None
+            if not jobs:
+                return flask.jsonify({"success": False, "error": "No autotune job."})
+            try:
+                self.start_autotune_queue(jobs)
+            except (ValueError, TypeError, KeyError) as ex:
+                return flask.jsonify({"success": False, "error": str(ex)})
+            return flask.jsonify({"success": True, "data": json.dumps(self._scheduler.summary())})
+
+        """Cancel the autotune queue"""
+        if command == "cancel_autotune_queue":
+            if self._scheduler and not self._scheduler.done:
+                self._scheduler.cancel()
+                self.send_message("autotune_queue", self._scheduler.summary())
+            return flask.jsonify({"success": True, "data": json.dumps({})})
+
+        """Get the autotune queue progress"""
+        if command == "autotune_queue":
+            summary = self._scheduler.summary() if self._scheduler else None
+            return flask.jsonify({"success": True, "data": json.dumps(summary)})
+
+        """Relay autotune of several heaters at once"""
+        if command == "relay_autotune":
+            jobs = data["data"].get("heaters") if isinstance(data["data"], dict) else None
+            if not jobs:
+                return flask.jsonify({"success": False, "error": "No heater to tune."})
+            try:
+                self.start_relay_autotune(jobs)
+            except (ValueError, TypeError, KeyError) as ex:
+                return flask.jsonify({"success": False, "error": str(ex)})
+            return flask.jsonify({"success": True, "data": json.dumps(self._relay.summary())})
+
+        """Stop the running relay autotune and switch its heaters off"""
+        if command == "stop_relay_autotune":
+            if self._relay:
+                self._printer.commands(self._relay.stop("Stopped by user"))
+                self.send_message("relay", self._relay.summary())
+            return flask.jsonify({"success": True, "data": json.dumps({})})
+
         """Update current printer profile"""
         if command == "printer_profile_updated":
             self.get_printer_profile()
@@ -320,11 +422,36 @@ class PidtunePlugin(
 
         """Get data for graph update"""
         if command == "update":
-            data_tsd = self.updateplot()
+            cursor = None
+            points = 0
+            fmt = FORMAT_JSON
+            span = 0
+            if isinstance(data.get("data"), dict):
+                cursor = data["data"].get("cursor")
+                fmt = data["data"].get("format") or FORMAT_JSON
+                try:
+                    points = self._number_field(data["data"], "points", int, 0, minimum=0)
+                    span = self._number_field(data["data"], "span", float, 0, minimum=0)
+                except ValueError as ex:
+                    return bad_request(str(ex))
+                if cursor is not None and not isinstance(cursor, dict):
+                    return bad_request("Invalid cursor: {!r}".format(cursor))
+                if fmt not in (FORMAT_JSON, FORMAT_B64):
+                    return bad_request("Invalid format: {!r}".format(fmt))
+            history = self.history.view()
+            etag = make_etag(
+                "update", history.version(), sorted(self.tempControllers.items()), cursor, points, fmt, span
+            )
+            if is_not_modified(flask.request, etag):
+                return not_modified(etag)
+            data_tsd = self.updateplot(cursor, points, fmt, span, history)
             if data_tsd:
-                tp_dt = { "data": data_tsd }
+                tp_dt = self._history_payload(data_tsd, history.tier_for(span), history)
+                if fmt == FORMAT_B64:
+                    # already compact, sent as an object rather than a JSON string
+                    return json_response(flask.request, {"success": True, "data": tp_dt}, etag)
                 dtf = json.dumps(tp_dt)
-                return flask.jsonify({"success": True, "data": dtf})
+                return json_response(flask.request, {"success": True, "data": dtf}, etag)
             return flask.jsonify({"success": False, "error": "no actual temp."})
 
         """Process full data for debuging"""
@@ -351,8 +478,136 @@ class PidtunePlugin(
             dtf = json.dumps(data)
             return flask.jsonify({"success": True, "data": dtf})
 
+        """Get every heater's PID data, to resync after a missed piddata delta"""
+        if command == "pid_snapshot":
+            if self._parser:
+                return flask.jsonify({"success": True, "data": json.dumps(self._parser.get_pids_snapshot())})
+            return flask.jsonify({"success": False, "error": "Parser is none."})
+
+        """Get line classifier counters"""
+        if command == "parser_stats":
+            if self._parser:
+                return flask.jsonify({"success": True, "data": json.dumps(self._parser.classifier.stats())})
+            return flask.jsonify({"success": False, "error": "Parser is none."})
+
+        """Get graph history memory usage"""
+        if command == "history_stats":
+            return flask.jsonify({"success": True, "data": json.dumps(self.history.view().memory_usage())})
+
+        """Query the persisted history beyond the in-memory window"""
+        if command == "history_range":
+            if not self.segment_store:
+                return flask.jsonify({"success": False, "error": "History persistence is disabled."})
+            query = data["data"] if isinstance(data["data"], dict) else {}
+            try:
+                end = self._number_field(query, "end", float, datetime.now().timestamp() * 1000)
+                start = self._number_field(query, "start", float, end - 24 * 3600 * 1000)
+                points = self._number_field(query, "points", int, 0, minimum=0)
+            except ValueError as ex:
+                return bad_request(str(ex))
+            series = query.get("series")
+            if series is not None and not (isinstance(series, list) and all(isinstance(s, str) for s in series)):
+                return bad_request("Invalid series: {!r}".format(series))
+            result = self.segment_store.query(start, end, series, points)
+            return flask.jsonify({"success": True, "data": json.dumps({"start": start, "end": end, "series": result})})
+
+        """Fit a process model to a recorded heat-up and compute gains from it"""
+        if command == "identify":
+            query = data["data"] if isinstance(data["data"], dict) else {}
+            try:
+                heater = self._number_field(query, "heater", int, 0)
+                start = self._number_field(query, "start")
+                end = self._number_field(query, "end")
+                power = self._number_field(query, "power", float, 1.0, minimum=0)
+            except ValueError as ex:
+                return bad_request(str(ex))
+            try:
+                actual, target = self._heater_history(heater, start, end)
+                result = identify(
+                    [p[0] for p in actual], [p[1] for p in actual],
+                    [p[0] for p in target], [p[1] for p in target],
+                    power, start, end
+                )
+            except (ValueError, TypeError) as ex:
+                return flask.jsonify({"success": False, "error": str(ex)})
+            result["heater"] = heater
+            return flask.jsonify({"success": True, "data": json.dumps(result)})
+
+        """List recorded autotune sessions"""
+        if command == "sessions":
+            if not self.sessions:
+                return flask.jsonify({"success": False, "error": "Session recorder is none."})
+            return flask.jsonify({"success": True, "data": json.dumps(self.sessions.list())})
+
+        """Get one recorded autotune session"""
+        if command == "session":
+            session = self.sessions.load(str(data["data"].get("id"))) if self.sessions and isinstance(data["data"], dict) else None
+            if session:
+                return flask.jsonify({"success": True, "data": json.dumps(session)})
+            return flask.jsonify({"success": False, "error": "Session not found."})
+
+        """Replay a recorded autotune session faster than real time"""
+        if command == "replay_session":
+            session = self.sessions.load(str(data["data"].get("id"))) if self.sessions and isinstance(data["data"], dict) else None
+            if not session:
+                return flask.jsonify({"success": False, "error": "Session not found."})
+            try:
+                speed = self._number_field(data["data"], "speed", float, 20.0, minimum=0)
+            except ValueError as ex:
+                return bad_request(str(ex))
+            self.start_replay(session, speed or 20.0)
+            return flask.jsonify({"success": True, "data": json.dumps({"id": session["id"]})})
+
+        """Stop the running replay"""
+        if command == "stop_replay":
+            if self._replay:
+                self._replay.stop()
+            return flask.jsonify({"success": True, "data": json.dumps({})})
+
+        """Get windowed temperature statistics per heater"""
+        if command == "stats":
+            return flask.jsonify({"success": True, "data": json.dumps(self.history.view().stats_summary())})
+
+        """Restart the statistics windows"""
+        if command == "reset_stats":
+            self.history.reset_stats()
+            return flask.jsonify({"success": True, "data": json.dumps(self.history.view().stats_summary())})
+
+        """Get hot path timers and counters (timers need the metrics setting)"""
+        if command == "metrics":
+            return flask.jsonify({"success": True, "data": json.dumps(dict(self.metrics.summary(), **self.metrics_gauges()))})
+
+        """Get ingestion queue counters"""
+        if command == "ingest_stats":
+            if self._ingest:
+                return flask.jsonify({"success": True, "data": json.dumps(self._ingest.stats())})
+            return flask.jsonify({"success": False, "error": "Ingestion queue is none."})
+
+    def metrics_gauges(self) -> dict:
+        gauges = {"history": self.history.view().memory_usage(), "metrics_enabled": self.metrics.enabled}
+        if self._parser:
+            gauges["parser"] = self._parser.classifier.stats()
+        if self._ingest:
+            gauges["ingest"] = self._ingest.stats()
+        return gauges
+
+    @octoprint.plugin.BlueprintPlugin.route("/metrics", methods=["GET"])
+    def prometheus_metrics(self):
+        """Hot path timers and counters in the Prometheus text format"""
+        return flask.Response(
+            prometheus_text(self.metrics.summary(), self.metrics_gauges()),
+            mimetype="text/plain; version=0.0.4"
+        )
+
     def on_api_get(self, request):
-        return flask.jsonify(self._parser.get_pids_data())  # TODO
+        if not self._parser:
+            return flask.jsonify(None)
+        etag = make_etag("pids", id(self._parser), self._parser.pids_version)
+        if is_not_modified(request, etag):
+            return not_modified(etag)
+        # data and version read together, the version may have moved since
+        snapshot = self._parser.get_pids_snapshot()
+        return json_response(request, snapshot["piddata"], make_etag("pids", id(self._parser), snapshot["version"]))
 
     def on_settings_save(self, data):
         octoprint.plugin.SettingsPlugin.on_settings_save(self, data)
@@ -366,52 +621,290 @@ class PidtunePlugin(
         btm = self.get_settings().get(['b_tm'])
 
         self.temperature_cutoff = int(tco) if tco else 0
+        self.history.set_window(self.temperature_cutoff * 60 * 1000)
+        hmm = self.get_settings().get_float(['history_memory_mb'])
+        self.history.memory_budget = int(hmm * 1024 * 1024) if hmm and hmm > 0 else 0
         self.h_tm = int(htm) if htm else 0
         self.b_tm = int(btm) if btm else 0
+        rhy = self.get_settings().get_float(['relay_hysteresis'])
+        self.relay_hysteresis = rhy if rhy and rhy > 0 else 1.0
+        self.early_stop = self.get_settings().get_boolean(['early_stop'])
+        est = self.get_settings().get_float(['early_stop_tolerance'])
+        self.early_stop_tolerance = est / 100 if est and est > 0 else 0.05
+        esc = self.get_settings().get_int(['early_stop_cycles'])
+        self.early_stop_cycles = esc if esc and esc >= 2 else 3
+        self.early_stop_apply = self.get_settings().get_boolean(['early_stop_apply'])
+
+        sti = self.get_settings().get_float(['stream_interval'])
+        self.stream_interval = sti if sti and sti > 0 else 1.0
+        self.metrics.enabled = self.get_settings().get_boolean(['metrics_enabled'])
+        self.logger.setLevel(log_level(self.get_settings().get(['log_level'])))
 
-    def updateplot(self):
-        datat = []
-        for tool in self.tempControllers:
+    @staticmethod
+    def _plot_series(series_id: str, label: str, color: str, series, since: dict, points: int = 0,
+                     fmt: str = FORMAT_JSON) -> dict:
+        plot_series = {
+            "id"      : series_id,
+            "label"   : label,
+            "color"   : color,
+            "first"   : 0,
+            "start"   : 0,
+            "next"    : 0,
+            "min_time": 0,
+            "replace" : False,
+            "data"    : []
+        }
+        if series is None:
+            return plot_series
+        cursor = since.get(series_id, 0)
+        first = series.first()
+        plot_series.update(
+            first=series.first_seq,
+            start=series.start_seq(cursor),
+            next=series.next_seq,
+            min_time=int(first[0]) if first else 0
+        )
+        tail = series.tail()
+        if tail:
+            plot_series["tail"] = tail
+        if points and cursor <= series.first_seq and len(series) > points:
+            plot_series["replace"] = True
+            if fmt == FORMAT_B64:
+                plot_series.update(data=None, enc=encode_points(series.downsampled(points)))
+            else:
+                plot_series["data"] = series.downsampled(points)
+        elif fmt == FORMAT_B64:
+            plot_series.update(data=None, enc=encode_columns(*series.columns(cursor)))
+        else:
+            plot_series["data"] = series.points(cursor)
+        return plot_series
 
-            if self.act_temps[tool] and (len(self.act_temps[tool]) > 0):
-                self.act_temps[tool].sort()
-                actual_temp = self.utils.format_temp_value(self.act_temps[tool][len(self.act_temps[tool]) - 1][1])
+    @staticmethod
+    def _tier_series(series_id: str, label: str, color: str, rollup: Optional[RollupSeries], start_time: float,
+                     points: int = 0, fmt: str = FORMAT_JSON) -> dict:
+        """``_plot_series`` of a rollup tier, always whole from ``start_time`` on."""
+        plot_series = {
+            "id"      : series_id,
+            "label"   : label,
+            "color"   : color,
+            "first"   : 0,
+            "start"   : 0,
+            "next"    : 0,
+            "min_time": int(start_time),
+            "replace" : True,
+            "data"    : []
+        }
+        if rollup is None:
+            return plot_series
+        first = rollup.seq_at(start_time)
+        plot_series.update(first=first, start=first, next=rollup.next_seq)
+        tail = rollup.tail()
+        if tail:
+            plot_series["tail"] = tail
+        data = rollup.downsampled(points, first) if points else rollup.points(first)
+        if fmt == FORMAT_B64:
+            plot_series.update(data=None, enc=encode_points(data))
+        else:
+            plot_series["data"] = data
+        return plot_series
+
+    @timed("updateplot")
+    def updateplot(self, cursor: Optional[dict] = None, points: int = 0, fmt: str = FORMAT_JSON, span: float = 0,
+                   history: Optional[HistoryView] = None):
+        """Build the graph series.
+
+        With a ``cursor`` ({"epoch": ..., "tier": ..., "series": {id: next_seq}})
+        from the same history epoch and tier, each series only carries the samples added since
+        that sequence number, along with the time of its oldest retained
+        sample so the client can drop evicted points. A full series longer
+        than ``points`` is downsampled and flagged ``replace``. With ``fmt``
+        "b64" the samples are in ``enc`` (see wire.encode_columns) instead
+        of ``data``.
+
+        A ``span`` (ms) longer than the raw window is served whole from the
+        matching rollup tier (see HistoryStore.tier_for) instead. Reads the
+        last published ``history`` view unless one is given.
+        """
+        history = history or self.history.view()
+        return self._build_plot(history, self.tempControllers, cursor, points, fmt, span)
+
+    def _build_plot(self, history: HistoryView, controllers: dict,
+                    cursor: Optional[dict] = None, points: int = 0, fmt: str = FORMAT_JSON, span: float = 0) -> list:
+        since = {}
+        tier = history.tier_for(span)
+        tier_name = ROLLUP_TIERS[tier][0] if tier is not None else None
+        # sequence numbers of another tier say nothing about this one, the client gets it whole
+        if cursor and cursor.get("epoch") == history.epoch and cursor.get("tier") == tier_name:
+            since = cursor.get("series") or {}
+        start_time = time.time() * 1000 - span
+
+        def plot_series(name, key, raw, series_id, label, color):
+            if tier is None:
+                return self._plot_series(series_id, label, color, raw, since, points, fmt)
+            return self._tier_series(series_id, label, color, history.rollup(name, key, tier), start_time, points, fmt)
+
+        datat = []
+        for tool in controllers:
+            act_series = history.actual.get(tool)
+            if act_series is not None and len(act_series) > 0:
+                actual_temp = self.utils.format_temp_value(act_series.last()[1])
             else:
                 return datat
 
             current_target_temp = "-"
-            if self.target_temps[tool] and (len(self.target_temps[tool]) > 0):
-                self.target_temps[tool].sort()
-                current_target_temp = self.utils.format_temp_value(self.target_temps[tool][len(self.target_temps[tool]) - 1][1])
-
-            datat.append(
-                {
-                    "label": "%s Actual: %s" % (self.tempControllers[tool], str(actual_temp)),
-                    "color": self.graphColors[tool],
-                    "data" : self.act_temps[tool]
-                }
-            )
+            tgt_series = history.target.get(tool)
+            if tgt_series is not None and len(tgt_series) > 0:
+                current_target_temp = self.utils.format_temp_value(tgt_series.last()[1])
+
+            datat.append(plot_series(
+                "actual", tool, act_series,
+                "actual:%s" % tool,
+                "%s Actual: %s" % (controllers[tool], str(actual_temp)),
+                self.graphColors[tool]
+            ))
+            datat.append(plot_series(
+                "target", tool, tgt_series,
+                "target:%s" % tool,
+                "%s Target: %s" % (controllers[tool], str(current_target_temp)),
+                self.tg_graphColors[tool]
+            ))
+        for f_idx in history.fan_speeds:
+            fan_series = history.fans.get(f_idx)
+            if fan_series is not None and len(fan_series) > 0:
+                actual_fan_speed = fan_series.last()[1]
+                datat.append(plot_series(
+                    "fan", f_idx, fan_series,
+                    "fan:%s" % f_idx,
+                    "Fan%s : %s%%" % (str(f_idx), str(actual_fan_speed)),
+                    self.fan_graphColors[f_idx]
+                ))
+        return datat
 
-            datat.append(
-                {
-                    "label": "%s Target: %s" % (self.tempControllers[tool], str(current_target_temp)),
-                    "color": self.tg_graphColors[tool],
-                    "data" : self.target_temps[tool]
-                }
+    def start_segment_store(self):
+        if self.segment_store or not self._settings.get_boolean(["persist_history"]):
+            return
+        retention = self._settings.get_float(["history_retention_days"])
+        try:
+            self.segment_store = SegmentStore(
+                os.path.join(self.get_plugin_data_folder(), "history"),
+                self.logger,
+                retention_days=retention if retention and retention > 0 else 7
             )
-        for f_idx, _ in self.fans_values.items():
-            if self.fans_speeds[f_idx] and (len(self.fans_speeds[f_idx]) > 0):
-                self.fans_speeds[f_idx].sort()
-                actual_fan_speed = self.fans_speeds[f_idx][len(self.fans_speeds[f_idx]) - 1][1]
-                datat.append(
-                    {
-                        "label": "Fan%s : %s%%" % (str(f_idx), str(actual_fan_speed)),
-                        "color": self.fan_graphColors[f_idx],
-                        "data" : self.fans_speeds[f_idx]
-                    }
-                )
-        return datat
+        except (IOError, OSError):
+            self.logger.exception("Could not open the history folder, history won't be persisted")
+            return
+        self.history.sink = self.segment_store.record
+        self.segment_store.start_maintenance()
+
+    def _heater_history(self, heater: int, start: Optional[float] = None, end: Optional[float] = None) -> tuple:
+        """Actual and target [time, value] points of a heater.
+
+        Ranges starting before the in-memory window are read from the
+        persisted history, with a minute of margin for the initial temperature.
+        """
+        history = self.history.view()
+        actual = history.actual.get(heater)
+        target = history.target.get(heater)
+        first = actual.first() if actual is not None else None
+        if self.segment_store and start is not None and (first is None or first[0] > start):
+            act_id, tgt_id = series_id(KIND_ACTUAL, heater), series_id(KIND_TARGET, heater)
+            series = self.segment_store.query(start - 60 * 1000, end or datetime.now().timestamp() * 1000, [act_id, tgt_id])
+            return series.get(act_id, []), series.get(tgt_id, [])
+        if actual is None or target is None:
+            return [], []
+        return actual.points(), target.points()
+
+    def start_session_recorder(self):
+        if self.sessions:
+            return
+        try:
+            self.sessions = SessionRecorder(
+                os.path.join(self.get_plugin_data_folder(), "sessions"),
+                self.logger,
+                on_saved=lambda session: self.send_message("session_saved", {"id": session["id"]})
+            )
+        except (IOError, OSError):
+            self.logger.exception("Could not open the sessions folder, autotune sessions won't be recorded")
+
+    def start_replay(self, session: dict, speed: float):
+        if self._replay:
+            self._replay.stop()
+        self._replay = SessionReplay(
+            session,
+            Parser(self.logger, self.has_heatedbed, self.hotend_count),
+            lambda history, parser, progress, done: self._send_replay_frame(session, history, parser, progress, done),
+            speed=speed
+        )
+        self._replay.start()
+
+    def _send_replay_frame(self, session: dict, history: HistoryStore, parser: Parser, progress: float, done: bool):
+        heater = session["heater"]
+        name = self.tempControllers.get(heater) or ("Bed" if heater == -1 else "Tool%d" % heater)
+        self.send_message("replay", {
+            "id"      : session["id"],
+            "heater"  : heater,
+            "progress": progress,
+            "done"    : done,
+            "data"    : self._build_plot(history, {heater: name}, points=600),
+            "max"     : history.max_value(),
+            "piddata" : parser.get_pids_data()
+        })
+
+    def start_history_stream(self):
+        if self._stream_timer:
+            return
+        history = self.history.view()
+        self._stream_cursor = self._history_cursor(self.updateplot(history=history), history)
+        self._stream_timer = RepeatedTimer(lambda: self.stream_interval, self.stream_history, daemon=True)
+        self._stream_timer.start()
+
+    def stop_history_stream(self):
+        if self._stream_timer:
+            self._stream_timer.cancel()
+            self._stream_timer = None
+
+    def _history_payload(self, plot_series: list, tier: Optional[int] = None,
+                         history: Optional[HistoryView] = None) -> dict:
+        history = history or self.history.view()
+        return {
+            "epoch": history.epoch,
+            "tier" : ROLLUP_TIERS[tier][0] if tier is not None else None,
+            "data" : plot_series,
+            "stats": history.stats_summary(),
+            "max"  : history.max_value(tier)
+        }
+
+    def _history_cursor(self, plot_series: list, history: HistoryView) -> dict:
+        return {
+            "epoch" : history.epoch,
+            "tier"  : None,
+            "series": {s["id"]: s["next"] for s in plot_series}
+        }
+
+    def stream_history(self):
+        """Broadcast, once per interval, the samples added since the last broadcast.
+
+        Clients merge these deltas into their local series and only fall back
+        to the update command when they detect a gap.
+        """
+        try:
+            if self.sessions:
+                self.sessions.close_if_due(time.time() * 1000)
+            history = self.history.view()
+            plot_series = self.updateplot(self._stream_cursor, history=history)
+            if not plot_series:
+                return
+            cursor = self._history_cursor(plot_series, history)
+            if cursor == self._stream_cursor:
+                return
+            self._stream_cursor = cursor
+            self.send_message("history", self._history_payload(plot_series, history=history))
+        except Exception as ex:
+            self.logger.error("stream_history")
+            self.logger.error(ex)
+            self.logger.error(traceback.format_exc())
 
+    @timed("process_current_data")
     def process_current_data(self, data):
         self.process_temp_data(data)
         self.process_state_data(data)
@@ -496,6 +989,7 @@ class PidtunePlugin(
         self.logger.debug(data["temperature_cutoff"])
         self.temperature_cutoff = data["temperature_cutoff"]"""
 
+    @timed("process_temp_data")
     def process_temp_data(self, data):
         if self.started:
             if not self.printer_profile:
@@ -509,64 +1003,34 @@ class PidtunePlugin(
                         tool_index = None
                         for k, v in x.items():
                             if k != "time":
-                                logmatch = re.compile("^(tool)(?P<tool_index>\d+)").match(k)
+                                logmatch = _RE_TOOL_KEY.match(k)
                                 if logmatch:
                                     tool_index = int(logmatch.group("tool_index"))
 
-                                logmatch2 = re.compile("^(bed)").match(k)
+                                logmatch2 = k.startswith("bed")
                                 if logmatch2:
                                     tool_index = -1
 
                                 if logmatch2 or logmatch:
-                                    obj_actual = [time_, v["actual"]]
-                                    obj_target = [time_, v["target"]]
-
-                                    if len(self.act_temps[tool_index]) > 0:
-                                        if (client_time - (int(self.act_temps[tool_index][0][0]) / 1000)) >= (self.temperature_cutoff * 60):
-                                            self.act_temps[tool_index] = self.utils.shift(self.act_temps[tool_index])
-                                    if len(self.target_temps[tool_index]) > 0:
-                                        if (client_time - (int(self.target_temps[tool_index][0][0]) / 1000)) >= (self.temperature_cutoff * 60):
-                                            self.target_temps[tool_index] = self.utils.shift(self.target_temps[tool_index])
-
-                                    if obj_actual not in self.act_temps[tool_index]:
-                                        self.act_temps[tool_index].append(obj_actual)
-                                    if obj_target not in self.target_temps[tool_index]:
-                                        self.target_temps[tool_index].append(obj_target)
-
-                                    for f_idx, f_v in self.fans_values.items():
-                                        if len(self.fans_speeds) > 0 and f_idx in self.fans_speeds:
-                                            if len(self.fans_speeds[f_idx]) > 0:
-                                                if (client_time - (int(self.fans_speeds[f_idx][0][0]) / 1000)) >= (self.temperature_cutoff * 60):
-                                                    self.fans_speeds[f_idx] = self.utils.shift(self.fans_speeds[f_idx])
-                                        else:
-                                            self.fans_speeds[f_idx] = []
-                                        self.fans_speeds[f_idx].append([time_, self.fans_values[f_idx]])
-
-                                    """===========min / max========="""
-                                    if tool_index in self.min_temp:
-                                        min_temp = self.min_temp[tool_index]
-                                    else:
-                                        self.min_temp[tool_index] = 0.0
-                                        min_temp = 0.0
-                                    if tool_index in self.max_temp:
-                                        max_temp = self.max_temp[tool_index]
-                                    else:
-                                        self.max_temp[tool_index] = 0.0
-                                        max_temp = 0.0
-
-                                    if tool_index in self.max_target_temp:
-                                        max_t_temp = self.max_target_temp[tool_index]
-                                    else:
-                                        self.max_target_temp[tool_index] = 0.0
-                                        max_t_temp = 0.0
-
-                                    self.min_temp[tool_index] = self.utils.update_min_temp(obj_actual[1], min_temp)
-                                    self.max_temp[tool_index] = self.utils.update_max_temp(obj_actual[1], max_temp)
-                                    self.max_target_temp[tool_index] = self.utils.update_max_temp(obj_target[1], max_t_temp)
+                                    if v["actual"] is None:
+                                        continue
+                                    now_ms = client_time * 1000
+                                    self.history.add_temperature(tool_index, time_, v["actual"], v["target"], now_ms)
+                                    if self.sessions and self.sessions.active:
+                                        self.sessions.add_sample(tool_index, time_, v["actual"], v["target"])
+                                    if self._relay and not self._relay.done:
+                                        self.relay_sample(tool_index, time_, v["actual"])
+                                    if self._scheduler and not self._scheduler.done:
+                                        if self._scheduler.add_sample(tool_index, time_, v["actual"]):
+                                            self.send_message("autotune_queue", self._scheduler.summary())
+                        # once per report, not once per heater
+                        self.history.add_fan_speeds(time_, client_time * 1000)
+                # readers only see whole reports
+                self.history.publish()
 
     @staticmethod
     def format_data(data):
-        return unfreeze(data)
+        return thaw(data)
 
     def process_state_data(self, data):
         if "data" in data and "state" in data["data"] and "flags" in data["data"]["state"]:
@@ -592,6 +1056,8 @@ class PidtunePlugin(
                 self.isReady = data["data"]["state"]["flags"]["ready"]
             if "loading" in data["data"]["state"]["flags"]:
                 self.isLoading = data["data"]["state"]["flags"]["loading"]
+            if self.isErrorOrClosed:
+                self.stop_autotunes("The printer is closed or in error")
 
     def send_plugin_errors(self, message_type, errors):
         self._plugin_manager.send_plugin_message(
@@ -605,45 +1071,77 @@ class PidtunePlugin(
 
     def send_message(self, type_, data_):
         payload = {"type": type_, "data": data_}
+        if self.metrics.enabled:
+            self.metrics.count("messages")
+            self.metrics.count("payload_bytes", len(json.dumps(payload)))
         self._plugin_manager.send_plugin_message("pidtune", payload)
 
+    @timed("gcode_received")
     def comm_protocol_gcode_received(self, comm, line, *args, **kwargs):
-        try:
-            if self.started:
-                self.parse_pid_gcode(line=line)
-        except Exception as ex:
-            self.logger.error("comm_protocol_gcode_received")
-            self.logger.error(ex)
-            self.logger.error(traceback.format_exc())
+        if self.started:
+            self._ingest.push(LINE_RECEIVED, line)
         return line
 
+    @timed("gcode_sent")
     def comm_protocol_gcode_sent(self, comm, phase, cmd, cmd_type, gcode, subcode=None, tags=None, *args, **kwargs):
-        try:
-            if self.started:
-                self.parse_gcode(cmd, gcode)
-        except Exception as ex:
-            self.logger.error("comm_protocol_gcode_sent")
-            self.logger.error(ex)
-            self.logger.error(traceback.format_exc())
+        if self.started:
+            self._ingest.push(LINE_SENT, cmd, gcode, tags)
+
+    def process_ingested_line(self, kind, timestamp, line, gcode=None, tags=None):
+        """Called from the ingestion worker thread, never from the comm thread."""
+        if kind == LINE_RECEIVED:
+            matched = self.parse_pid_gcode(line=line)
+            if matched and self._parser.last_kind in (TUNE_STAT, TUNE_PARAM):
+                self._autotune_progress(timestamp)
+                if self.early_stop:
+                    self.check_tune_convergence(timestamp)
+            elif matched and self._parser.last_kind == TUNE_RESULT:
+                self._autotune_progress(timestamp, self._parser.auto_state_pid())
+            if self.sessions and self.sessions.active:
+                self.sessions.add_line(timestamp * 1000, line, matched)
+                if matched and self._parser.last_kind == TUNE_RESULT:
+                    heater = self._parser.current_heater
+                    self.sessions.finish(self._parser.auto_state_pid(), self._parser.tune_cycles.get(heater), timestamp * 1000)
+        elif kind == LINE_SENT:
+            self.parse_gcode(line, gcode, tags)
+
+    def check_tune_convergence(self, timestamp: float):
+        """Stop a running M303 (M108) once its Ku/Tu have converged.
+
+        The gains computed from the converged Ku/Tu are applied with
+        M301/M304 when ``early_stop_apply`` is set, proposed otherwise.
+        """
+        if self._parser.auto_state_pid() != "started" or not self._own_autotune:
+            return
+        heater = self._parser.current_heater
+        converged = self._parser.tune_converged(heater, self.early_stop_tolerance, self.early_stop_cycles)
+        if not converged:
+            return
+        gains = marlin_gains(converged["ku"], converged["tu"])
+        self._parser.auto_state_pid("converged")
+        commands = ["M108"]
+        if self.early_stop_apply:
+            commands.append(pid_command(heater, gains))
+        self._printer.commands(commands)
+        self.logger.info("Autotune of heater {} converged after {} cycles: {}".format(heater, converged["cycles"], gains))
+        if self.sessions and self.sessions.active:
+            self.sessions.finish("converged", self._parser.tune_cycles.get(heater), timestamp * 1000, gains)
+        self.send_message("converged", dict(converged, heater=heater, applied=self.early_stop_apply, **gains))
+        self._autotune_progress(timestamp, "converged", gains)
 
     def comm_protocol_gcode_queueing(self, comm, phase, cmd, cmd_type, gcode, subcode=None, tags=None, *args, **kwargs):
         if gcode and gcode == "M107":
             cmd = []
-            if len(self.fans_values) <= 1:
+            fans = self.fans_values
+            if len(fans) <= 1:
                 cmd.append("M106 S0")
             else:
-                if len(self.fans_values) <= 0:
-                    self.fans_values[0] = 0
-                if len(self.fans_values) == 1:
-                    self.fans_values[0] = 0
-                    cmd.append("M106 S0")
-                if len(self.fans_values) > 1:
-                    for fan_idx, _ in self.fans_values.items():
-                        self.fans_values[fan_idx] = 0
-                        cmd.append("M106 P%s S0" % str(fan_idx))
+                for fan_idx in fans:
+                    cmd.append("M106 P%s S0" % str(fan_idx))
+                self.set_fans_values({fan_idx: 0 for fan_idx in fans})
         return cmd
 
-    def parse_gcode(self, cmd, gcode=None):
+    def parse_gcode(self, cmd, gcode=None, tags=None):
         if not self.started:
             return
         if not self.printer_profile:
@@ -658,22 +1156,21 @@ class PidtunePlugin(
                 self.collecting_data = False
 
             if gcode and gcode == "M303":
-                self._parser.auto_state_pid("started")
-                commandheater_match = re.compile(self._parser.reReqPid).match(cmd)
-                if commandheater_match:
-                    if "tool_index" in commandheater_match.groupdict():
-                        self._parser.current_heater = int(commandheater_match.group("tool_index"))
+                self._parser.start_tuning(parse_m303(cmd)["heater"])
+                self._own_autotune = bool(tags) and COMMAND_TAGS <= set(tags)
+                if self.sessions:
+                    self.sessions.start(cmd, time.time() * 1000)
             # get target tool pid
             if gcode and (gcode == "M301" or gcode == "M304"):
                 if gcode == "M301":
-                    load_pid_cmd = re.compile(self._parser.reLoadToolPid).match(cmd)
+                    load_pid_cmd = _RE_LOAD_TOOL_PID.match(cmd)
                     if load_pid_cmd and "tool_index" in load_pid_cmd.groupdict():
                         self._parser.current_heater = int(load_pid_cmd.group("tool_index"))
                 else:
                     self._parser.current_heater = -1
 
             if gcode and gcode == "M106":
-                fan_value = re.compile("M106\s+(P(?P<index>\d*)\s+)?S(?P<value>\d*)").match(cmd)
+                fan_value = _RE_FAN_SPEED_CMD.match(cmd)
                 value = 255
                 index = 0
                 if fan_value:
@@ -690,23 +1187,123 @@ class PidtunePlugin(
                     index = index if index else 0
                     value = value if value else 0
 
-                self.fans_values[index] = self.utils.format_fan_speed(value)
+                speeds = dict(self.fans_values)
+                speeds[index] = self.utils.format_fan_speed(value)
+                self.set_fans_values(speeds)
 
             if gcode and gcode == "M107":
-                for x in self.fans_values:
-                    self.fans_values[x] = 0
+                self.set_fans_values({x: 0 for x in self.fans_values})
 
-    def parse_pid_gcode(self, line, force: bool = False):
+    def set_fans_values(self, speeds: dict):
+        """Replace the fan speeds, never changed in place since other threads iterate them."""
+        self.fans_values = speeds
+        self.history.set_fan_speeds(speeds)
+
+    def parse_pid_gcode(self, line, force: bool = False) -> bool:
         if not self.printer_profile: self.get_printer_profile()
-        gcode = re.compile(self._parser.regex_command).match(line)
+        gcode = _RE_COMMAND.match(line)
         if gcode and "gcode" in gcode.groupdict() and (gcode.group("gcode") == "M106" or gcode.group("gcode") == "M107"):
             self.parse_gcode(line, gcode.group("gcode"))
         elif self.printer_profile and self._parser.parse_pid_data(line):
             try:
-                self.send_message("piddata", self._parser.json_pids_data)
+                if self._parser.last_delta:
+                    self.send_message("piddata", self._parser.last_delta)
             except Exception as ex:
                 self.logger.error(ex)
                 self.logger.error(traceback.format_exc())
+            return True
+        return False
+
+    def start_relay_autotune(self, jobs: list):
+        """Start a relay autotune of every heater in ``jobs`` ({heater, target, cycles}).
+
+        Heaters are limited by the hotend/bed max temperature settings.
+        """
+        if not self.printer_profile:
+            self.get_printer_profile()
+        if not self._printer.is_operational() or self._printer.is_printing() or self._printer.is_paused():
+            raise ValueError("The printer must be operational and idle.")
+        if self._relay and not self._relay.done:
+            raise ValueError("A relay autotune is already running.")
+        if self._scheduler and not self._scheduler.done:
+            raise ValueError("An autotune queue is running.")
+        if self._parser and self._parser.auto_state_pid() == "started":
+            raise ValueError("A firmware autotune (M303) is running.")
+        tuners = []
+        for job in jobs:
+            heater = int(job["heater"])
+            if heater not in self.tempControllers:
+                raise ValueError("Heater {} not found in printer profile".format(heater))
+            tuners.append(RelayTuner(
+                heater,
+                float(job["target"]),
+                self.b_tm if heater == -1 else self.h_tm,
+                cycles=int(job.get("cycles") or 5),
+                hysteresis=self.relay_hysteresis
+            ))
+        self._relay = RelayAutotune(tuners)
+        self._printer.commands(self._relay.start(datetime.now().timestamp() * 1000))
+        self.logger.info("Relay autotune started: {}".format(jobs))
+
+    def start_autotune_queue(self, jobs: list):
+        """Queue M303 runs ({heater, target, cycles, fan}) to run back to back."""
+        if not self.printer_profile:
+            self.get_printer_profile()
+        if not self._printer.is_operational() or self._printer.is_printing() or self._printer.is_paused():
+            raise ValueError("The printer must be operational and idle.")
+        if (self._scheduler and not self._scheduler.done) or (self._relay and not self._relay.done):
+            raise ValueError("An autotune is already running.")
+        queue = []
+        for job in jobs:
+            heater = int(job["heater"])
+            target = float(job["target"])
+            if heater not in self.tempControllers:
+                raise ValueError("Heater {} not found in printer profile".format(heater))
+            max_temp = self.b_tm if heater == -1 else self.h_tm
+            if max_temp and target > max_temp:
+                raise ValueError("Target {} is above the max temperature {} of heater {}".format(target, max_temp, heater))
+            fan = job.get("fan")
+            queue.append(AutotuneJob(heater, target, int(job.get("cycles") or 8), int(fan) if fan not in (None, "") else None))
+        self._scheduler = AutotuneScheduler(queue, self.send_commands)
+        self.logger.info("Autotune queue started: {}".format(jobs))
+
+    def _autotune_progress(self, timestamp: float, status: Optional[str] = None, gains: Optional[dict] = None):
+        """Report a cycle, or the end of the run when ``status`` is set, to the queue."""
+        if not self._scheduler or self._scheduler.done:
+            return
+        heater = self._parser.current_heater
+        cycles = self._parser.tune_cycles.get(heater) or []
+        if status:
+            changed = self._scheduler.finish(heater, status, cycles, timestamp * 1000, gains)
+        else:
+            changed = self._scheduler.cycle(heater, cycles)
+        if changed:
+            self.send_message("autotune_queue", self._scheduler.summary())
+
+    def send_commands(self, commands):
+        """Send G-code tagged as the plugin's own, see ``COMMAND_TAGS``."""
+        self._printer.commands(commands, tags=set(COMMAND_TAGS))
+
+    def stop_autotunes(self, reason: str):
+        """Stop the relay autotune and the autotune queue, if running, and switch their heaters off."""
+        if self._relay and not self._relay.done:
+            self._printer.commands(self._relay.stop(reason))
+            self.logger.warning("Relay autotune stopped: {}".format(reason))
+            self.send_message("relay", self._relay.summary())
+        if self._scheduler and not self._scheduler.done:
+            self._scheduler.cancel()
+            self.logger.warning("Autotune queue cancelled: {}".format(reason))
+            self.send_message("autotune_queue", self._scheduler.summary())
+
+    def relay_sample(self, heater: int, time_: float, actual: float):
+        commands = self._relay.update(heater, time_, actual)
+        if not commands:
+            return
+        self._printer.commands(commands)
+        summary = self._relay.summary()
+        if summary["done"]:
+            self.logger.info("Relay autotune finished: {}".format(summary))
+        self.send_message("relay", summary)
 
     def PIDAutoTuning(self, heater: str, temp, cycles):
         if not self.started:
@@ -719,7 +1316,7 @@ class PidtunePlugin(
                 if not self._printer.is_printing() and not self._printer.is_paused() and self._printer.is_operational():
                     heater_index = -1
                     if heater.lower() != "bed": heater_index = heater[-1]
-                    self._printer.commands("M303 E{} S{} U{}".format(heater_index, temp, cycles))
+                    self.send_commands("M303 E{} S{} U{}".format(heater_index, temp, cycles))
             else:
                 self.logger.debug("Heater {} not found in printer profile".format(heater))
 
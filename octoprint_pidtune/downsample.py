@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Reduce graph series to roughly the number of points the chart can display
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+# Below this many output points a bucket can't hold both its extremes.
+MIN_THRESHOLD = 4
+
+
+def minmax_downsample(times, values, threshold: int) -> list:
+    """Min/max-per-bucket reduction of a (times, values) pair of arrays.
+
+    The first and last samples are kept, and every bucket in between keeps
+    its lowest and highest sample in time order, so oscillation peaks and
+    troughs survive however far the series is reduced. ``min``/``max`` and
+    ``index`` run over array slices, so the per-bucket work stays in C.
+    """
+    n = len(values)
+    if threshold < MIN_THRESHOLD or n <= threshold:
+        return [[int(t), v] for t, v in zip(times, values)]
+
+    buckets = (threshold - 2) // 2
+    size = (n - 2) / buckets
+    out = [[int(times[0]), values[0]]]
+    for bucket in range(buckets):
+        lo = 1 + int(bucket * size)
+        hi = 1 + int((bucket + 1) * size)
+        if hi <= lo:
+            continue
+        chunk = values[lo:hi]
+        v_min = min(chunk)
+        v_max = max(chunk)
+        i_min = lo + chunk.index(v_min)
+        i_max = lo + chunk.index(v_max)
+        if i_min == i_max:
+            out.append([int(times[i_min]), v_min])
+        elif i_min < i_max:
+            out.append([int(times[i_min]), v_min])
+            out.append([int(times[i_max]), v_max])
+        else:
+            out.append([int(times[i_max]), v_max])
+            out.append([int(times[i_min]), v_min])
+    out.append([int(times[n - 1]), values[n - 1]])
+    return out
@@ -0,0 +1,662 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Time-series storage for the temperature and fan graphs
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import bisect
+import math
+import sys
+import threading
+import time
+from array import array
+from typing import Optional
+
+from octoprint_pidtune.downsample import minmax_downsample
+from octoprint_pidtune.stats import WindowStats
+
+# Evicted slots are only reclaimed once they represent at least this many
+# samples and half of the buffer, which keeps eviction amortized O(1).
+COMPACT_MIN = 1024
+# (name, bucket width, retention) of the rollup tiers in ms, finest first.
+ROLLUP_TIERS = (
+    ("10s", 10 * 1000, 6 * 3600 * 1000),
+    ("1m", 60 * 1000, 48 * 3600 * 1000),
+)
+# The memory budget never cuts the raw series below this span, nor a tier
+# below this many buckets.
+BUDGET_MIN_RAW = 5 * 60 * 1000
+BUDGET_MIN_BUCKETS = 60
+# Samples added between two checks of the memory budget.
+BUDGET_CHECK_EVERY = 512
+
+
+class TimeSeries:
+    """Columnar ring buffer of (time in ms, value) samples.
+
+    Samples are kept in two ``array('d')`` columns, always in strictly
+    increasing time order: a sample that isn't newer than the last one is
+    ignored, so the data never needs sorting.
+
+    Every sample gets a sequence number, ``first_seq`` being the oldest one
+    still stored and ``next_seq`` the one the next sample will get, which
+    lets readers fetch only what they haven't seen yet.
+
+    Samples are only ever appended past ``_end``; compaction and ``clear``
+    swap in new arrays rather than shifting the current ones. A
+    ``snapshot()`` sharing the arrays therefore keeps reading the same
+    samples while the writer goes on.
+    """
+
+    def __init__(self, window: float = 0):
+        self.window = window
+        self.times = array("d")
+        self.values = array("d")
+        self._head = 0
+        self._end = 0
+        self._base_seq = 0
+
+    def __len__(self):
+        return self._end - self._head
+
+    def snapshot(self):
+        """Read-only copy of the series as it is now, sharing its arrays."""
+        view = object.__new__(type(self))
+        view.__dict__.update(self.__dict__)
+        return view
+
+    @property
+    def first_seq(self) -> int:
+        return self._base_seq + self._head
+
+    @property
+    def next_seq(self) -> int:
+        return self._base_seq + self._end
+
+    def append(self, time_: float, value: float) -> bool:
+        times = self.times
+        if self._end > self._head and time_ <= times[-1]:
+            return False
+        times.append(time_)
+        self.values.append(value)
+        self._end += 1
+        return True
+
+    def _evict_head(self, limit: float) -> int:
+        """Index of the first sample to keep."""
+        times = self.times
+        head = self._head
+        end = self._end
+        while head < end and times[head] < limit:
+            head += 1
+        return head
+
+    def evict(self, now: float):
+        if self.window > 0:
+            self.evict_before(now - self.window)
+
+    def evict_before(self, limit: float):
+        head = self._head = self._evict_head(limit)
+        if head >= COMPACT_MIN and head * 2 >= self._end:
+            self.times = self.times[head:]
+            self.values = self.values[head:]
+            self._base_seq += head
+            self._end -= head
+            self._head = 0
+
+    def clear(self):
+        self._base_seq = self.next_seq
+        self.times = array("d")
+        self.values = array("d")
+        self._head = 0
+        self._end = 0
+
+    def first(self) -> Optional[tuple]:
+        if self._end > self._head:
+            return self.times[self._head], self.values[self._head]
+        return None
+
+    def last(self) -> Optional[tuple]:
+        if self._end > self._head:
+            return self.times[self._end - 1], self.values[self._end - 1]
+        return None
+
+    def points(self, since: int = 0) -> list:
+        times, values = self.columns(since)
+        return [[int(t), v] for t, v in zip(times, values)]
+
+    def columns(self, since: int = 0) -> tuple:
+        """(times, values) array slices of what ``points(since)`` returns."""
+        start = self._head
+        if since > self.first_seq:
+            start = min(since - self._base_seq, self._end)
+        return self.times[start:self._end], self.values[start:self._end]
+
+    def downsampled(self, threshold: int) -> list:
+        return minmax_downsample(*self.columns(), threshold)
+
+    def tail(self) -> Optional[list]:
+        """Point to draw after the stored ones; only step series have one."""
+        return None
+
+    def start_seq(self, since: int = 0) -> int:
+        """Sequence number of the first sample ``points(since)`` returns."""
+        if since > self.first_seq:
+            return min(since, self.next_seq)
+        return self.first_seq
+
+    def memory_usage(self) -> int:
+        return (
+            sys.getsizeof(self)
+            + self.times.buffer_info()[1] * self.times.itemsize
+            + self.values.buffer_info()[1] * self.values.itemsize
+        )
+
+    def data_size(self) -> int:
+        """Bytes held by the retained samples, used for the memory budget."""
+        return len(self) * 16
+
+
+class StepSeries(TimeSeries):
+    """``TimeSeries`` of a step-like signal (targets, fan speeds).
+
+    Only change-points are stored: a sample repeating the last value just
+    moves ``last_time``. Readers get the steps expanded (the previous value
+    up to each change) and ``tail()`` for the current value up to
+    ``last_time``. Eviction keeps the last change before the window, since
+    that value still applies at its start.
+    """
+
+    def __init__(self, window: float = 0):
+        super(StepSeries, self).__init__(window)
+        self.last_time: Optional[float] = None
+
+    def append(self, time_: float, value: float) -> bool:
+        """Returns True only when a change-point was stored."""
+        if self.last_time is not None and time_ <= self.last_time:
+            return False
+        self.last_time = time_
+        if self._end > self._head and self.values[-1] == value:
+            return False
+        return super(StepSeries, self).append(time_, value)
+
+    def _evict_head(self, limit: float) -> int:
+        times = self.times
+        head = self._head
+        end = self._end
+        while head + 1 < end and times[head + 1] <= limit:
+            head += 1
+        return head
+
+    def clear(self):
+        super(StepSeries, self).clear()
+        self.last_time = None
+
+    def points(self, since: int = 0) -> list:
+        start = self._head
+        if since > self.first_seq:
+            start = min(since - self._base_seq, self._end)
+        times, values = self.times, self.values
+        out = []
+        for i in range(start, self._end):
+            if i > self._head:
+                out.append([int(times[i]), values[i - 1]])
+            out.append([int(times[i]), values[i]])
+        return out
+
+    def columns(self, since: int = 0) -> tuple:
+        points = self.points(since)
+        return array("d", [p[0] for p in points]), array("d", [p[1] for p in points])
+
+    def downsampled(self, threshold: int) -> list:
+        # a handful of change-points, nothing to reduce
+        return self.points()
+
+    def tail(self) -> Optional[list]:
+        last = self.last()
+        if last is None or self.last_time is None or self.last_time <= last[0]:
+            return None
+        return [int(self.last_time), last[1]]
+
+    def max(self) -> Optional[float]:
+        return max(self.values[self._head:self._end]) if len(self) else None
+
+    def summary(self) -> dict:
+        """``WindowStats.summary()`` of the step, mean and stddev weighted by time."""
+        count = len(self)
+        if not count:
+            return {"count": 0, "min": None, "max": None, "mean": None, "stddev": None, "p2p": None}
+        times, values = self.times, self.values
+        end = self._end
+        start = self.last_time - self.window if self.window > 0 else times[self._head]
+        total = weighted = weighted_sq = 0.0
+        for i in range(self._head, end):
+            span = (times[i + 1] if i + 1 < end else self.last_time) - max(times[i], start)
+            if span > 0:
+                total += span
+                weighted += span * values[i]
+                weighted_sq += span * values[i] * values[i]
+        low, high = min(values[self._head:end]), max(values[self._head:end])
+        mean = weighted / total if total else values[end - 1]
+        stddev = math.sqrt(max(0.0, weighted_sq / total - mean * mean)) if total else 0.0
+        return {"count": count, "min": low, "max": high, "mean": mean, "stddev": stddev, "p2p": high - low}
+
+
+class RollupSeries:
+    """Fixed-width time buckets of a series, with the min, max and mean of each.
+
+    Samples accumulate in an open bucket, which is closed into the columns
+    when a sample past its end arrives. A closed bucket reads as two points,
+    its min and max in the order they occurred, at the start and the middle
+    of the bucket, so that oscillations stay visible at any scale. Sequence
+    numbers count those points, as ``TimeSeries`` ones count samples. The
+    open bucket is only drawn as ``tail()``, with its mean so far. Columns
+    are shared with snapshots the same way as ``TimeSeries`` ones.
+    """
+
+    def __init__(self, bucket: float, retention: float):
+        self.bucket = bucket
+        self.window = retention
+        self.starts = array("d")
+        self.mins = array("d")
+        self.maxs = array("d")
+        self.means = array("d")
+        self.min_first = array("b")
+        self._head = 0
+        self._end = 0
+        self._base = 0
+        # start, min, min time, max, max time, sum, count, last time
+        self._open = None
+
+    def __len__(self):
+        return self._end - self._head
+
+    def snapshot(self):
+        view = object.__new__(RollupSeries)
+        view.__dict__.update(self.__dict__)
+        if self._open is not None:
+            view._open = list(self._open)
+        return view
+
+    def _columns(self) -> tuple:
+        return self.starts, self.mins, self.maxs, self.means, self.min_first
+
+    @property
+    def first_seq(self) -> int:
+        return 2 * (self._base + self._head)
+
+    @property
+    def next_seq(self) -> int:
+        return 2 * (self._base + self._end)
+
+    def add(self, time_: float, value: float) -> bool:
+        current = self._open
+        if current is not None and time_ <= current[7]:
+            return False
+        start = time_ - time_ % self.bucket
+        if current is None or start != current[0]:
+            if current is not None:
+                self._close(current)
+            self._open = [start, value, time_, value, time_, value, 1, time_]
+            return True
+        if value < current[1]:
+            current[1], current[2] = value, time_
+        if value > current[3]:
+            current[3], current[4] = value, time_
+        current[5] += value
+        current[6] += 1
+        current[7] = time_
+        return True
+
+    def _close(self, bucket: list):
+        self.starts.append(bucket[0])
+        self.mins.append(bucket[1])
+        self.maxs.append(bucket[3])
+        self.means.append(bucket[5] / bucket[6])
+        self.min_first.append(bucket[2] <= bucket[4])
+        self._end += 1
+
+    def evict(self, now: float):
+        if self.window > 0:
+            self.evict_before(now - self.window)
+
+    def evict_before(self, limit: float):
+        starts = self.starts
+        head = self._head
+        end = self._end
+        while head < end and starts[head] < limit:
+            head += 1
+        self._head = head
+        if head >= COMPACT_MIN and head * 2 >= end:
+            self.starts, self.mins, self.maxs, self.means, self.min_first = (
+                column[head:] for column in self._columns()
+            )
+            self._base += head
+            self._end -= head
+            self._head = 0
+
+    def clear(self):
+        self._base += self._end
+        self.starts, self.mins, self.maxs, self.means, self.min_first = (
+            array(column.typecode) for column in self._columns()
+        )
+        self._head = 0
+        self._end = 0
+        self._open = None
+
+    def first(self) -> Optional[tuple]:
+        if len(self):
+            head = self._head
+            return self.starts[head], self.mins[head] if self.min_first[head] else self.maxs[head]
+        return None
+
+    def seq_at(self, time_: float) -> int:
+        """Sequence number of the first bucket starting at or after ``time_``."""
+        return 2 * (self._base + bisect.bisect_left(self.starts, time_, self._head, self._end))
+
+    def start_seq(self, since: int = 0) -> int:
+        if since > self.first_seq:
+            return min(since, self.next_seq)
+        return self.first_seq
+
+    def points(self, since: int = 0) -> list:
+        start = self._head
+        if since > self.first_seq:
+            start = min(since // 2 - self._base, self._end)
+        half = self.bucket / 2
+        out = []
+        for i in range(start, self._end):
+            low, high = self.mins[i], self.maxs[i]
+            if not self.min_first[i]:
+                low, high = high, low
+            out.append([int(self.starts[i]), low])
+            out.append([int(self.starts[i] + half), high])
+        return out
+
+    def columns(self, since: int = 0) -> tuple:
+        points = self.points(since)
+        return array("d", [p[0] for p in points]), array("d", [p[1] for p in points])
+
+    def downsampled(self, threshold: int, since: int = 0) -> list:
+        return minmax_downsample(*self.columns(since), threshold)
+
+    def tail(self) -> Optional[list]:
+        current = self._open
+        if current is None:
+            return None
+        return [int(current[0]), current[5] / current[6]]
+
+    def max(self) -> Optional[float]:
+        values = list(self.maxs[self._head:self._end])
+        if self._open is not None:
+            values.append(self._open[3])
+        return max(values) if values else None
+
+    def memory_usage(self) -> int:
+        return sys.getsizeof(self) + sum(column.buffer_info()[1] * column.itemsize for column in self._columns())
+
+    def data_size(self) -> int:
+        return len(self) * 33
+
+
+class HistoryView:
+    """Read side of a ``HistoryStore``: its series, stats and graph helpers.
+
+    ``HistoryStore.view()`` returns one frozen at the last ``publish()``,
+    whose series are snapshots and whose stats are summaries, so any number
+    of threads can read it without a lock while the store keeps changing.
+    """
+
+    window = 0
+    memory_budget = 0
+    epoch = 0
+    stats_resets = 0
+    budget_trims = 0
+
+    def __init__(self):
+        self.actual = {}
+        self.target = {}
+        self.fans = {}
+        # current speed of every fan index, each one gets a sample per temperature report
+        self.fan_speeds = {}
+        self.rollups = {}
+        self.actual_stats = {}
+
+    def version(self) -> tuple:
+        """Changes whenever a sample is added or evicted, or the stats restart."""
+        return (
+            self.epoch,
+            self.stats_resets,
+            tuple((name, key, s.first_seq, s.next_seq, s.tail())
+                  for name, group in (("a", self.actual), ("t", self.target), ("f", self.fans))
+                  for key, s in group.items())
+        )
+
+    def all_series(self):
+        for group in (self.actual, self.target, self.fans):
+            for series in group.values():
+                yield series
+
+    def tier_for(self, span: float) -> Optional[int]:
+        """Index of the coarsest-needed tier for a graph ``span`` in ms, None for the raw series."""
+        if not span or span <= self.window:
+            return None
+        for index, (_name, _bucket, retention) in enumerate(ROLLUP_TIERS):
+            if retention >= span:
+                return index
+        return len(ROLLUP_TIERS) - 1
+
+    def rollup(self, name: str, key, tier: int) -> Optional[RollupSeries]:
+        tiers = self.rollups.get((name, key))
+        return tiers[tier] if tiers else None
+
+    def data_size(self) -> int:
+        return (
+            sum(s.data_size() for s in self.all_series())
+            + sum(r.data_size() for tiers in self.rollups.values() for r in tiers)
+        )
+
+    def stats_summary(self) -> dict:
+        return {
+            tool: {
+                "actual": stats.summary(),
+                "target": (self.target.get(tool) or StepSeries(self.window)).summary()
+            }
+            for tool, stats in self.actual_stats.items()
+        }
+
+    def max_value(self, tier: Optional[int] = None) -> float:
+        """Highest temperature or fan value currently in the window, or in a tier."""
+        values = [0.0]
+        if tier is not None:
+            values.extend(v for v in (tiers[tier].max() for tiers in self.rollups.values()) if v is not None)
+            return max(values)
+        values.extend(s.max for s in self.actual_stats.values() if len(s))
+        values.extend(s.max() for s in self.target.values() if len(s))
+        values.extend(s.last()[1] for s in self.fans.values() if len(s))
+        return max(values)
+
+    def memory_usage(self) -> dict:
+        usage = {
+            "actual": sum(s.memory_usage() for s in self.actual.values()),
+            "target": sum(s.memory_usage() for s in self.target.values()),
+            "fans"  : sum(s.memory_usage() for s in self.fans.values()),
+        }
+        usage["rollups"] = sum(r.memory_usage() for tiers in self.rollups.values() for r in tiers)
+        usage["samples"] = sum(len(s) for s in self.all_series())
+        usage["buckets"] = sum(len(r) for tiers in self.rollups.values() for r in tiers)
+        usage["budget"] = self.memory_budget
+        usage["budget_trims"] = self.budget_trims
+        usage["total"] = usage["actual"] + usage["target"] + usage["fans"] + usage["rollups"]
+        return usage
+
+
+class HistoryStore(HistoryView):
+    """Per-heater actual/target series and per-fan speed series.
+
+    Targets and fan speeds are ``StepSeries``. Actual temperatures also feed
+    per-heater ``WindowStats`` over the same window. Every stored sample
+    (change-point for step series) is passed to ``sink``
+    ("actual"/"target"/"fan", index, time, value) when one is set.
+
+    ``epoch`` changes whenever the series are recreated, so that sequence
+    numbers from an earlier set of series are never mistaken for current ones.
+
+    Every series also feeds one ``RollupSeries`` per ``ROLLUP_TIERS`` entry,
+    which serve the graph spans longer than the raw ``window``. When the
+    retained data goes over ``memory_budget`` bytes, the oldest raw samples
+    are dropped first, then the oldest buckets of the finer tiers.
+
+    Changes are serialized by a lock that only writers take. Other threads
+    read ``view()``, which the writer replaces after each batch of samples
+    (``publish()``) and after every reset.
+    """
+
+    def __init__(self, window: float = 0, memory_budget: int = 0):
+        super(HistoryStore, self).__init__()
+        self.window = window
+        self.memory_budget = memory_budget
+        self.epoch = int(time.time() * 1000)
+        self.sink = None
+        self._until_budget_check = BUDGET_CHECK_EVERY
+        self._lock = threading.RLock()
+        self._view: Optional[HistoryView] = None
+
+    def view(self) -> HistoryView:
+        """The last published state, never changed afterwards."""
+        view = self._view
+        return view if view is not None else self.publish()
+
+    def publish(self) -> HistoryView:
+        with self._lock:
+            view = HistoryView()
+            view.window = self.window
+            view.memory_budget = self.memory_budget
+            view.epoch = self.epoch
+            view.stats_resets = self.stats_resets
+            view.budget_trims = self.budget_trims
+            view.actual = {k: s.snapshot() for k, s in self.actual.items()}
+            view.target = {k: s.snapshot() for k, s in self.target.items()}
+            view.fans = {k: s.snapshot() for k, s in self.fans.items()}
+            view.fan_speeds = dict(self.fan_speeds)
+            view.rollups = {k: tuple(r.snapshot() for r in tiers) for k, tiers in self.rollups.items()}
+            view.actual_stats = {k: s.snapshot() for k, s in self.actual_stats.items()}
+            self._view = view
+            return view
+
+    def set_window(self, window: float):
+        with self._lock:
+            self.window = window
+            for series in self.all_series():
+                series.window = window
+            for stats in self.actual_stats.values():
+                stats.window = window
+            self.publish()
+
+    def reset(self, tools):
+        with self._lock:
+            self.epoch = max(self.epoch + 1, int(time.time() * 1000))
+            self.actual = {t: TimeSeries(self.window) for t in tools}
+            self.target = {t: StepSeries(self.window) for t in tools}
+            self.fans = {}
+            self.rollups = {}
+            self.reset_stats(tools)
+
+    def reset_stats(self, tools=None):
+        with self._lock:
+            tools = self.actual.keys() if tools is None else tools
+            self.stats_resets += 1
+            self.actual_stats = {t: WindowStats(self.window) for t in tools}
+            self.publish()
+
+    def _series(self, group: dict, key, factory=TimeSeries) -> TimeSeries:
+        series = group.get(key)
+        if series is None:
+            series = group[key] = factory(self.window)
+        return series
+
+    def _stats(self, group: dict, key) -> WindowStats:
+        stats = group.get(key)
+        if stats is None:
+            stats = group[key] = WindowStats(self.window)
+        return stats
+
+    def _rollups(self, name: str, key) -> tuple:
+        tiers = self.rollups.get((name, key))
+        if tiers is None:
+            tiers = self.rollups[(name, key)] = tuple(
+                RollupSeries(bucket, retention) for _name, bucket, retention in ROLLUP_TIERS
+            )
+        return tiers
+
+    def enforce_budget(self, now: float):
+        """Drop the oldest data, raw series first, until under ``memory_budget``."""
+        with self._lock:
+            self._enforce_budget(now)
+
+    def _enforce_budget(self, now: float):
+        if self.memory_budget <= 0:
+            return
+        excess = self.data_size() - self.memory_budget
+        if excess <= 0:
+            return
+        groups = [(list(self.all_series()), BUDGET_MIN_RAW)]
+        for tier, (_name, bucket, _retention) in enumerate(ROLLUP_TIERS):
+            groups.append(([tiers[tier] for tiers in self.rollups.values()], bucket * BUDGET_MIN_BUCKETS))
+        for group, keep in groups:
+            floor = now - keep
+            firsts = [s.first()[0] for s in group if len(s)]
+            limit = min(firsts) if firsts else floor
+            while excess > 0 and limit < floor:
+                # a quarter of what's left at a time, the budget only needs approaching
+                limit = min(floor, limit + (now - limit) / 4)
+                for s in group:
+                    before = s.data_size()
+                    s.evict_before(limit)
+                    excess -= before - s.data_size()
+                self.budget_trims += 1
+            if excess <= 0:
+                break
+
+    def _add(self, name: str, key, series: TimeSeries, stats: Optional[WindowStats], time_: float, value: float, now: float):
+        series.evict(now)
+        if stats is not None:
+            stats.evict(now)
+        for rollup in self._rollups(name, key):
+            rollup.evict(now)
+            rollup.add(time_, value)
+        self._until_budget_check -= 1
+        if self._until_budget_check <= 0:
+            self._until_budget_check = BUDGET_CHECK_EVERY
+            self._enforce_budget(now)
+        if series.append(time_, value):
+            if stats is not None:
+                stats.add(time_, value)
+            if self.sink:
+                self.sink(name, key, time_, value)
+
+    def add_temperature(self, tool, time_: float, actual, target, now: float):
+        with self._lock:
+            if actual is not None:
+                self._add("actual", tool, self._series(self.actual, tool), self._stats(self.actual_stats, tool), time_, actual, now)
+            if target is not None:
+                self._add("target", tool, self._series(self.target, tool, StepSeries), None, time_, target, now)
+
+    def add_fan(self, fan, time_: float, value, now: float):
+        with self._lock:
+            self._add("fan", fan, self._series(self.fans, fan, StepSeries), None, time_, value, now)
+
+    def set_fan_speeds(self, speeds: dict):
+        with self._lock:
+            self.fan_speeds = dict(speeds)
+
+    def add_fan_speeds(self, time_: float, now: float):
+        """Sample every fan at its current speed, see ``set_fan_speeds``."""
+        with self._lock:
+            for fan, value in self.fan_speeds.items():
+                self.add_fan(fan, time_, value, now)
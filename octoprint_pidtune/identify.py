@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Model-based PID gains from recorded heat-up steps
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import math
+from typing import Optional
+
+# Marlin's PID output range (PID_MAX), the unit its gains are expressed in.
+OUTPUT_RANGE = 255.0
+# Fits run on at most this many samples, enough for a heat-up curve.
+FIT_POINTS = 300
+# A target change smaller than this is not a heat-up step.
+MIN_STEP = 10.0
+# The heater runs at full power until it closes in on the target, so only
+# the response below this fraction of the step is open-loop.
+OPEN_LOOP_FRACTION = 0.8
+
+
+def find_step(target_times, target_values, min_step: float = MIN_STEP) -> Optional[tuple]:
+    """(time, previous target, new target) of the last upward target step."""
+    for i in range(len(target_values) - 1, 0, -1):
+        if target_values[i] - target_values[i - 1] >= min_step:
+            return target_times[i], target_values[i - 1], target_values[i]
+    return None
+
+
+def step_response(times, values, step_time: float, target: float, end_time: Optional[float] = None) -> tuple:
+    """Samples of the open-loop part of a heat-up starting at ``step_time``.
+
+    Returns (seconds since the step, temperatures, initial temperature).
+    """
+    y0 = None
+    out_t, out_y = [], []
+    for t, v in zip(times, values):
+        if t < step_time:
+            y0 = v
+            continue
+        if end_time is not None and t > end_time:
+            break
+        if y0 is None:
+            y0 = v
+        if v >= y0 + OPEN_LOOP_FRACTION * (target - y0):
+            break
+        out_t.append((t - step_time) / 1000.0)
+        out_y.append(v)
+    return out_t, out_y, y0
+
+
+def _decimate(times: list, values: list, count: int) -> tuple:
+    if len(times) <= count:
+        return times, values
+    step = len(times) / count
+    index = [int(i * step) for i in range(count)]
+    return [times[i] for i in index], [values[i] for i in index]
+
+
+def _fit_amplitude(times, rises, tau: float, dead_time: float) -> tuple:
+    """Least-squares step amplitude for a fixed tau/dead time, and its SSE."""
+    sxx = sxy = 0.0
+    shape = []
+    for t, y in zip(times, rises):
+        x = 1.0 - math.exp(-(t - dead_time) / tau) if t > dead_time else 0.0
+        shape.append(x)
+        sxx += x * x
+        sxy += x * y
+    if sxx <= 0:
+        return 0.0, float("inf")
+    amplitude = sxy / sxx
+    sse = 0.0
+    for x, y in zip(shape, rises):
+        e = y - amplitude * x
+        sse += e * e
+    return amplitude, sse
+
+
+def _golden(f, lo: float, hi: float, iterations: int = 40) -> float:
+    ratio = (math.sqrt(5) - 1) / 2
+    a, b = lo, hi
+    c = b - ratio * (b - a)
+    d = a + ratio * (b - a)
+    fc, fd = f(c), f(d)
+    for _ in range(iterations):
+        if fc < fd:
+            b, d, fd = d, c, fc
+            c = b - ratio * (b - a)
+            fc = f(c)
+        else:
+            a, c, fc = c, d, fd
+            d = a + ratio * (b - a)
+            fd = f(d)
+    return (a + b) / 2
+
+
+def fit_fopdt(times, values, y0: float, power: float = 1.0) -> dict:
+    """First-order-plus-dead-time fit of a step response.
+
+    ``times`` are seconds since the step, ``values`` the temperatures and
+    ``power`` the heater duty (0-1) during the step. The model is
+    ``y = y0 + A (1 - exp(-(t - L) / tau))`` for ``t > L``: the amplitude is
+    solved in closed form for every (tau, L) pair, L is searched on a grid
+    and tau refined by golden-section search on a log scale.
+    """
+    times, values = _decimate(list(times), list(values), FIT_POINTS)
+    if len(times) < 10 or times[-1] <= 0:
+        raise ValueError("Not enough samples in the heat-up to fit a model")
+    rises = [v - y0 for v in values]
+    if max(rises) < 5:
+        raise ValueError("The temperature barely moved during the step")
+
+    span = times[-1]
+    best = None
+    for i in range(31):
+        dead_time = span * 0.5 * i / 30
+        log_tau = _golden(
+            lambda lt: _fit_amplitude(times, rises, math.exp(lt), dead_time)[1],
+            math.log(span * 0.05), math.log(span * 50)
+        )
+        tau = math.exp(log_tau)
+        amplitude, sse = _fit_amplitude(times, rises, tau, dead_time)
+        if best is None or sse < best[0]:
+            best = (sse, amplitude, tau, dead_time)
+
+    sse, amplitude, tau, dead_time = best
+    # the grid can land on 0 while a small dead time is still the best fit
+    dead_time = max(dead_time, span / 200)
+    amplitude, sse = _fit_amplitude(times, rises, tau, dead_time)
+    return {
+        "gain"     : amplitude / (power * OUTPUT_RANGE),
+        "amplitude": amplitude,
+        "tau"      : tau,
+        "dead_time": dead_time,
+        "y0"       : y0,
+        "rmse"     : math.sqrt(sse / len(times)),
+        "samples"  : len(times),
+        "duration" : span,
+    }
+
+
+def ultimate_point(gain: float, tau: float, dead_time: float) -> tuple:
+    """(Ku, Tu) of the model: where its phase reaches -180 degrees."""
+    lo, hi = 1e-9, math.pi / dead_time
+    for _ in range(100):
+        w = (lo + hi) / 2
+        if w * dead_time + math.atan(w * tau) < math.pi:
+            lo = w
+        else:
+            hi = w
+    w = (lo + hi) / 2
+    return math.sqrt(1 + (w * tau) ** 2) / gain, 2 * math.pi / w
+
+
+def marlin_gains(ku: float, tu: float) -> dict:
+    """The classic Ziegler-Nichols rule Marlin's M303 applies to Ku/Tu."""
+    kp = 0.6 * ku
+    return {"kp": kp, "ki": 2 * kp / tu, "kd": kp * tu / 8}
+
+
+def pid_command(heater: int, gains: dict) -> str:
+    """M301/M304 setting ``gains`` on ``heater`` (-1 being the bed)."""
+    values = "P%.2f I%.2f D%.2f" % (gains["kp"], gains["ki"], gains["kd"])
+    if heater == -1:
+        return "M304 " + values
+    return "M301 E%d %s" % (heater, values)
+
+
+def _gains(kp: float, ti: Optional[float], td: float) -> dict:
+    return {"kp": kp, "ki": kp / ti if ti else 0.0, "kd": kp * td}
+
+
+def tuning_rules(model: dict) -> dict:
+    """Marlin-unit Kp/Ki/Kd from a FOPDT model for the usual tuning rules."""
+    k, tau, l = model["gain"], model["tau"], model["dead_time"]
+    r = l / tau
+    ku, tu = ultimate_point(k, tau, l)
+    lam = max(0.25 * l, 0.2 * tau)
+    return {
+        "ziegler_nichols": _gains(1.2 * tau / (k * l), 2 * l, 0.5 * l),
+        "cohen_coon"     : _gains(
+            (tau / (k * l)) * (4 / 3 + r / 4), l * (32 + 6 * r) / (13 + 8 * r), 4 * l / (11 + 2 * r)
+        ),
+        "simc"           : _gains(tau / (k * 2 * l), min(tau, 8 * l), 0.0),
+        "imc"            : _gains((2 * tau + l) / (k * (2 * lam + l)), tau + l / 2, tau * l / (2 * tau + l)),
+        "tyreus_luyben"  : _gains(ku / 2.2, 2.2 * tu, tu / 6.3),
+        "ku"             : ku,
+        "tu"             : tu,
+    }
+
+
+def identify(times, values, target_times, target_values, power: float = 1.0,
+             start: Optional[float] = None, end: Optional[float] = None) -> dict:
+    """Model and gains from the last heat-up step in a heater's history.
+
+    ``start``/``end`` (ms) force the step window instead of looking for the
+    last upward change of the target; a forced step heats towards the
+    highest target seen in the window.
+    """
+    if start is None:
+        step = find_step(target_times, target_values)
+        if step is None:
+            raise ValueError("No heat-up step found in the history")
+        start, _, target = step
+    else:
+        target = max((v for t, v in zip(target_times, target_values) if t >= start and (end is None or t <= end)),
+                     default=max(target_values, default=0))
+    seconds, temps, y0 = step_response(times, values, start, target, end)
+    if y0 is None:
+        raise ValueError("No temperature samples after the step")
+    model = fit_fopdt(seconds, temps, y0, power)
+    model.update({"start": start, "target": target, "power": power})
+    return {"model": model, "gains": tuning_rules(model)}
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Bounded ingestion stage between OctoPrint's comm thread and the plugin's parsing
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import collections
+import threading
+import time
+
+LINE_RECEIVED = "recv"
+LINE_SENT = "sent"
+
+
+class IngestionQueue:
+    """Drop-oldest ring buffer drained in batches by a single worker thread.
+
+    ``push`` only appends to a bounded ``deque`` (atomic under the GIL) and
+    never waits, so a stalled consumer can't hold up the comm thread: once
+    the ring is full the oldest entry is discarded and counted in
+    ``dropped``.
+    """
+
+    def __init__(self, logger, handler, maxlen: int = 4096, batch_size: int = 256, idle_timeout: float = 0.5):
+        self._logger = logger
+        self._handler = handler
+        self.maxlen = maxlen
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+
+        self._ring = collections.deque(maxlen=maxlen)
+        self._wakeup = threading.Event()
+        self._idle = False
+        self._running = False
+        self._thread = None
+
+        self.pushed = 0
+        self.dropped = 0
+        self.processed = 0
+        self.batches = 0
+
+    def push(self, kind: str, line: str, gcode=None, tags=None):
+        if len(self._ring) >= self.maxlen:
+            self.dropped += 1
+        self._ring.append((kind, time.time(), line, gcode, tags))
+        self.pushed += 1
+        if self._idle:
+            self._wakeup.set()
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="PIDTuneIngest")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        self._running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def drain(self) -> int:
+        ring = self._ring
+        handler = self._handler
+        count = 0
+        while ring and count < self.batch_size:
+            try:
+                kind, ts, line, gcode, tags = ring.popleft()
+            except IndexError:
+                break
+            try:
+                handler(kind, ts, line, gcode, tags)
+            except Exception:
+                self._logger.exception("Error while processing ingested line: {}".format(line))
+            count += 1
+        if count:
+            self.processed += count
+            self.batches += 1
+        return count
+
+    def _run(self):
+        while self._running:
+            if self.drain():
+                continue
+            self._idle = True
+            if not self._ring:
+                self._wakeup.wait(self.idle_timeout)
+            self._idle = False
+            self._wakeup.clear()
+        while self.drain():
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "pending"  : len(self._ring),
+            "pushed"   : self.pushed,
+            "dropped"  : self.dropped,
+            "processed": self.processed,
+            "batches"  : self.batches,
+        }
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Plugin log handlers that never write from the caller's thread
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+# Per call site, at most DEBUG_BURST debug records every DEBUG_INTERVAL seconds.
+DEBUG_BURST = 20
+DEBUG_INTERVAL = 10.0
+
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+
+def log_level(name) -> int:
+    """Level of a setting value, INFO when unknown."""
+    name = str(name or "").upper()
+    return getattr(logging, name) if name in LOG_LEVELS else logging.INFO
+
+
+class RateLimitFilter(logging.Filter):
+    """Drops repeated records below ``limit_level`` from the same call site.
+
+    The first record let through after some were dropped tells how many.
+    """
+
+    def __init__(self, burst: int = DEBUG_BURST, interval: float = DEBUG_INTERVAL, limit_level: int = logging.INFO):
+        super(RateLimitFilter, self).__init__()
+        self.burst = burst
+        self.interval = interval
+        self.limit_level = limit_level
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.limit_level:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.interval:
+                suppressed = site[2] if site else 0
+                self._sites[key] = [now, 1, 0]
+            elif site[1] < self.burst:
+                site[1] += 1
+                suppressed = 0
+            else:
+                site[2] += 1
+                return False
+        if suppressed:
+            record.msg = "%s [%d similar messages suppressed]" % (record.getMessage(), suppressed)
+            record.args = None
+        return True
+
+
+def queue_logging(logger: logging.Logger, make_handler, level: int) -> logging.Logger:
+    """Route ``logger`` through a queue to the handler from ``make_handler()``.
+
+    Callers only enqueue records; a ``QueueListener`` thread does the
+    writing. Calling it again for the same logger only changes the level.
+    """
+    with _listeners_lock:
+        if logger.name not in _listeners:
+            records = queue.Queue(-1)
+            queue_handler = QueueHandler(records)
+            queue_handler.addFilter(RateLimitFilter())
+            listener = QueueListener(records, make_handler())
+            listener.start()
+            logger.addHandler(queue_handler)
+            _listeners[logger.name] = (logger, queue_handler, listener)
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
+
+
+def stop_queue_logging():
+    """Flush and detach every queue set up by ``queue_logging``."""
+    with _listeners_lock:
+        for logger, queue_handler, listener in _listeners.values():
+            logger.removeHandler(queue_handler)
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
+        _listeners.clear()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Counters and timers of the plugin's hot paths
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import functools
+import re
+import threading
+import time
+
+_RE_METRIC_NAME = re.compile(r"[^a-zA-Z0-9_]")
+
+
+class Metrics:
+    """Call counts and durations per timer, plus free counters.
+
+    While ``enabled`` is False nothing is recorded: an instrumented call
+    only pays the ``enabled`` check.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._timers = {}
+        self._counters = {}
+
+    def observe(self, name: str, duration_ns: int):
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                self._timers[name] = [1, duration_ns, duration_ns]
+            else:
+                timer[0] += 1
+                timer[1] += duration_ns
+                if duration_ns > timer[2]:
+                    timer[2] = duration_ns
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+            self.started = time.time()
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "enabled" : self.enabled,
+                "since"   : self.started,
+                "timers"  : {
+                    name: {"calls": calls, "total_ms": total / 1e6, "mean_us": total / calls / 1e3, "max_us": peak / 1e3}
+                    for name, (calls, total, peak) in self._timers.items()
+                },
+                "counters": dict(self._counters),
+            }
+
+
+def timed(name: str):
+    """Time a method into ``self.metrics`` under ``name``."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if not metrics.enabled:
+                return func(self, *args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                metrics.observe(name, time.perf_counter_ns() - start)
+        return wrapper
+    return decorate
+
+
+def _flatten(prefix: str, value, out: list):
+    if isinstance(value, bool):
+        out.append((prefix, int(value)))
+    elif isinstance(value, (int, float)):
+        out.append((prefix, value))
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            _flatten("%s_%s" % (prefix, _RE_METRIC_NAME.sub("_", str(key))), item, out)
+
+
+def prometheus_text(summary: dict, gauges: dict, prefix: str = "pidtune") -> str:
+    """Prometheus text exposition of a ``Metrics.summary()`` and nested ``gauges``."""
+    lines = [
+        "# TYPE %s_calls_total counter" % prefix,
+        "# TYPE %s_seconds_total counter" % prefix,
+        "# TYPE %s_seconds_max gauge" % prefix,
+    ]
+    for name, timer in sorted(summary["timers"].items()):
+        lines.append('%s_calls_total{hook="%s"} %d' % (prefix, name, timer["calls"]))
+        lines.append('%s_seconds_total{hook="%s"} %.9f' % (prefix, name, timer["total_ms"] / 1e3))
+        lines.append('%s_seconds_max{hook="%s"} %.9f' % (prefix, name, timer["max_us"] / 1e6))
+    for name, value in sorted(summary["counters"].items()):
+        metric = "%s_%s_total" % (prefix, _RE_METRIC_NAME.sub("_", name))
+        lines.append("# TYPE %s counter" % metric)
+        lines.append("%s %d" % (metric, value))
+    flat = []
+    for name, value in gauges.items():
+        _flatten("%s_%s" % (prefix, name), value, flat)
+    for metric, value in flat:
+        lines.append("# TYPE %s gauge" % metric)
+        lines.append("%s %s" % (metric, repr(float(value))))
+    return "\n".join(lines) + "\n"
@@ -12,26 +12,52 @@ __copyright__ = (
 )
 
 import re
+import threading
+
+from octoprint_pidtune.metrics import Metrics, timed
 
 class PIDData:
+    """PID values of one heater.
+
+    The dict sent to the frontend is cached and only rebuilt after
+    ``update()`` actually changed a field.
+    """
+    FIELDS = ("p", "i", "d", "ku", "tu", "kp", "ki", "kd", "name", "bias", "min", "max")
+    __slots__ = FIELDS + ("_type_", "_logger", "_snapshot")
+
     def __init__(self, logger):
-        self.p = None
-        self.i = None
-        self.d = None
-        self.ku = None
-        self.tu = None
-        self.kp = None
-        self.ki = None
-        self.kd = None
-        self.name = None
+        for field in self.FIELDS:
+            object.__setattr__(self, field, None)
         self._type_ = None
-        self.bias = None
-        self.min = None
-        self.max = None
         self._logger = logger
+        self._snapshot: Optional[dict] = None
+
+    def __setattr__(self, key, value):
+        if key in self.FIELDS:
+            object.__setattr__(self, "_snapshot", None)
+        object.__setattr__(self, key, value)
+
+    @property
+    def dirty(self) -> bool:
+        return self._snapshot is None
+
+    def update(self, fields: dict) -> dict:
+        """Set ``fields``, returns the ones whose value changed."""
+        changes = {k: v for k, v in fields.items() if getattr(self, k) != v}
+        for k, v in changes.items():
+            setattr(self, k, v)
+        return changes
+
+    def snapshot(self) -> dict:
+        """Public fields as a dict; a new dict after every change, never mutated."""
+        if self._snapshot is None:
+            self._snapshot = {field: getattr(self, field) for field in self.FIELDS}
+        return self._snapshot
 
 
 class PIDBedData(PIDData):
+    __slots__ = ()
+
     def __init__(self, logger):
         super().__init__(logger)
         self.name = "HB"
@@ -39,6 +65,9 @@ class PIDBedData(PIDData):
 
 
 class PIDToolData(PIDData):
+    FIELDS = PIDData.FIELDS + ("index",)
+    __slots__ = ("index",)
+
     def __init__(self, logger, index: int = 0, name=None):
         super().__init__(logger)
         self.index = index
@@ -46,27 +75,101 @@ class PIDToolData(PIDData):
         self._type_ = "hotend"
 
 
+TUNE_STAT = "stat"
+TUNE_PARAM = "param"
+TUNE_RESULT = "result"
+BED_PID = "bed_pid"
+TOOL_PID = "tool_pid"
+PID_REPORT = "pid_report"
+
+# Keyword that must be present for each kind of line, in the order the
+# firmware can emit them. A Marlin cycle line carries both "bias:" and
+# "Ku:", so "bias:" comes first and its pattern also captures Ku/Tu.
+_RE_KEYWORD = re.compile(r"bias:|Ku:|PID Autotune|M304|M301|\se:")
+_KEYWORD_KINDS = {
+    "bias:"       : TUNE_STAT,
+    "Ku:"         : TUNE_PARAM,
+    "PID Autotune": TUNE_RESULT,
+    "M304"        : BED_PID,
+    "M301"        : TOOL_PID,
+}
+_KIND_PATTERNS = {
+    TUNE_STAT  : re.compile(
+        r"^(Recv:)?\s*(bias:\s*(?P<bias>\d+\.?\d*)\s+)(d:\s*(?P<d>\d+\.?\d*)\s+)"
+        r"(min:\s*(?P<min>\d+\.?\d*)\s+)(max:\s*(?P<max>\d+\.?\d*))"
+        r"(.*?Ku:\s*(?P<ku>\d+\.?\d*)\s+Tu:\s*(?P<tu>\d+\.?\d*))?.*"
+    ),
+    TUNE_PARAM : re.compile(r"^(Recv:)?.+(Ku:\s*(?P<ku>\d+\.?\d*)\s+)(Tu:\s*(?P<tu>\d+\.?\d*)).*"),
+    TUNE_RESULT: re.compile(r"^(Recv:)?\s*PID Autotune (?P<result>finished|failed).*"),
+    BED_PID    : re.compile(
+        r"^(Recv:)?(\s*echo:)?\s*M304\s+(P(?P<P>\d+\.?\d*)\s+)(I(?P<I>\d+\.?\d*)\s+)(D(?P<D>\d+\.?\d*)).*"
+    ),
+    TOOL_PID   : re.compile(
+        r"^(Recv:)?(\s*echo:)?\s*M301\s+(P(?P<P>\d+\.?\d*)\s+)(I(?P<I>\d+\.?\d*)\s+)(D(?P<D>\d+\.?\d*)).*"
+    ),
+    PID_REPORT : re.compile(
+        r"^(Recv:)?(\s*echo:)?\s*(?P<tool>e:(?P<e_index>\d+)?\s+)(p:(?P<P>\d+\.?\d*)\s+)"
+        r"(i:(?P<I>\d+\.?\d*)\s+)(d:(?P<D>\d+\.?\d*)).*"
+    ),
+}
+_TUNE_KINDS = (TUNE_STAT, TUNE_PARAM, TUNE_RESULT)
+# Temperature reports and acknowledgements make up nearly all of the traffic
+# and can never carry PID output.
+_REJECT_PREFIXES = ("ok", "T:", " T:", "wait")
+
+
+class LineClassifier:
+    """Single-pass classifier for lines received from the printer.
+
+    Lines are rejected on a prefix check, then a keyword scan picks the one
+    precompiled pattern able to match them.
+    """
+
+    def __init__(self):
+        self.classified = 0
+        self.rejected = 0
+        self.matches = {}
+
+    def classify(self, line: str, tuning: bool = False):
+        if not line or line.startswith(_REJECT_PREFIXES):
+            self.rejected += 1
+            return None, None
+        keyword = _RE_KEYWORD.search(line)
+        if keyword:
+            kind = _KEYWORD_KINDS.get(keyword.group(0), PID_REPORT)
+            if tuning or kind not in _TUNE_KINDS:
+                match = _KIND_PATTERNS[kind].match(line)
+                if match:
+                    self.classified += 1
+                    self.matches[kind] = self.matches.get(kind, 0) + 1
+                    return kind, match
+        self.rejected += 1
+        return None, None
+
+    def stats(self) -> dict:
+        return {"classified": self.classified, "rejected": self.rejected, "matches": dict(self.matches)}
+
+
 class Parser:
-    re_pid = "^(Recv:)?(\s+echo:)?\s+(?P<tool>e:(?P<e_index>\d+)?\s+)(p:(?P<p>\d+\.?\d*)\s+)(i:(?P<i>\d+\.?\d*)\s+)(d:(?P<d>\d+\.?\d*)\s+).*"
-    re_tool_pid = "^(Recv:)?(\s+echo:)?\s+M301\s+(P(?P<P>\d+\.?\d*)\s+)(I(?P<I>\d+\.?\d*)\s+)(D(?P<D>\d+\.?\d*)\s+).*"
     reLoadToolPid = "^(Recv:)?(\s+echo:)?\s+M301\s+(E(?P<tool_index>\-?\d+)\s+).*"
 
-    reBedlPid = "^(Recv:)?(\s+echo:)?\s+M304\s+(P(?P<P>\d+\.?\d*)\s+)(I(?P<I>\d+\.?\d*)\s+)(D(?P<D>\d+\.?\d*)\s+).*"
-    reReqPid = "^(Recv:)?(\s+echo:)?\s+M303\s+(E(?P<tool_index>\-?\d+)\s+)(C(?P<cycles>\-?\d+)\s+)?(S(?P<temp_tgt>\-?\d+)\s+)?.*"
-    reTuneStat = "^(Recv:)?\s+(bias:\s*(?P<bias>\d+\.?\d*)\s+)(d:\s*(?P<d>\d+\.?\d*)\s+)(min:\s*(?P<min>\d+\.?\d*)\s+)(max:\s*(?P<max>\d+\.?\d*)).*"
-    reTuneParam = "^(Recv:)?.+(Ku:\s*(?P<ku>\d+\.?\d*)\s+)(Tu:\s*(?P<tu>\d+\.?\d*)).*"
-    reTuneComplete = "^(Recv:)?\s+PID Autotune finished.*"
-    reTuneFailed = "^(Recv:)?\s+PID Autotune failed.*"
-    reFanSpeed = "^(Recv:)?\s+Fan\(s\)\s+Speed:\s+Fan(?P<fan_index>\d+)=\s*?(?P<value>\d+).*"
     regex_command = "\s*(?P<gcode>M(?P<value>\d{1,3}))"
 
-    def __init__(self, logger, has_heatedbed: bool = True, hotend_count: int = 1):
+    def __init__(self, logger, has_heatedbed: bool = True, hotend_count: int = 1, metrics: Optional[Metrics] = None):
         self.json_pids_data = None
+        self.metrics = metrics or Metrics()
+        self.pids_version = 0
+        self._pids_dirty = True
+        self.last_delta: Optional[dict] = None
+        self._pids_lock = threading.RLock()
         self.current_heater = 0
         self.has_heatedbed = has_heatedbed
         self.hotend_count = hotend_count
         self._logger = logger
         self.pid_auto_state: Optional[str] = None
+        self.classifier = LineClassifier()
+        self.last_kind: Optional[str] = None
+        self.tune_cycles = {}
         self.__pids_data = {"tools": {}}
         if self.has_heatedbed:
             self.__pids_data["tools"][-1] = PIDBedData(self._logger)
@@ -74,73 +177,109 @@ class Parser:
             for index in range(0, hotend_count):
                 self.__pids_data["tools"][index] = PIDToolData(logger=self._logger, index=index, name="E%d" % index)
 
+    @timed("parse_pid_data")
     def parse_pid_data(self, line: str) -> bool:
-        updates_pid = False
-        if self.pid_auto_state == "started":
-            logs_match = re.compile(self.reTuneStat).match(line)
-            if logs_match:
-                self.__pids_data["tools"][self.current_heater].bias = float(logs_match.group("bias"))
-                self.__pids_data["tools"][self.current_heater].min  = float(logs_match.group("min"))
-                self.__pids_data["tools"][self.current_heater].max  = float(logs_match.group("max"))
-                updates_pid = True
-
-            logs_match = re.compile(self.reTuneParam).match(line)
-            if logs_match:
-                self.__pids_data["tools"][self.current_heater].ku = float(logs_match.group("ku"))
-                self.__pids_data["tools"][self.current_heater].tu = float(logs_match.group("tu"))
-                updates_pid = True
-
-            logs_match = re.compile(self.reTuneComplete).match(line)
-            if logs_match:
-                self.auto_state_pid("completed")
-                updates_pid = True
-
-            logs_match = re.compile(self.reTuneFailed).match(line)
-            if logs_match:
-                self.auto_state_pid("failed")
-                updates_pid = True
-
-        logs_match = re.compile(self.reBedlPid).match(line)
-        if logs_match:
-            self.__pids_data["tools"][-1].kp = float(logs_match.group("P"))
-            self.__pids_data["tools"][-1].ki = float(logs_match.group("I"))
-            self.__pids_data["tools"][-1].kd = float(logs_match.group("D"))
-            updates_pid = True
-
-        logs_match = re.compile(self.re_tool_pid).match(line)
-        if logs_match:
-            self.__pids_data["tools"][self.current_heater].kp = float(logs_match.group("P"))
-            self.__pids_data["tools"][self.current_heater].ki = float(logs_match.group("I"))
-            self.__pids_data["tools"][self.current_heater].kd = float(logs_match.group("D"))
-            updates_pid = True
-
-        logs_match = re.compile(self.re_pid).match(line)
-        if logs_match:
-            self.__pids_data["tools"][self.current_heater].kp = float(logs_match.group("P"))
-            self.__pids_data["tools"][self.current_heater].ki = float(logs_match.group("I"))
-            self.__pids_data["tools"][self.current_heater].kd = float(logs_match.group("D"))
-            updates_pid = True
-
-        # construct response
-        if updates_pid:
-            self._logger.debug("updates_pid")
-            dico_d = {}
-            if self.__pids_data and "tools" in self.__pids_data:
-                for t in self.__pids_data["tools"]:
-                    dico_d[t] = {k: v for k, v in self.__pids_data["tools"][t].__dict__.items() if k[0] != "_"}
-            if len(dico_d) >= 1:
-                self.json_pids_data = dico_d
-                return True
-        return False
+        kind, logs_match = self.classifier.classify(line, self.pid_auto_state == "started")
+        self.last_kind = kind
+        if not kind:
+            return False
+
+        tools = self.__pids_data["tools"]
+        if kind == BED_PID:
+            key = -1
+        elif kind == PID_REPORT and logs_match.group("e_index") is not None:
+            key = int(logs_match.group("e_index"))
+        else:
+            key = self.current_heater
+        heater = tools.get(key)
+        if heater is None:
+            return False
+
+        self.last_delta = None
+        if kind == TUNE_STAT:
+            fields = {
+                "bias": float(logs_match.group("bias")),
+                "min" : float(logs_match.group("min")),
+                "max" : float(logs_match.group("max")),
+            }
+            if logs_match.group("ku") is not None:
+                fields["ku"] = float(logs_match.group("ku"))
+                fields["tu"] = float(logs_match.group("tu"))
+            self._update(key, heater, fields)
+            self.tune_cycles.setdefault(self.current_heater, []).append({
+                "bias": heater.bias,
+                "d"   : float(logs_match.group("d")),
+                "min" : heater.min,
+                "max" : heater.max,
+                "ku"  : float(logs_match.group("ku")) if logs_match.group("ku") is not None else None,
+                "tu"  : float(logs_match.group("tu")) if logs_match.group("tu") is not None else None,
+            })
+        elif kind == TUNE_PARAM:
+            self._update(key, heater, {"ku": float(logs_match.group("ku")), "tu": float(logs_match.group("tu"))})
+            cycles = self.tune_cycles.get(self.current_heater)
+            if cycles and cycles[-1]["ku"] is None:
+                cycles[-1]["ku"] = heater.ku
+                cycles[-1]["tu"] = heater.tu
+        elif kind == TUNE_RESULT:
+            self.auto_state_pid("completed" if logs_match.group("result") == "finished" else "failed")
+        else:
+            self._update(key, heater, {
+                "kp": float(logs_match.group("P")),
+                "ki": float(logs_match.group("I")),
+                "kd": float(logs_match.group("D")),
+            })
+        return True
+
+    def _update(self, key: int, heater: PIDData, fields: dict):
+        """Set ``fields`` on ``heater``; the ones that changed become ``last_delta``."""
+        with self._pids_lock:
+            changes = heater.update(fields)
+            if not changes:
+                return
+            self._pids_dirty = True
+            self.pids_version += 1
+            self.last_delta = {"version": self.pids_version, "heater": key, "changes": changes}
 
     def get_pids_data(self) -> dict:
-        dico_d = {}
-        if self.__pids_data and "tools" in self.__pids_data:
-            for t in self.__pids_data["tools"]:
-                dico_d[t] = {k: v for k, v in self.__pids_data["tools"][t].__dict__.items() if k[0] != "_"}
-        if len(dico_d) >= 1:
-            self.json_pids_data = dico_d
-        return self.json_pids_data
+        """Every heater's snapshot, rebuilt only after one of them changed."""
+        with self._pids_lock:
+            if self._pids_dirty:
+                dico_d = {t: heater.snapshot() for t, heater in self.__pids_data["tools"].items()}
+                if len(dico_d) >= 1:
+                    self.json_pids_data = dico_d
+                self._pids_dirty = False
+            return self.json_pids_data
+
+    def get_pids_snapshot(self) -> dict:
+        """Every heater's data with the version of the last delta it includes."""
+        with self._pids_lock:
+            return {"version": self.pids_version, "piddata": self.get_pids_data()}
+
+    def start_tuning(self, heater: int):
+        """Mark an M303 run on ``heater`` as started and forget its previous cycles."""
+        self.current_heater = heater
+        self.tune_cycles[heater] = []
+        self.auto_state_pid("started")
+
+    def tune_converged(self, heater: int, tolerance: float, cycles: int) -> Optional[dict]:
+        """Mean Ku/Tu of the last ``cycles`` cycles of ``heater``'s autotune.
+
+        Only returned once Ku and Tu each changed by at most ``tolerance``
+        (relative) from one cycle to the next over those cycles.
+        """
+        params = [(c["ku"], c["tu"]) for c in self.tune_cycles.get(heater, ()) if c["ku"] and c["tu"]]
+        if len(params) < cycles + 1:
+            return None
+        recent = params[-(cycles + 1):]
+        for (ku0, tu0), (ku1, tu1) in zip(recent, recent[1:]):
+            if abs(ku1 - ku0) > tolerance * ku0 or abs(tu1 - tu0) > tolerance * tu0:
+                return None
+        recent = recent[1:]
+        return {
+            "ku"    : sum(ku for ku, _ in recent) / cycles,
+            "tu"    : sum(tu for _, tu in recent) / cycles,
+            "cycles": len(self.tune_cycles[heater]),
+        }
 
     def auto_state_pid(self, state: Optional[str] = None):
         if state and len(state) > 3:
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 import json
 import time
+from collections.abc import Mapping
 
 from octoprint.printer import PrinterCallback
 from octoprint.util.json import JsonEncoding
@@ -13,6 +14,44 @@ def unfreeze(frozen) -> dict:
             "</", "<\\/"
         )
     )
+
+
+def thaw(frozen):
+    """Recursively copy frozen mappings/sequences into plain dicts/lists."""
+    if isinstance(frozen, Mapping):
+        return {k: thaw(v) for k, v in frozen.items()}
+    if isinstance(frozen, (list, tuple)):
+        return [thaw(v) for v in frozen]
+    return frozen
+
+
+def thaw_temperature(frozen) -> dict:
+    """Thaw an add-temperature payload: ``time`` plus one flat mapping per heater."""
+    return {k: dict(v) if isinstance(v, Mapping) else v for k, v in frozen.items()}
+
+
+def thaw_current_data(frozen) -> dict:
+    """Thaw only the parts of OctoPrint's current data the plugin reads.
+
+    ``logs``, ``messages``, ``job`` and the rest are left out instead of
+    being encoded and decoded just to be thrown away.
+    """
+    data = {}
+    state = frozen.get("state")
+    if state is not None:
+        flags = state.get("flags")
+        data["state"] = {
+            "text" : state.get("text"),
+            "error": state.get("error"),
+            "flags": dict(flags) if flags is not None else {}
+        }
+    if "temps" in frozen:
+        data["temps"] = [thaw_temperature(t) for t in frozen["temps"]]
+    if "serverTime" in frozen:
+        data["serverTime"] = frozen["serverTime"]
+    return data
+
+
 class PrinterDataCallBack(PrinterCallback):
     def __init__(self, logger, callback):
         self.full_data = {
@@ -29,7 +68,7 @@ class PrinterDataCallBack(PrinterCallback):
         self._logger.debug(json.dumps(unfreeze(data)), indent=4, sort_keys=True)
 
     def on_printer_send_current_data(self, data):
-        self.full_data["current"]["data"] = unfreeze(data)
+        self.full_data["current"]["data"] = thaw_current_data(data)
         self.update_data()
 
     def update_data(self):
@@ -48,7 +87,7 @@ class PrinterDataCallBack(PrinterCallback):
         self._logger.debug("output: %s", output)
 
     def on_printer_add_temperature(self, data):
-        self.full_data["temps"].append(unfreeze(data))
+        self.full_data["temps"].append(thaw_temperature(data))
         self.update_data()
 
     def on_printer_add_log(self, data):
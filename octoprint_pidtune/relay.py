@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Relay (bang-bang) autotune of every heater at once, driven by the plugin
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import math
+from typing import Optional
+
+from octoprint_pidtune.identify import marlin_gains
+
+# Marlin's PID output range; the relay swings between 0 and full power.
+OUTPUT_RANGE = 255.0
+# Above PID_FUNCTIONAL_RANGE (10 by default) Marlin drives a heater at full
+# power, so "on" asks for a target at least this far above the band.
+ON_OFFSET = 15.0
+# Heaters are shut off once they get this close to their max temperature.
+SAFETY_MARGIN = 5.0
+
+STATE_HEATING = "heating"
+STATE_COOLING = "cooling"
+STATE_COMPLETED = "completed"
+STATE_FAILED = "failed"
+
+
+def heater_command(heater: int, target: float) -> str:
+    if heater == -1:
+        return "M140 S%d" % target
+    return "M104 T%d S%d" % (heater, target)
+
+
+class RelayTuner:
+    """Relay autotune state machine of one heater.
+
+    The heater is switched fully on below ``setpoint - hysteresis`` and off
+    above ``setpoint + hysteresis``, by moving its target, and every full
+    oscillation gives an amplitude and a period. The first one (the initial
+    heat-up) is discarded, the following ``cycles`` are averaged into Ku/Tu
+    with the describing-function formula and turned into gains with the
+    same Ziegler-Nichols rule Marlin's M303 uses.
+    """
+
+    def __init__(self, heater: int, setpoint: float, max_temp: float, cycles: int = 5,
+                 hysteresis: float = 1.0, timeout: float = 1800):
+        if setpoint + hysteresis + ON_OFFSET > max_temp - SAFETY_MARGIN:
+            raise ValueError("Target {} is too close to the max temperature {} of heater {}".format(setpoint, max_temp, heater))
+        self.heater = heater
+        self.setpoint = setpoint
+        self.max_temp = max_temp
+        self.cycles_wanted = max(2, cycles)
+        self.hysteresis = hysteresis
+        self.timeout_ms = timeout * 1000
+        self.on_target = min(max_temp - SAFETY_MARGIN, setpoint + hysteresis + ON_OFFSET)
+
+        self.state = STATE_HEATING
+        self.error: Optional[str] = None
+        self.started: Optional[float] = None
+        self.cycles = []
+        self._last_on: Optional[float] = None
+        self._high: Optional[float] = None
+        self._low: Optional[float] = None
+        self.result: Optional[dict] = None
+
+    @property
+    def done(self) -> bool:
+        return self.state in (STATE_COMPLETED, STATE_FAILED)
+
+    def start(self, now: float) -> str:
+        self.started = now
+        self.state = STATE_HEATING
+        return heater_command(self.heater, self.on_target)
+
+    def stop(self, error: Optional[str] = None) -> str:
+        if not self.done:
+            self.state = STATE_FAILED if error else STATE_COMPLETED
+            self.error = error
+        return heater_command(self.heater, 0)
+
+    def update(self, now: float, actual: float) -> Optional[str]:
+        """Feed one temperature sample, returns the G-code to send if any."""
+        if self.done:
+            return None
+        if actual >= self.max_temp - SAFETY_MARGIN:
+            return self.stop("Heater {} reached {:.1f}, too close to its max temperature".format(self.heater, actual))
+        if now - self.started > self.timeout_ms:
+            return self.stop("Heater {} did not oscillate in time".format(self.heater))
+
+        self._high = actual if self._high is None else max(self._high, actual)
+        self._low = actual if self._low is None else min(self._low, actual)
+        if self.state == STATE_HEATING and actual > self.setpoint + self.hysteresis:
+            self.state = STATE_COOLING
+            return heater_command(self.heater, 0)
+        if self.state == STATE_COOLING and actual < self.setpoint - self.hysteresis:
+            self.state = STATE_HEATING
+            self._close_cycle(now)
+            if self.done:
+                return heater_command(self.heater, 0)
+            return heater_command(self.heater, self.on_target)
+        return None
+
+    def _close_cycle(self, now: float):
+        if self._last_on is not None:
+            self.cycles.append({
+                "period": (now - self._last_on) / 1000,
+                "max"   : self._high,
+                "min"   : self._low,
+            })
+        # the heat-up from ambient never counts, only full swings
+        self._last_on = now
+        self._high = self._low = None
+        if len(self.cycles) >= self.cycles_wanted:
+            self._compute()
+
+    def _compute(self):
+        amplitude = sum(c["max"] - c["min"] for c in self.cycles) / len(self.cycles) / 2
+        tu = sum(c["period"] for c in self.cycles) / len(self.cycles)
+        relay = OUTPUT_RANGE / 2
+        ku = 4 * relay / (math.pi * math.sqrt(max(amplitude ** 2 - self.hysteresis ** 2, 1e-6)))
+        self.result = dict(marlin_gains(ku, tu), ku=ku, tu=tu, amplitude=amplitude)
+        self.state = STATE_COMPLETED
+
+    def summary(self) -> dict:
+        return {
+            "heater"  : self.heater,
+            "setpoint": self.setpoint,
+            "state"   : self.state,
+            "error"   : self.error,
+            "cycles"  : len(self.cycles),
+            "wanted"  : self.cycles_wanted,
+            "result"  : self.result,
+        }
+
+
+class RelayAutotune:
+    """Runs a ``RelayTuner`` per heater side by side on the same sample stream."""
+
+    def __init__(self, tuners: list):
+        self.tuners = {tuner.heater: tuner for tuner in tuners}
+
+    @property
+    def done(self) -> bool:
+        return all(tuner.done for tuner in self.tuners.values())
+
+    def start(self, now: float) -> list:
+        return [tuner.start(now) for tuner in self.tuners.values()]
+
+    def update(self, heater: int, now: float, actual: float) -> list:
+        """G-code to send after a sample of ``heater``.
+
+        A heater hitting its safety limit stops every heater of the run.
+        """
+        tuner = self.tuners.get(heater)
+        if tuner is None:
+            return []
+        command = tuner.update(now, actual)
+        if tuner.state == STATE_FAILED and command:
+            return self.stop("Stopped because heater {} failed: {}".format(heater, tuner.error))
+        return [command] if command else []
+
+    def stop(self, error: Optional[str] = None) -> list:
+        commands = []
+        for tuner in self.tuners.values():
+            if tuner.done:
+                commands.append(heater_command(tuner.heater, 0))
+            else:
+                commands.append(tuner.stop(error))
+        return commands
+
+    def summary(self) -> dict:
+        return {"done": self.done, "heaters": [tuner.summary() for tuner in self.tuners.values()]}
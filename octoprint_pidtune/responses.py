@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Conditional (ETag) and gzip-compressed JSON responses
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import gzip
+import hashlib
+import json
+
+import flask
+
+# Smaller bodies aren't worth the compression time.
+GZIP_MIN_SIZE = 1024
+# Low levels already get most of the gain on JSON and keep a Pi's CPU free.
+GZIP_LEVEL = 4
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag of a few cheap version numbers."""
+    return '"%s"' % hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:24]
+
+
+def is_not_modified(request, etag: str) -> bool:
+    header = request.headers.get("If-None-Match") or ""
+    return header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")]
+
+
+def not_modified(etag: str):
+    response = flask.make_response("", 304)
+    response.headers["ETag"] = etag
+    return response
+
+
+def bad_request(error: str):
+    """400 with the usual ``{"success": False, "error": ...}`` body."""
+    return flask.make_response(flask.jsonify({"success": False, "error": error}), 400)
+
+
+def json_response(request, payload, etag: str = None):
+    """``payload`` as JSON, gzipped when big enough and the client accepts it."""
+    body = json.dumps(payload).encode("utf-8")
+    headers = {"Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if etag:
+        headers["ETag"] = etag
+    if len(body) >= GZIP_MIN_SIZE and "gzip" in (request.headers.get("Accept-Encoding") or ""):
+        body = gzip.compress(body, GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    response = flask.make_response(body)
+    response.headers.update(headers)
+    response.mimetype = "application/json"
+    return response
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Back to back firmware autotune of several heaters
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import collections
+import threading
+from typing import Optional
+
+from octoprint_pidtune.identify import marlin_gains
+from octoprint_pidtune.relay import heater_command
+
+JOB_PENDING = "pending"
+JOB_WAITING = "waiting"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+AMBIENT = 25.0
+# Rough figures for the ETA until the running job measured its own.
+HEAT_RATE = {"bed": 0.3, "hotend": 2.0}
+CYCLE_PERIOD = {"bed": 120.0, "hotend": 40.0}
+
+
+class AutotuneJob:
+    def __init__(self, heater: int, target: float, cycles: int = 8, fan: Optional[int] = None):
+        self.heater = heater
+        self.target = target
+        self.cycles = cycles
+        self.fan = fan
+        self.state = JOB_PENDING
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.waited: float = 0
+        self._wait_started: Optional[float] = None
+        self.deadline: Optional[float] = None
+        self.timed_out = False
+        self.cycles_done = 0
+        self.tu: Optional[float] = None
+        self.result: Optional[dict] = None
+
+    @property
+    def kind(self) -> str:
+        return "bed" if self.heater == -1 else "hotend"
+
+    def command(self) -> list:
+        commands = []
+        if self.fan is not None:
+            commands.append("M106 S%d" % self.fan)
+        commands.append("M303 E%d S%d C%d" % (self.heater, self.target, self.cycles))
+        return commands
+
+    def estimate(self, actual: Optional[float]) -> float:
+        """Seconds this job still needs."""
+        period = self.tu or CYCLE_PERIOD[self.kind]
+        if self.state == JOB_RUNNING and self.cycles_done:
+            return max(0.0, (self.cycles - self.cycles_done) * period)
+        start = actual if actual is not None else AMBIENT
+        return max(0.0, self.target - start) / HEAT_RATE[self.kind] + self.cycles * period
+
+    def summary(self) -> dict:
+        return {
+            "heater"     : self.heater,
+            "target"     : self.target,
+            "cycles"     : self.cycles,
+            "fan"        : self.fan,
+            "state"      : self.state,
+            "started"    : self.started,
+            "finished"   : self.finished,
+            "waited"     : self.waited,
+            "cycles_done": self.cycles_done,
+            "timed_out"  : self.timed_out,
+            "result"     : self.result,
+        }
+
+
+class AutotuneScheduler:
+    """Runs M303 jobs one after the other without fixed pauses.
+
+    A job starts as soon as its heater is at least ``gap`` below the job's
+    target and is either near ambient or stable (moving less than
+    ``stable_rate`` degrees per second over ``stable_window`` seconds), as
+    measured on the temperature stream; a job on another heater than the
+    previous one usually starts right away.
+
+    A running job that hasn't ended ``timeout_factor`` times its estimated
+    duration after it started (the M303 result line was lost, the firmware
+    never finished) is stopped with M108, marked failed, and the queue moves
+    on to the next job.
+
+    ``send(commands)`` sends G-code to the printer.
+    """
+
+    def __init__(self, jobs: list, send, gap: float = 20.0, stable_rate: float = 0.05,
+                 stable_window: float = 30.0, ambient_margin: float = 15.0, timeout_factor: float = 3.0):
+        self.jobs = jobs
+        self.send = send
+        self.gap = gap
+        self.stable_rate = stable_rate
+        self.stable_window_ms = stable_window * 1000
+        self.ambient_margin = ambient_margin
+        self.timeout_factor = timeout_factor
+        self.started: Optional[float] = None
+        self.cancelled = False
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    @property
+    def current(self) -> Optional[AutotuneJob]:
+        for job in self.jobs:
+            if job.state in (JOB_PENDING, JOB_WAITING, JOB_RUNNING):
+                return job
+        return None
+
+    @property
+    def done(self) -> bool:
+        return self.current is None
+
+    def _latest(self, heater: int) -> Optional[float]:
+        samples = self._samples.get(heater)
+        return samples[-1][1] if samples else None
+
+    def ready(self, job: AutotuneJob) -> bool:
+        samples = self._samples.get(job.heater)
+        if not samples:
+            return False
+        actual = samples[-1][1]
+        if actual > job.target - self.gap:
+            return False
+        if actual <= AMBIENT + self.ambient_margin:
+            return True
+        first_time, first_value = samples[0]
+        span = (samples[-1][0] - first_time) / 1000
+        if span < self.stable_window_ms / 1000 * 0.9:
+            return False
+        return abs(actual - first_value) / span <= self.stable_rate
+
+    def add_sample(self, heater: int, time_ms: float, actual: float) -> bool:
+        """Feed a temperature sample; returns True when the queue state changed."""
+        with self._lock:
+            samples = self._samples.get(heater)
+            if samples is None:
+                samples = self._samples[heater] = collections.deque()
+            samples.append((time_ms, actual))
+            while samples and samples[0][0] < time_ms - self.stable_window_ms:
+                samples.popleft()
+
+            job = self.current
+            if job is None or self.cancelled:
+                return False
+            if self.started is None:
+                self.started = time_ms
+            if job.state == JOB_RUNNING and job.deadline is not None and time_ms > job.deadline:
+                job.state = JOB_FAILED
+                job.timed_out = True
+                job.finished = time_ms
+                self.send(["M108", heater_command(job.heater, 0)] + self._fan_off(job))
+                return True
+            if job.state == JOB_PENDING:
+                job.state = JOB_WAITING
+                job._wait_started = time_ms
+            if job.state == JOB_WAITING and job.heater == heater and self.ready(job):
+                job.state = JOB_RUNNING
+                job.waited = (time_ms - job._wait_started) / 1000
+                job.started = time_ms
+                job.deadline = time_ms + job.estimate(actual) * self.timeout_factor * 1000
+                self.send(job.command())
+                return True
+            return False
+
+    def cycle(self, heater: int, cycles: list) -> bool:
+        """Per-cycle progress of the running job, from the parser."""
+        with self._lock:
+            job = self.current
+            if job is None or job.state != JOB_RUNNING or job.heater != heater:
+                return False
+            job.cycles_done = len(cycles)
+            periods = [c["tu"] for c in cycles if c.get("tu")]
+            if periods:
+                job.tu = periods[-1]
+            return True
+
+    def finish(self, heater: int, status: str, cycles: list, time_ms: float, gains: Optional[dict] = None) -> bool:
+        """End of the running job: ``status`` is the parser's autotune state."""
+        with self._lock:
+            job = self.current
+            if job is None or job.state != JOB_RUNNING or job.heater != heater:
+                return False
+            job.finished = time_ms
+            job.cycles_done = len(cycles or [])
+            if status in ("completed", "converged"):
+                job.state = JOB_DONE
+                last = [c for c in (cycles or []) if c.get("ku") and c.get("tu")]
+                if gains:
+                    job.result = gains
+                elif last:
+                    job.result = dict(marlin_gains(last[-1]["ku"], last[-1]["tu"]), ku=last[-1]["ku"], tu=last[-1]["tu"])
+            else:
+                job.state = JOB_FAILED
+            fan_off = self._fan_off(job)
+            if fan_off:
+                self.send(fan_off)
+            return True
+
+    def _fan_off(self, job: AutotuneJob) -> list:
+        """M106 S0 after a job that set the fan, unless a pending job sets it again."""
+        if job.fan is not None and not any(j.fan is not None for j in self.jobs if j.state == JOB_PENDING):
+            return ["M106 S0"]
+        return []
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            commands = []
+            for job in self.jobs:
+                if job.state == JOB_RUNNING:
+                    commands.extend(["M108", heater_command(job.heater, 0)])
+                if job.state in (JOB_PENDING, JOB_WAITING, JOB_RUNNING):
+                    job.state = JOB_CANCELLED
+            if any(job.fan is not None for job in self.jobs):
+                commands.append("M106 S0")
+            if commands:
+                self.send(commands)
+
+    def eta(self) -> float:
+        """Estimated seconds until the last job ends."""
+        remaining = 0.0
+        for job in self.jobs:
+            if job.state in (JOB_PENDING, JOB_WAITING, JOB_RUNNING):
+                remaining += job.estimate(self._latest(job.heater))
+        return remaining
+
+    def summary(self) -> dict:
+        with self._lock:
+            finished = sum(1 for job in self.jobs if job.state in (JOB_DONE, JOB_FAILED, JOB_CANCELLED))
+            return {
+                "done"     : self.done,
+                "cancelled": self.cancelled,
+                "progress" : finished / len(self.jobs) if self.jobs else 1.0,
+                "eta"      : self.eta(),
+                "jobs"     : [job.summary() for job in self.jobs],
+            }
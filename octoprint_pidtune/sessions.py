@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Recording and replay of firmware autotune (M303) sessions
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from octoprint_pidtune.history import HistoryStore
+
+SESSION_VERSION = 1
+
+_RE_M303_PARAM = re.compile(r"([ECSU])\s*(-?\d+\.?\d*)")
+_RE_GAINS_LINE = re.compile(r"Kp:\s*(?P<kp>\d+\.?\d*)\s+Ki:\s*(?P<ki>\d+\.?\d*)\s+Kd:\s*(?P<kd>\d+\.?\d*)")
+_RE_GAIN_DEFINE = re.compile(r"#define\s+DEFAULT_(?:bed|chamber)?K(?P<k>[pid])\s+(?P<value>\d+\.?\d*)")
+_RE_SESSION_FILE = re.compile(r"^(?P<id>[\w\-]+)\.json\.gz$")
+
+
+def parse_m303(command: str) -> dict:
+    """Heater index, target and cycle count of an M303 command, in any order."""
+    params = {}
+    for letter, value in _RE_M303_PARAM.findall(command.upper().partition("M303")[2]):
+        params[letter] = value
+    return {
+        "heater": int(float(params.get("E", 0))),
+        "target": float(params["S"]) if "S" in params else None,
+        "cycles": int(float(params["C"])) if "C" in params else None,
+    }
+
+
+class SessionRecorder:
+    """Keeps the trace of the running M303 autotune and saves it when it ends.
+
+    A session holds the command, the target heater's samples (time deltas in
+    ms plus rounded actual/target values), the timestamped lines the parser
+    matched, the per-cycle stats and the final gains, and is written as
+    gzipped JSON. Lines keep being captured for ``grace`` seconds after the
+    result so the gains Marlin prints after "PID Autotune finished" make it
+    into the session.
+    """
+
+    def __init__(self, folder: str, logger, grace: float = 2.0, max_sessions: int = 50, on_saved=None):
+        self.folder = folder
+        self._logger = logger
+        self.on_saved = on_saved
+        self.grace_ms = grace * 1000
+        self.max_sessions = max_sessions
+        self._session: Optional[dict] = None
+        self._times = None
+        self._closing_at: Optional[float] = None
+        self._lock = threading.Lock()
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    @property
+    def active(self) -> bool:
+        return self._session is not None
+
+    def start(self, command: str, time_ms: float) -> dict:
+        with self._lock:
+            if self._session:
+                self._close("aborted")
+            params = parse_m303(command)
+            self._session = {
+                "version": SESSION_VERSION,
+                "id"     : self._new_id(time_ms, params["heater"]),
+                "command": command,
+                "heater" : params["heater"],
+                "target" : params["target"],
+                "cycles_requested": params["cycles"],
+                "started": int(time_ms),
+                "finished": None,
+                "status" : "started",
+                "samples": {"t0": int(time_ms), "dt": [], "actual": [], "target": []},
+                "lines"  : [],
+                "cycles" : [],
+                "result" : {"kp": None, "ki": None, "kd": None},
+            }
+            self._times = int(time_ms)
+            self._closing_at = None
+            return self._session
+
+    def _new_id(self, time_ms: float, heater: int) -> str:
+        """Time to the millisecond and heater, with a counter if that file exists already."""
+        started = datetime.fromtimestamp(time_ms / 1000)
+        base = "%s-%03d" % (started.strftime("%Y%m%d-%H%M%S"), started.microsecond // 1000)
+        suffix = "B" if heater == -1 else "E%d" % heater
+        session_id = "%s_%s" % (base, suffix)
+        count = 1
+        while os.path.exists(self._path(session_id)):
+            count += 1
+            session_id = "%s_%s-%d" % (base, suffix, count)
+        return session_id
+
+    def add_sample(self, tool, time_ms: float, actual: float, target):
+        if self._session is None:
+            return
+        self.close_if_due(time_ms)
+        with self._lock:
+            session = self._session
+            if session is None or tool != session["heater"] or time_ms <= self._times:
+                return
+            samples = session["samples"]
+            samples["dt"].append(int(time_ms) - self._times)
+            samples["actual"].append(round(actual, 2))
+            samples["target"].append(round(target, 2) if target is not None else None)
+            self._times = int(time_ms)
+
+    def add_line(self, time_ms: float, line: str, matched: bool):
+        if self._session is None:
+            return
+        gains = _RE_GAINS_LINE.search(line)
+        define = _RE_GAIN_DEFINE.search(line) if not gains else None
+        if not (matched or gains or define):
+            return
+        with self._lock:
+            session = self._session
+            if session is None:
+                return
+            session["lines"].append([int(time_ms) - session["started"], line.rstrip()])
+            if gains:
+                session["result"] = {k: float(gains.group(k)) for k in ("kp", "ki", "kd")}
+            elif define:
+                session["result"]["k" + define.group("k")] = float(define.group("value"))
+
+    def finish(self, status: str, cycles: list, time_ms: float, result: Optional[dict] = None):
+        with self._lock:
+            session = self._session
+            if session is None or session["finished"] is not None:
+                return
+            session["finished"] = int(time_ms)
+            session["status"] = status
+            session["cycles"] = list(cycles or [])
+            if result:
+                session["result"] = result
+            self._closing_at = time_ms + self.grace_ms
+
+    def close_if_due(self, time_ms: float):
+        if self._closing_at is not None and time_ms >= self._closing_at:
+            with self._lock:
+                if self._session is not None and self._closing_at is not None:
+                    self._close()
+
+    def _close(self, status: Optional[str] = None):
+        session, self._session = self._session, None
+        self._closing_at = None
+        if status and session["finished"] is None:
+            session["status"] = status
+            session["finished"] = self._times
+        try:
+            with gzip.open(self._path(session["id"]), "wt") as handle:
+                json.dump(session, handle, separators=(",", ":"))
+            self._prune()
+        except (IOError, OSError):
+            self._logger.exception("Could not save autotune session {}".format(session["id"]))
+            return
+        if self.on_saved:
+            self.on_saved(session)
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.folder, "%s.json.gz" % session_id)
+
+    def _session_ids(self) -> list:
+        ids = []
+        for name in os.listdir(self.folder):
+            match = _RE_SESSION_FILE.match(name)
+            if match:
+                ids.append(match.group("id"))
+        return sorted(ids)
+
+    def _prune(self):
+        ids = self._session_ids()
+        for session_id in ids[:max(0, len(ids) - self.max_sessions)]:
+            os.remove(self._path(session_id))
+
+    def load(self, session_id: str) -> Optional[dict]:
+        if not _RE_SESSION_FILE.match("%s.json.gz" % session_id):
+            return None
+        path = self._path(session_id)
+        if not os.path.isfile(path):
+            return None
+        with gzip.open(path, "rt") as handle:
+            return json.load(handle)
+
+    def list(self) -> list:
+        sessions = []
+        for session_id in reversed(self._session_ids()):
+            session = self.load(session_id)
+            if session:
+                sessions.append({k: session.get(k) for k in (
+                    "id", "command", "heater", "target", "started", "finished", "status", "result"
+                )})
+        return sessions
+
+
+class SessionReplay(threading.Thread):
+    """Feeds a recorded session through a fresh parser and history store.
+
+    Events are replayed ``speed`` times faster than they were recorded (as
+    fast as possible with a speed of 0), and ``on_frame(history, parser,
+    progress, done)`` is called at most once per ``frame_interval`` seconds
+    and once more at the end.
+    """
+
+    def __init__(self, session: dict, parser, on_frame, speed: float = 20.0, frame_interval: float = 0.25):
+        super().__init__(name="PIDTuneReplay")
+        self.daemon = True
+        self.session = session
+        self.parser = parser
+        self.history = HistoryStore()
+        self.on_frame = on_frame
+        self.speed = speed
+        self.frame_interval = frame_interval
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _events(self) -> list:
+        session = self.session
+        samples = session["samples"]
+        events = []
+        time_ms = samples["t0"]
+        for dt, actual, target in zip(samples["dt"], samples["actual"], samples["target"]):
+            time_ms += dt
+            events.append((time_ms, 1, actual, target))
+        for offset, line in session["lines"]:
+            events.append((session["started"] + offset, 0, line, None))
+        events.sort(key=lambda e: (e[0], e[1]))
+        return events
+
+    def run(self):
+        heater = self.session["heater"]
+        self.history.reset([heater])
+        self.parser.start_tuning(heater)
+        events = self._events()
+        if not events:
+            self.on_frame(self.history, self.parser, 1.0, True)
+            return
+        first = events[0][0]
+        span = max(1, events[-1][0] - first)
+        wall_start = time.time()
+        last_frame = 0.0
+        for time_ms, kind, value, target in events:
+            if self.speed > 0:
+                delay = wall_start + (time_ms - first) / 1000 / self.speed - time.time()
+                if delay > 0 and self._stopped.wait(delay):
+                    break
+            elif self._stopped.is_set():
+                break
+            if kind == 0:
+                self.parser.parse_pid_data(value)
+            else:
+                self.history.add_temperature(heater, time_ms, value, target, time_ms)
+            now = time.time()
+            if now - last_frame >= self.frame_interval:
+                last_frame = now
+                self.on_frame(self.history, self.parser, (time_ms - first) / span, False)
+        self.on_frame(self.history, self.parser, 1.0, True)
@@ -19,7 +19,6 @@ $(function () {
         self.temps.max = ko.observable("0");
         self.temps.min = ko.observable("0");
         self.maxtemp = 0;
-        self._resetMinMax = false;
 
         self.getminmaxtemp = false;
         self.actTemp = [];
@@ -60,6 +59,26 @@ $(function () {
 
         self.cycles = ko.observable("8");
         self.pidAutoState = ko.observable("Ready");
+        self.sessions = ko.observableArray([]);
+        self.selectedSession = ko.observable(undefined);
+        self.replayProgress = ko.observable(null);
+        // graph span in minutes, 0 for the live window
+        self.graphSpan = ko.observable(0);
+        self.graphSpans = [
+            {name: "Live", minutes: 0},
+            {name: "1 h", minutes: 60},
+            {name: "6 h", minutes: 360},
+            {name: "24 h", minutes: 1440},
+            {name: "48 h", minutes: 2880}
+        ];
+        self.identifyRules = ko.observableArray([]);
+        self.identifyMessage = ko.observable("");
+        self.relayState = ko.observable("");
+        self.relayRunning = ko.observable(false);
+        self.queueFan = ko.observable("");
+        self.queueState = ko.observable("");
+        self.queueJobs = ko.observableArray([]);
+        self.queueRunning = ko.observable(false);
         self.stepSize = ko.observable("10");
         self.target = ko.observable("200");
 
@@ -78,7 +97,7 @@ $(function () {
                 if(callback_ != null) {
                     let success = response.success;
                     if (success) {
-                        callback_(JSON.parse(response.data));
+                        callback_(typeof response.data === "string" ? JSON.parse(response.data) : response.data);
                     }
                 }
             });
@@ -179,7 +198,7 @@ $(function () {
             else if (self._selectedController() == 'Bed') {
                 self.target(self.settingsViewModel.settings.plugins.pidtune.b_tm());
             }
-
+            self._applyPidData(self._pidCache[self._selectedToolIndex()]);
         });
         self.pidData.tu.subscribe(self.updatePidDataK);
         self.pidData.ku.subscribe(self.updatePidDataK);
@@ -205,7 +224,30 @@ $(function () {
         };
 
         self.resetMinMax = function(){
-            self._resetMinMax = true;
+            self._api_post_command(
+                "reset_stats",
+                {},
+                self._applyStats
+            );
+        };
+
+        self._selectedToolIndex = function () {
+            if (self._selectedController() == 'Bed') {
+                return -1;
+            }
+            return parseInt(self._selectedController().slice(4, 5));
+        };
+
+        // windowed min/max/mean/stddev per heater, computed by the plugin
+        self._applyStats = function (stats) {
+            if (self.getminmaxtemp != true || !stats) {
+                return;
+            }
+            var heater = stats[self._selectedToolIndex()];
+            if (heater && heater.actual.count > 0) {
+                self.updateMax(heater.actual.max);
+                self.updateMin(heater.actual.min);
+            }
         };
 
         self.updateMax = function(maxt) {
@@ -228,6 +270,148 @@ $(function () {
         };
 
         //======================Buttons=========================
+        self.identifyBtn = function () {
+            self.identifyMessage(gettext("Fitting..."));
+            self.identifyRules([]);
+            $.ajax({
+                url: API_BASEURL + "plugin/pidtune",
+                type: "POST",
+                dataType: "json",
+                data: JSON.stringify({command: "identify", data: {"heater": self._selectedToolIndex()}}),
+                contentType: "application/json; charset=UTF-8"
+            }).done(function (response) {
+                if (!response.success) {
+                    self.identifyMessage(response.error);
+                    return;
+                }
+                var result = JSON.parse(response.data);
+                var model = result.model;
+                self.identifyMessage(_.sprintf("K=%.3f tau=%.1fs L=%.1fs rmse=%.2f", model.gain, model.tau, model.dead_time, model.rmse));
+                var rules = [];
+                for (var name in result.gains) {
+                    var g = result.gains[name];
+                    if (g !== null && typeof g === "object") {
+                        rules.push({name: name, kp: g.kp.toFixed(2), ki: g.ki.toFixed(3), kd: g.kd.toFixed(2)});
+                    }
+                }
+                self.identifyRules(rules);
+            });
+        };
+
+        self.useIdentifiedGains = function (rule) {
+            self.updateKp(rule.kp);
+            self.updateKi(rule.ki);
+            self.updateKd(rule.kd);
+            $('#btnApply').addClass("btn-primary");
+        };
+
+        // every hotend at the target field (or 200°C) and the bed at it (or 60°C)
+        self._allHeaterJobs = function () {
+            var selected = self._selectedController();
+            var jobs = [];
+            _.each(self.tempControllers(), function (name) {
+                if (name == 'Bed') {
+                    jobs.push({heater: -1, target: selected == 'Bed' ? self.target() : 60, cycles: self.cycles()});
+                } else if (name.slice(0, 4) == 'Tool') {
+                    jobs.push({heater: parseInt(name.slice(4)), target: selected.slice(0, 4) == 'Tool' ? self.target() : 200, cycles: self.cycles()});
+                }
+            });
+            return jobs;
+        };
+
+        self.queueBtn = function () {
+            var jobs = self._allHeaterJobs();
+            _.each(jobs, function (job) {
+                job.fan = job.heater == -1 ? null : self.queueFan();
+            });
+            self.queueState(gettext("Starting..."));
+            $.ajax({
+                url: API_BASEURL + "plugin/pidtune",
+                type: "POST",
+                dataType: "json",
+                data: JSON.stringify({command: "queue_autotune", data: {"jobs": jobs}}),
+                contentType: "application/json; charset=UTF-8"
+            }).done(function (response) {
+                if (!response.success) {
+                    self.queueState(response.error);
+                    return;
+                }
+                self._applyQueueSummary(JSON.parse(response.data));
+            });
+        };
+
+        self.cancelQueueBtn = function () {
+            self._api_post_command("cancel_autotune_queue", {}, null);
+        };
+
+        self._applyQueueSummary = function (summary) {
+            if (!summary) {
+                return;
+            }
+            self.queueRunning(!summary.done);
+            var finished = _.filter(summary.jobs, function (job) { return job.state != "pending" && job.state != "waiting" && job.state != "running"; }).length;
+            var state = _.sprintf("%d/%d", finished, summary.jobs.length);
+            if (!summary.done) {
+                state += _.sprintf(", ETA %d min", Math.ceil(summary.eta / 60));
+            }
+            self.queueState(state);
+            self.queueJobs(_.map(summary.jobs, function (job) {
+                var text = (job.heater == -1 ? "Bed" : "Tool" + job.heater) + "@" + job.target + ": " + job.state;
+                if (job.state == "running") {
+                    text += " " + job.cycles_done + "/" + job.cycles;
+                }
+                if (job.timed_out) {
+                    text += " (timed out)";
+                }
+                if (job.result) {
+                    text += _.sprintf(" P%.2f I%.2f D%.2f", job.result.kp, job.result.ki, job.result.kd);
+                }
+                return text;
+            }));
+            _.each(summary.jobs, function (job) {
+                if (job.heater == self._selectedToolIndex() && job.result) {
+                    self._applyPidData(job.result);
+                }
+            });
+        };
+
+        self.relayBtn = function () {
+            var jobs = self._allHeaterJobs();
+            self.relayState(gettext("Starting..."));
+            $.ajax({
+                url: API_BASEURL + "plugin/pidtune",
+                type: "POST",
+                dataType: "json",
+                data: JSON.stringify({command: "relay_autotune", data: {"heaters": jobs}}),
+                contentType: "application/json; charset=UTF-8"
+            }).done(function (response) {
+                if (!response.success) {
+                    self.relayState(response.error);
+                    return;
+                }
+                self._applyRelaySummary(JSON.parse(response.data));
+            });
+        };
+
+        self.stopRelayBtn = function () {
+            self._api_post_command("stop_relay_autotune", {}, null);
+        };
+
+        self._applyRelaySummary = function (summary) {
+            self.relayRunning(!summary.done);
+            self.relayState(_.map(summary.heaters, function (h) {
+                var name = h.heater == -1 ? "Bed" : "Tool" + h.heater;
+                return name + ": " + (h.error || h.state + " " + h.cycles + "/" + h.wanted);
+            }).join(", "));
+            var tool_index = self._selectedToolIndex();
+            _.each(summary.heaters, function (h) {
+                if (h.heater == tool_index && h.result) {
+                    self._applyPidData(h.result);
+                    $('#btnApply').addClass("btn-primary");
+                }
+            });
+        };
+
         self.autoBtn = function () {
             if (self._selectedController().slice(0, 4) == 'Tool') {
                 data = { command: "M303 E" + self._selectedController().slice(4, 5) + " S" + self.target() + " C" + self.cycles() };
@@ -381,37 +565,8 @@ $(function () {
                 self._processStateData(data.state);
             }
             catch (exc) { console.log(exc); }
-            try {
-                self._processTempData(data);
-            }
-            catch (exc) { console.log(exc); }
-            try {
-                self.updatePlot();
-            }
-            catch (exc) { console.log(exc); }
         };
 
-        self._processTempData = function (data) {
-            var datatemps = data.temps;
-            for (var i = 0; i < datatemps.length; i++) {
-                for(var j = 0; j < self.tempControllers().length; j++){
-                    var objActual = parseFloat(datatemps[i][self._selectedController().toLowerCase()].actual);
-                    if (self.getminmaxtemp == true) {
-                        if (j == 0) {
-                            if (self._resetMinMax == true ) {
-                                self.updateMax(objActual);
-                                self.updateMin(objActual);
-                                self._resetMinMax = false;
-                            } else {
-                                self.updateMax( updateMaxTemp(objActual,self.temps.max()));
-                                self.updateMin( updateMinTemp(objActual,self.temps.min()));
-                            }
-                        }
-                    }
-                }
-            }
-        }.bind(self);
-
         self._processStateData = function (data) {
             self.isErrorOrClosed(data["flags"]["closedOrError"] );
             self.isOperational(  data["flags"]["operational"]   );
@@ -512,23 +667,154 @@ $(function () {
             });
         };
 
+        self._plotEpoch = null;
+        self._plotSeries = {};
+        self._plotOrder = [];
+        self._plotMax = 0;
+        // time of the last full update request, 0 once it has been answered
+        self._plotResyncPending = 0;
+        // ETag of the last update answer and the request it answered
+        self._plotEtag = null;
+        self._plotEtagRequest = null;
+        // rollup tier the local series come from, null for the raw samples
+        self._plotTier = null;
+        self._plotTierUpdated = 0;
+        // last frame of a running session replay, drawn instead of the live series
+        self._replayFrame = null;
+
+        // Pushed deltas must continue exactly where the local series stop;
+        // returns false when one doesn't so that a full update can be requested.
+        self._canMergePlotData = function (data) {
+            if (data["epoch"] !== self._plotEpoch || (data["tier"] || null) !== self._plotTier) {
+                return false;
+            }
+            for (var i = 0; i < data["data"].length; i++) {
+                var update = data["data"][i];
+                var local = self._plotSeries[update.id];
+                if (local === undefined || update.start > local.next || local.next > update.next) {
+                    return false;
+                }
+            }
+            return true;
+        };
+
+        self._mergePlotData = function (data) {
+            if (data["epoch"] !== self._plotEpoch || (data["tier"] || null) !== self._plotTier) {
+                self._plotEpoch = data["epoch"];
+                self._plotTier = data["tier"] || null;
+                self._plotSeries = {};
+            }
+            self._plotMax = data["max"] || 0;
+            self._applyStats(data["stats"]);
+            var order = [];
+            var seen = {};
+            for (var i = 0; i < data["data"].length; i++) {
+                var update = data["data"][i];
+                var local = self._plotSeries[update.id];
+                if (local === undefined || update.replace || update.start > local.next || local.next > update.next) {
+                    local = {data: update.data.slice()};
+                } else {
+                    // targets and fans send two points per change, so the overlap is skipped by time, not by sequence
+                    var last = local.data.length ? local.data[local.data.length - 1][0] : -Infinity;
+                    var fresh = 0;
+                    while (fresh < update.data.length && update.data[fresh][0] <= last) {
+                        fresh++;
+                    }
+                    local.data.push.apply(local.data, update.data.slice(fresh));
+                }
+                var evicted = 0;
+                while (evicted < local.data.length && local.data[evicted][0] < update.min_time) {
+                    evicted++;
+                }
+                if (evicted > 0) {
+                    local.data.splice(0, evicted);
+                }
+                local.next = update.next;
+                local.tail = update.tail || null;
+                local.label = update.label;
+                local.color = update.color;
+                self._plotSeries[update.id] = local;
+                seen[update.id] = true;
+                order.push(update.id);
+            }
+            for (var id in self._plotSeries) {
+                if (!seen[id]) {
+                    delete self._plotSeries[id];
+                }
+            }
+            self._plotOrder = order;
+        };
+
+        self._base64Bytes = function (text) {
+            var raw = atob(text);
+            var bytes = new Uint8Array(raw.length);
+            for (var i = 0; i < raw.length; i++) {
+                bytes[i] = raw.charCodeAt(i);
+            }
+            return bytes;
+        };
+
+        // "b64" series: t0 plus uint16/uint32/float64 time deltas and float32 values, little-endian
+        self._decodeSeries = function (enc) {
+            var times = new Float64Array(enc.n);
+            if (enc.n === 0) {
+                return {times: times, values: new Float32Array(0)};
+            }
+            var dt = self._base64Bytes(enc.dt).buffer;
+            var deltas = enc.dtw === 2 ? new Uint16Array(dt) : enc.dtw === 4 ? new Uint32Array(dt) : new Float64Array(dt);
+            times[0] = enc.t0;
+            for (var i = 1; i < enc.n; i++) {
+                times[i] = times[i - 1] + deltas[i - 1];
+            }
+            return {times: times, values: new Float32Array(self._base64Bytes(enc.v).buffer)};
+        };
+
+        self._expandPlotData = function (data) {
+            for (var i = 0; i < data["data"].length; i++) {
+                var update = data["data"][i];
+                if (!update.enc) {
+                    continue;
+                }
+                var columns = self._decodeSeries(update.enc);
+                var points = new Array(columns.times.length);
+                for (var j = 0; j < points.length; j++) {
+                    points[j] = [columns.times[j], Math.round(columns.values[j] * 100) / 100];
+                }
+                update.data = points;
+                delete update.enc;
+            }
+            return data;
+        };
+
         self.__updatePlot = function (data) {
+            self._plotResyncPending = 0;
+            self._mergePlotData(self._expandPlotData(data));
+            self._drawPlot();
+        };
+
+        // targets and fans only store their changes, the last value runs up to "tail"
+        self._withTail = function (series) {
+            return series.tail ? series.data.concat([series.tail]) : series.data;
+        };
+
+        self._drawPlot = function () {
             if (self.updatePlot_tab_selected == false) {
                 return;
             }
-            var datatemps = data["data"];
-            var maxplotdata = [];
-            for (var i = 0; i < datatemps.length; i++) {
-                for(var j = 0; j < datatemps[i]["data"].length; j++){
-                    var objActual = parseFloat(datatemps[i]["data"][j][1]);
-                    maxplotdata.push(objActual);
-                }
+            var datatemps = [];
+            var max = self._plotMax;
+            if (self._replayFrame) {
+                datatemps = self._replayFrame.data;
+                max = self._replayFrame.max;
+            }
+            for (var i = 0; i < self._plotOrder.length && !self._replayFrame; i++) {
+                var series = self._plotSeries[self._plotOrder[i]];
+                datatemps.push({label: series.label, color: series.color, data: self._withTail(series)});
             }
-            var max_temp = Math.max.apply(Math, maxplotdata);
             $.plot(
                 "#pidtune-graph",
-                data["data"],
-                self.pidPlotOptions(max_temp+10),
+                datatemps,
+                self.pidPlotOptions(max+10),
                 {
                     scrollZoom: true,
                     displayModeBar: true
@@ -536,11 +822,74 @@ $(function () {
             );
         }
         self.updatePlot = function () {
-            self._api_post_command(
-                "update",
-                {"data": "data"},
-                self.__updatePlot
-            );
+            var cursor = {epoch: self._plotEpoch, tier: self._plotTier, series: {}};
+            for (var id in self._plotSeries) {
+                cursor.series[id] = self._plotSeries[id].next;
+            }
+            self._plotResyncPending = Date.now();
+            var request = JSON.stringify({
+                command: "update",
+                data: {
+                    "cursor": cursor,
+                    "points": $("#pidtune-graph").width() || 0,
+                    "format": "b64",
+                    "span": self.graphSpan() * 60 * 1000
+                }
+            });
+            // the ETag covers the request too, only send it back for the same one
+            var etag = request === self._plotEtagRequest ? self._plotEtag : null;
+            $.ajax({
+                url: API_BASEURL + "plugin/pidtune",
+                type: "POST",
+                dataType: "json",
+                data: request,
+                contentType: "application/json; charset=UTF-8",
+                headers: etag ? {"If-None-Match": etag} : {}
+            }).done(function (response, status, xhr) {
+                if (xhr.status === 304) {
+                    // nothing new since the last answer to this same request
+                    self._plotResyncPending = 0;
+                    return;
+                }
+                self._plotEtag = xhr.getResponseHeader("ETag");
+                self._plotEtagRequest = request;
+                if (response.success) {
+                    self.__updatePlot(typeof response.data === "string" ? JSON.parse(response.data) : response.data);
+                }
+            });
+        };
+
+        self.graphSpan.subscribe(function () {
+            // sequence numbers of the previous tier mean nothing in the new one
+            self._plotEpoch = null;
+            self._plotTier = null;
+            self._plotSeries = {};
+            self._plotEtag = null;
+            self._plotTierUpdated = Date.now();
+            self.updatePlot();
+        });
+
+        self.loadSessions = function () {
+            self._api_post_command("sessions", {}, function (sessions) {
+                self.sessions(sessions);
+            });
+        };
+
+        self.replayBtn = function () {
+            if (!self.selectedSession()) {
+                return;
+            }
+            self._api_post_command("replay_session", {"id": self.selectedSession(), "speed": 20}, function () {
+                self.replayProgress(0);
+            });
+        };
+
+        self.stopReplayBtn = function () {
+            self._api_post_command("stop_replay", {}, function () {
+                self._replayFrame = null;
+                self.replayProgress(null);
+                self._drawPlot();
+            });
         };
 
         self.resetAdvgraph = function () {
@@ -548,6 +897,9 @@ $(function () {
             try {
                 var plt = $.plot("#pidtune-graph", [], self.pidPlotOptions(0, 0));
                 plt.destroy();
+                self._plotEpoch = null;
+                self._plotSeries = {};
+                self._plotEtag = null;
                 console.log("reset");
                 self.updatePlot();
             }
@@ -577,6 +929,9 @@ $(function () {
                 }
             }
             self.updatePlot_tab_selected = true;
+            self.loadSessions();
+            self._api_post_command("autotune_queue", {}, self._applyQueueSummary);
+            self.updatePlot();
         };
 
         //==================================================
@@ -616,6 +971,48 @@ $(function () {
                 });
             }
         };
+        // per heater PID data, kept current from the piddata deltas
+        self._pidCache = {};
+        self._pidVersion = null;
+        self._resyncPidData = function () {
+            self._api_post_command("pid_snapshot", {}, function (snapshot) {
+                self._pidCache = snapshot.piddata || {};
+                self._pidVersion = snapshot.version;
+                if (!self._replayFrame) {
+                    self._applyPidData(self._pidCache[self._selectedToolIndex()]);
+                }
+            });
+        };
+        self._applyPidDelta = function (delta) {
+            if (self._pidVersion === null || delta.version > self._pidVersion + 1) {
+                // missed a delta (or just loaded): start over from a snapshot
+                self._pidVersion = delta.version;
+                self._resyncPidData();
+                return;
+            }
+            if (delta.version <= self._pidVersion) {
+                return;
+            }
+            self._pidVersion = delta.version;
+            self._pidCache[delta.heater] = _.extend(self._pidCache[delta.heater] || {}, delta.changes);
+            if (delta.heater == self._selectedToolIndex() && !self._replayFrame) {
+                self._applyPidData(delta.changes);
+            }
+        };
+        self._applyPidData = function (pid) {
+            if (!pid) {
+                return;
+            }
+            if (pid["bias"]    != null) { self.pidData.bias(parseFloat(pid["bias"])); }
+            if (pid["min"]     != null) {  self.pidData.min(parseFloat(pid["min"] )); }
+            if (pid["max"]     != null) {  self.pidData.max(parseFloat(pid["max"] )); }
+            if (pid["ku"]      != null) {   self.pidData.ku(parseFloat(pid["ku"]  )); }
+            if (pid["tu"]      != null) {   self.pidData.tu(parseFloat(pid["tu"]  )); }
+            if (pid["kp"]      != null) {   self.pidData.kp(parseFloat(pid["kp"]  )); }
+            if (pid["ki"]      != null) {   self.pidData.ki(parseFloat(pid["ki"]  )); }
+            if (pid["kd"]      != null) {   self.pidData.kd(parseFloat(pid["kd"]  )); }
+        };
+
         // DataUpdater
         self.onDataUpdaterPluginMessage = function (plugin, data) {
             if (typeof plugin == 'undefined') {
@@ -627,26 +1024,51 @@ $(function () {
             }
 
             if (data.type === "piddata") {
-                var tool_index = 0;
-                if (self._selectedController() == 'Bed'){
-                    tool_index = -1;
-                } else {
-                    tool_index = parseInt(self._selectedController().slice(4, 5));
+                self._applyPidDelta(data.data);
+            }
+            if (data.type === "replay") {
+                // the last frame stays on the graph until the replay is stopped
+                self._replayFrame = {
+                    data: _.map(data.data.data, function (series) {
+                        return {label: series.label, color: series.color, data: self._withTail(series)};
+                    }),
+                    max: data.data.max
+                };
+                self.replayProgress(Math.round(data.data.progress * 100));
+                self._applyPidData(data.data.piddata[data.data.heater]);
+                self._drawPlot();
+            }
+            if (data.type === "converged") {
+                self.pidAutoState(data.data.applied ? "Converged, applied" : "Converged");
+                if (data.data.heater == self._selectedToolIndex()) {
+                    self._applyPidData(data.data);
+                    if (!data.data.applied) {
+                        $('#btnApply').addClass("btn-primary");
+                    }
                 }
-                if (data.data[tool_index]["bias"]    != null) { self.pidData.bias(parseFloat(data.data[tool_index]["bias"])); }
-                if (data.data[tool_index]["min"]     != null) {  self.pidData.min(parseFloat(data.data[tool_index]["min"] )); }
-                if (data.data[tool_index]["max"]     != null) {  self.pidData.max(parseFloat(data.data[tool_index]["max"] )); }
-                if (data.data[tool_index]["ku"]      != null) {   self.pidData.ku(parseFloat(data.data[tool_index]["ku"]  )); }
-                if (data.data[tool_index]["tu"]      != null) {   self.pidData.tu(parseFloat(data.data[tool_index]["tu"]  )); }
-                if (data.data[tool_index]["kp"]      != null) {   self.pidData.kp(parseFloat(data.data[tool_index]["kp"]  )); }
-                if (data.data[tool_index]["ki"]      != null) {   self.pidData.ki(parseFloat(data.data[tool_index]["ki"]  )); }
-                if (data.data[tool_index]["kd"]      != null) {   self.pidData.kd(parseFloat(data.data[tool_index]["kd"]  )); }
-            }
-            if (data.type === "update") {
-                if (data) { //self.updatePlot2(data);
-                    console.log(data);
+            }
+            if (data.type === "autotune_queue") {
+                self._applyQueueSummary(data.data);
+            }
+            if (data.type === "relay") {
+                self._applyRelaySummary(data.data);
+            }
+            if (data.type === "session_saved") {
+                self.loadSessions();
+            }
+            if (data.type === "history") {
+                if (self.graphSpan() > 0) {
+                    // long spans come whole from a rollup tier, refreshed as its buckets fill
+                    if (Date.now() - self._plotTierUpdated > 10000) {
+                        self._plotTierUpdated = Date.now();
+                        self.updatePlot();
+                    }
+                } else if (self._canMergePlotData(data.data)) {
+                    self._mergePlotData(data.data);
+                    self._drawPlot();
+                } else if (Date.now() - self._plotResyncPending > 5000) {
+                    self.updatePlot();
                 }
-                else {}
             }
 
             if (data.type === "locked") {
@@ -681,16 +1103,6 @@ $(function () {
             return _.sprintf("%i pwm", speed);
         }
     }
-    function updateMaxTemp(newValue, oldValue) {
-        return Math.max(0, Math.max(newValue, oldValue));
-    }
-    function updateMinTemp(newValue, oldValue){
-        if(oldValue == 0){
-            return newValue;
-        }else {
-            return Math.min(newValue, oldValue);
-        }
-    }
 
     // view model class, parameters for constructor, container to bind to
     OCTOPRINT_VIEWMODELS.push([
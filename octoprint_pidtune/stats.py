@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Sliding-window statistics for heater temperatures
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import collections
+import math
+from typing import Optional
+
+
+class WindowStats:
+    """Min, max, mean and standard deviation over a time window.
+
+    Min and max come from monotonic deques, mean and variance from running
+    sums of the values minus the first sample (to limit cancellation), so
+    every sample costs amortized O(1) to add and to evict.
+    """
+
+    def __init__(self, window: float = 0):
+        self.window = window
+        self._samples = collections.deque()
+        self._min = collections.deque()
+        self._max = collections.deque()
+        self._offset: Optional[float] = None
+        self._sum = 0.0
+        self._sum_sq = 0.0
+
+    def __len__(self):
+        return len(self._samples)
+
+    def clear(self):
+        self._samples.clear()
+        self._min.clear()
+        self._max.clear()
+        self._offset = None
+        self._sum = 0.0
+        self._sum_sq = 0.0
+
+    def add(self, time_: float, value: float):
+        if self._offset is None:
+            self._offset = value
+        sample = (time_, value)
+        self._samples.append(sample)
+        shifted = value - self._offset
+        self._sum += shifted
+        self._sum_sq += shifted * shifted
+
+        max_q = self._max
+        while max_q and max_q[-1][1] <= value:
+            max_q.pop()
+        max_q.append(sample)
+        min_q = self._min
+        while min_q and min_q[-1][1] >= value:
+            min_q.pop()
+        min_q.append(sample)
+
+    def evict(self, now: float):
+        if self.window <= 0:
+            return
+        limit = now - self.window
+        samples = self._samples
+        while samples and samples[0][0] < limit:
+            time_, value = samples.popleft()
+            shifted = value - self._offset
+            self._sum -= shifted
+            self._sum_sq -= shifted * shifted
+            if self._max and self._max[0][0] <= time_:
+                self._max.popleft()
+            if self._min and self._min[0][0] <= time_:
+                self._min.popleft()
+        if not samples:
+            self.clear()
+
+    @property
+    def min(self) -> Optional[float]:
+        return self._min[0][1] if self._min else None
+
+    @property
+    def max(self) -> Optional[float]:
+        return self._max[0][1] if self._max else None
+
+    @property
+    def mean(self) -> Optional[float]:
+        count = len(self._samples)
+        if not count:
+            return None
+        return self._offset + self._sum / count
+
+    @property
+    def stddev(self) -> Optional[float]:
+        count = len(self._samples)
+        if not count:
+            return None
+        mean_shifted = self._sum / count
+        return math.sqrt(max(0.0, self._sum_sq / count - mean_shifted * mean_shifted))
+
+    def snapshot(self) -> "StatsSnapshot":
+        return StatsSnapshot(self.summary())
+
+    def summary(self) -> dict:
+        count = len(self._samples)
+        if not count:
+            return {"count": 0, "min": None, "max": None, "mean": None, "stddev": None, "p2p": None}
+        return {
+            "count" : count,
+            "min"   : self.min,
+            "max"   : self.max,
+            "mean"  : self.mean,
+            "stddev": self.stddev,
+            "p2p"   : self.max - self.min,
+        }
+
+
+class StatsSnapshot:
+    """Read-only ``WindowStats`` values taken at one point in time."""
+
+    def __init__(self, summary: dict):
+        self._summary = summary
+
+    def __len__(self):
+        return self._summary["count"]
+
+    @property
+    def min(self) -> Optional[float]:
+        return self._summary["min"]
+
+    @property
+    def max(self) -> Optional[float]:
+        return self._summary["max"]
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self._summary["mean"]
+
+    @property
+    def stddev(self) -> Optional[float]:
+        return self._summary["stddev"]
+
+    def summary(self) -> dict:
+        return dict(self._summary)
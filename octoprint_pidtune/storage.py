@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Persistent temperature history kept in fixed-record binary segment files
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from typing import Optional
+
+from octoprint_pidtune.downsample import minmax_downsample
+
+# time (ms), value, series kind, heater/fan index
+RECORD = struct.Struct("<ddhh4x")
+_TIME = struct.Struct("<d")
+
+KIND_ACTUAL = 0
+KIND_TARGET = 1
+KIND_FAN = 2
+KIND_NAMES = {KIND_ACTUAL: "actual", KIND_TARGET: "target", KIND_FAN: "fan"}
+KIND_IDS = {v: k for k, v in KIND_NAMES.items()}
+# only their change-points are recorded, the value holds until the next one
+STEP_KINDS = (KIND_TARGET, KIND_FAN)
+
+_RE_SEGMENT = re.compile(r"^history-(?P<start>\d+)(?P<compacted>\.c)?\.bin$")
+
+# Records of a flushed batch are time sorted, but consecutive batches may
+# overlap slightly, so range lookups start this much earlier and filter.
+ORDER_SLACK_MS = 60 * 1000
+
+
+def series_id(kind: int, index: int) -> str:
+    return "%s:%d" % (KIND_NAMES[kind], index)
+
+
+def parse_series_id(sid: str) -> Optional[tuple]:
+    name, _, index = sid.partition(":")
+    if name not in KIND_IDS:
+        return None
+    try:
+        return KIND_IDS[name], int(index)
+    except ValueError:
+        return None
+
+
+class SegmentStore:
+    """Append-only store of fixed 24 byte records, one file per time segment.
+
+    Samples are buffered and written in batches by the maintenance thread,
+    so recording never touches the disk. Reads map segment files with
+    ``mmap`` and binary search them by time, so a range query only touches
+    the records it returns. Segments older than ``compact_after`` are
+    rewritten keeping the min and max of every ``compact_bucket`` per series,
+    and segments older than ``retention`` are deleted.
+
+    Targets and fan speeds only come in as change-points. Every new segment
+    starts with a keyframe of their current values, so a query finds the
+    value in force at its start in the segment holding it.
+    """
+
+    def __init__(self, folder: str, logger=None, segment_seconds: int = 3600, retention_days: float = 7,
+                 compact_after_hours: float = 2, compact_bucket_seconds: int = 10,
+                 batch_records: int = 512, flush_interval: float = 10.0):
+        self.folder = folder
+        self._logger = logger
+        self.segment_ms = segment_seconds * 1000
+        self.retention_ms = retention_days * 24 * 3600 * 1000
+        self.compact_after_ms = compact_after_hours * 3600 * 1000
+        self.compact_bucket_ms = compact_bucket_seconds * 1000
+        self.batch_records = batch_records
+        self.flush_interval = flush_interval
+
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._maintenance: Optional[threading.Thread] = None
+        self._wakeup = threading.Event()
+        self._running = False
+        self._current_segment = None
+        # last written value of every step series, for the segment keyframes
+        self._steps = {}
+
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    def append(self, kind: int, index: int, time_ms: float, value: float):
+        with self._lock:
+            self._buffer.append((time_ms, value, kind, index))
+            pending = len(self._buffer)
+        if pending == self.batch_records:
+            self._wakeup.set()
+
+    def record(self, name: str, index: int, time_ms: float, value: float):
+        """``HistoryStore`` sink: ``name`` is "actual", "target" or "fan"."""
+        self.append(KIND_IDS[name], index, time_ms, value)
+
+    def flush(self) -> bool:
+        """Write the buffered records; True when a new segment was started."""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return False
+        batch.sort()
+        with self._write_lock:
+            handle = None
+            segment = None
+            try:
+                for record in batch:
+                    start = int(record[0] // self.segment_ms) * self.segment_ms
+                    if start != segment:
+                        if handle:
+                            handle.close()
+                        segment = start
+                        path = self._segment_path(start)
+                        keyframe = not os.path.exists(path)
+                        handle = open(path, "ab")
+                        if keyframe:
+                            for (kind, index), value in sorted(self._steps.items()):
+                                handle.write(RECORD.pack(start, value, kind, index))
+                    handle.write(RECORD.pack(*record))
+                    if record[2] in STEP_KINDS:
+                        self._steps[(record[2], record[3])] = record[1]
+            finally:
+                if handle:
+                    handle.close()
+        if segment != self._current_segment:
+            self._current_segment = segment
+            return True
+        return False
+
+    def _segment_path(self, start: int, compacted: bool = False) -> str:
+        return os.path.join(self.folder, "history-%d%s.bin" % (start // 1000, ".c" if compacted else ""))
+
+    def segments(self) -> list:
+        """(start ms, path, compacted) of every segment, oldest first."""
+        found = []
+        for name in os.listdir(self.folder):
+            match = _RE_SEGMENT.match(name)
+            if match:
+                found.append((int(match.group("start")) * 1000, os.path.join(self.folder, name), bool(match.group("compacted"))))
+        found.sort()
+        return found
+
+    def start_maintenance(self):
+        if self._running:
+            return
+        self._running = True
+        self._maintenance = threading.Thread(target=self._run, name="PIDTuneHistoryMaintenance")
+        self._maintenance.daemon = True
+        self._maintenance.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the maintenance thread after a last flush."""
+        self._running = False
+        self._wakeup.set()
+        if self._maintenance:
+            self._maintenance.join(timeout)
+            self._maintenance = None
+        self.flush()
+
+    def _run(self):
+        self.maintain()
+        maintained = time.time()
+        while self._running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                if self.flush() or time.time() - maintained >= self.segment_ms / 1000:
+                    self.maintain()
+                    maintained = time.time()
+            except (IOError, OSError):
+                if self._logger:
+                    self._logger.exception("Failed to write history segment")
+
+    def maintain(self, now: Optional[float] = None):
+        now_ms = (now if now is not None else time.time()) * 1000
+        for start, path, compacted in self.segments():
+            end = start + self.segment_ms
+            try:
+                if end < now_ms - self.retention_ms:
+                    os.remove(path)
+                elif not compacted and end < now_ms - self.compact_after_ms:
+                    self._compact(start, path)
+            except (IOError, OSError):
+                if self._logger:
+                    self._logger.exception("Failed to maintain history segment {}".format(path))
+
+    def _compact(self, start: int, path: str):
+        buckets = {}
+        with open(path, "rb") as handle:
+            data = handle.read()
+        usable = len(data) - len(data) % RECORD.size
+        for time_ms, value, kind, index in RECORD.iter_unpack(data[:usable]):
+            key = (kind, index, int(time_ms // self.compact_bucket_ms))
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = [(time_ms, value), (time_ms, value)]
+            else:
+                if value < bucket[0][1]:
+                    bucket[0] = (time_ms, value)
+                if value > bucket[1][1]:
+                    bucket[1] = (time_ms, value)
+        records = set()
+        for (kind, index, _), bucket in buckets.items():
+            for time_ms, value in bucket:
+                records.add((time_ms, value, kind, index))
+        target = self._segment_path(start, compacted=True)
+        with open(target + ".tmp", "wb") as handle:
+            for record in sorted(records):
+                handle.write(RECORD.pack(*record))
+        os.replace(target + ".tmp", target)
+        os.remove(path)
+
+    @staticmethod
+    def _bisect(view, count: int, time_ms: float) -> int:
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if _TIME.unpack_from(view, mid * RECORD.size)[0] < time_ms:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, start_ms: float, end_ms: float, series=None, points: int = 0) -> dict:
+        """Samples between ``start_ms`` and ``end_ms`` grouped by series id.
+
+        ``series`` restricts the result to the given ids ("actual:0", ...),
+        ``points`` downsamples every series to about that many points.
+        Target and fan series start with the value in force at ``start_ms``,
+        taken from the last change-point before it in the same segment.
+        """
+        wanted = None
+        if series:
+            wanted = set(filter(None, (parse_series_id(s) for s in series)))
+        if self._buffer:
+            self.flush()
+
+        columns = {}
+        before = {}
+        segments = self.segments()
+        # while a segment is being compacted, both files can be listed
+        compacted = {start for start, _, is_compacted in segments if is_compacted}
+        for seg_start, path, is_compacted in segments:
+            if seg_start + self.segment_ms < start_ms - ORDER_SLACK_MS or seg_start > end_ms:
+                continue
+            if not is_compacted and seg_start in compacted:
+                continue
+            try:
+                self._read_segment(path, start_ms, end_ms, wanted, columns, before if seg_start <= start_ms else None)
+            except (IOError, OSError, ValueError):
+                # removed or replaced by the maintenance thread since it was listed
+                continue
+
+        for key, (_, value) in before.items():
+            column = columns.setdefault(key, ([], []))
+            column[0].insert(0, start_ms)
+            column[1].insert(0, value)
+
+        result = {}
+        for (kind, index), (times, values) in columns.items():
+            if len(times) > 1 and any(times[i] > times[i + 1] for i in range(len(times) - 1)):
+                ordered = sorted(zip(times, values))
+                times = [t for t, _ in ordered]
+                values = [v for _, v in ordered]
+            result[series_id(kind, index)] = minmax_downsample(times, values, points)
+        return result
+
+    def _read_segment(self, path: str, start_ms: float, end_ms: float, wanted: Optional[set], columns: dict,
+                      before: Optional[dict] = None):
+        """Adds the records between ``start_ms`` and ``end_ms`` to ``columns``.
+
+        With ``before``, the segment is read from its start and the last step
+        record before ``start_ms`` of every series is kept there as (time, value).
+        """
+        with open(path, "rb") as handle:
+            count = os.fstat(handle.fileno()).st_size // RECORD.size
+            if not count:
+                return
+            with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                first = 0 if before is not None else self._bisect(view, count, start_ms - ORDER_SLACK_MS)
+                last = self._bisect(view, count, end_ms + ORDER_SLACK_MS)
+                for time_ms, value, kind, index in RECORD.iter_unpack(view[first * RECORD.size:last * RECORD.size]):
+                    if time_ms < start_ms:
+                        if before is not None and kind in STEP_KINDS and (wanted is None or (kind, index) in wanted):
+                            known = before.get((kind, index))
+                            if known is None or time_ms >= known[0]:
+                                before[(kind, index)] = (time_ms, value)
+                        continue
+                    if time_ms > end_ms:
+                        continue
+                    key = (kind, index)
+                    if wanted is not None and key not in wanted:
+                        continue
+                    column = columns.get(key)
+                    if column is None:
+                        column = columns[key] = ([], [])
+                    column[0].append(time_ms)
+                    column[1].append(value)
+
+    def disk_usage(self) -> int:
+        total = 0
+        for _, path, _ in self.segments():
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
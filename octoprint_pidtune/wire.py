@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Compact encoding of graph series for the frontend
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import base64
+import operator
+import sys
+from array import array
+
+FORMAT_JSON = "json"
+FORMAT_B64 = "b64"
+_DELTA_TYPES = {2: "H", 4: "I", 8: "d"}
+
+
+def _b64(column: array) -> str:
+    # typed arrays in the browser are little-endian
+    if sys.byteorder != "little":
+        column.byteswap()
+    return base64.b64encode(column.tobytes()).decode("ascii")
+
+
+def encode_columns(times, values) -> dict:
+    """Base64 series: integer ms as ``t0`` plus deltas, values as float32.
+
+    Deltas are uint16 (``dtw`` 2) when they all fit, uint32 (``dtw`` 4)
+    or, for gaps of weeks, float64 (``dtw`` 8) otherwise.
+    """
+    stamps = array("q", map(int, times))
+    if not stamps:
+        return {"n": 0, "t0": 0, "dtw": 2, "dt": "", "v": ""}
+    deltas = list(map(operator.sub, stamps[1:], stamps[:-1]))
+    largest = max(deltas) if deltas else 0
+    width = 2 if largest < 0x10000 else 4 if largest < 0x100000000 else 8
+    return {
+        "n"  : len(stamps),
+        "t0" : stamps[0],
+        "dtw": width,
+        "dt" : _b64(array(_DELTA_TYPES[width], deltas)),
+        "v"  : _b64(array("f", values)),
+    }
+
+
+def encode_points(points: list) -> dict:
+    """``encode_columns`` of a list of [time, value] pairs."""
+    return encode_columns([p[0] for p in points], [p[1] for p in points])
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Simple API commands, called the way OctoPrint's blueprint calls them
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import json
+import time
+
+import flask
+import pytest
+
+import plugin_stubs
+
+
+@pytest.fixture
+def plugin(tmp_path):
+    plugin = plugin_stubs.make_plugin(data_folder=str(tmp_path))
+    plugin.on_after_startup()
+    now = time.time()
+    plugin.process_temp_data({"data": {"serverTime": now, "temps": [
+        {"time": int(now), "tool0": {"actual": 25.0, "target": 0.0},
+         "tool1": {"actual": 25.0, "target": 0.0}, "bed": {"actual": 24.0, "target": 0.0}}
+    ]}})
+    yield plugin
+    plugin.on_shutdown()
+
+
+def call(plugin, command: str, data) -> tuple:
+    with flask.Flask(__name__).test_request_context():
+        response = flask.make_response(plugin.on_api_command(command, {"data": data}))
+        return response.status_code, json.loads(response.get_data())
+
+
+def test_update(plugin):
+    status, body = call(plugin, "update", {"points": "100"})
+    assert status == 200 and body["success"]
+    assert json.loads(body["data"])["data"][0]["id"] == "actual:0"
+
+
+@pytest.mark.parametrize("data", [
+    {"points": "many"},
+    {"points": -1},
+    {"points": float("inf")},
+    {"cursor": "abc"},
+    {"format": "xml"},
+])
+def test_update_rejects_bad_input(plugin, data):
+    status, body = call(plugin, "update", data)
+    assert status == 400
+    assert not body["success"]
+    assert body["error"].startswith("Invalid")
+
+
+def test_update_rejects_negative_span(plugin):
+    status, body = call(plugin, "update", {"span": -3600000})
+    assert status == 400
+    assert body["error"] == "Invalid span: -3600000"
+
+
+def test_history_range(plugin):
+    end = time.time() * 1000 + 1000
+    status, body = call(plugin, "history_range", {"start": end - 60000, "end": end, "series": ["actual:0"]})
+    assert status == 200
+    assert list(json.loads(body["data"])["series"]) == ["actual:0"]
+
+
+@pytest.mark.parametrize("data", [
+    {"start": "yesterday"},
+    {"end": float("nan")},
+    {"points": "1.5"},
+    {"series": "actual:0"},
+])
+def test_history_range_rejects_bad_input(plugin, data):
+    status, body = call(plugin, "history_range", data)
+    assert status == 400
+    assert body["error"].startswith("Invalid")
+
+
+def test_replay_rejects_bad_speed(plugin):
+    plugin.sessions.start("M303 E0 S200 C3", 1700000000000)
+    plugin.sessions.finish("completed", [], 1700000001000)
+    plugin.sessions.close_if_due(1700000010000)
+    session_id = plugin.sessions.list()[0]["id"]
+    status, body = call(plugin, "replay_session", {"id": session_id, "speed": "fast"})
+    assert status == 400
+    assert body["error"] == "Invalid speed: 'fast'"
+    assert plugin._replay is None
+
+
+@pytest.mark.parametrize("data", [
+    {"heater": "bed"},
+    {"start": "now"},
+    {"power": -1},
+])
+def test_identify_rejects_bad_input(plugin, data):
+    status, body = call(plugin, "identify", data)
+    assert status == 400
+    assert body["error"].startswith("Invalid")
+
+
+def test_identify_without_enough_data_is_not_a_bad_request(plugin):
+    status, body = call(plugin, "identify", {"heater": 0})
+    assert status == 200
+    assert not body["success"]
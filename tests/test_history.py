@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Graph history series, rollup tiers, snapshots and memory budget
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+from octoprint_pidtune.history import COMPACT_MIN, HistoryStore, RollupSeries, StepSeries, TimeSeries
+
+
+def filled(count: int, window: float = 0) -> TimeSeries:
+    series = TimeSeries(window)
+    for i in range(count):
+        series.append(i * 1000, float(i))
+    return series
+
+
+def test_older_samples_are_ignored():
+    series = filled(3)
+    assert not series.append(2000, 9.0)
+    assert not series.append(1500, 9.0)
+    assert series.points() == [[0, 0.0], [1000, 1.0], [2000, 2.0]]
+
+
+def test_cursor_returns_only_new_samples():
+    series = filled(3)
+    cursor = series.next_seq
+    series.append(3000, 3.0)
+    series.append(4000, 4.0)
+    assert series.start_seq(cursor) == cursor
+    assert series.points(cursor) == [[3000, 3.0], [4000, 4.0]]
+    assert series.points(series.next_seq) == []
+
+
+def test_sequence_numbers_survive_compaction():
+    count = 3 * COMPACT_MIN
+    series = filled(count, window=COMPACT_MIN * 1000)
+    cursor = series.next_seq - 2
+    series.evict(count * 1000)
+    assert series._head == 0
+    assert series.first_seq == count - COMPACT_MIN
+    assert series.next_seq == count
+    assert series.points(cursor) == [[(count - 2) * 1000, count - 2.0], [(count - 1) * 1000, count - 1.0]]
+    # a cursor older than the window gets everything left
+    assert series.start_seq(5) == series.first_seq
+    assert len(series.points(5)) == COMPACT_MIN
+
+
+def test_snapshot_keeps_its_samples_through_compaction():
+    count = 3 * COMPACT_MIN
+    series = filled(count, window=COMPACT_MIN * 1000)
+    snapshot = series.snapshot()
+    series.evict(count * 1000)
+    series.append(count * 1000, 0.0)
+    assert len(snapshot) == count
+    assert snapshot.last() == ((count - 1) * 1000, count - 1.0)
+
+
+def test_step_series_stores_change_points_only():
+    series = StepSeries()
+    assert series.append(0, 0.0)
+    assert not series.append(1000, 0.0)
+    assert series.append(2000, 200.0)
+    assert not series.append(3000, 200.0)
+    assert len(series) == 2
+    assert series.points() == [[0, 0.0], [2000, 0.0], [2000, 200.0]]
+    assert series.tail() == [3000, 200.0]
+
+
+def test_step_series_keeps_the_change_before_the_window():
+    series = StepSeries(window=10000)
+    series.append(0, 200.0)
+    series.append(1000, 210.0)
+    for t in range(2000, 30000, 1000):
+        series.append(t, 210.0)
+    series.evict(30000)
+    assert series.first() == (1000, 210.0)
+
+
+def test_step_series_summary_is_time_weighted():
+    series = StepSeries()
+    series.append(0, 0.0)
+    series.append(1000, 100.0)
+    series.append(4000, 100.0)
+    summary = series.summary()
+    assert summary["mean"] == 75.0
+    assert (summary["min"], summary["max"]) == (0.0, 100.0)
+
+
+def test_rollup_buckets_read_as_min_and_max_in_order():
+    rollup = RollupSeries(10000, 0)
+    for t, value in ((0, 5.0), (3000, 9.0), (6000, 1.0), (12000, 4.0), (15000, 6.0), (21000, 2.0)):
+        rollup.add(t, value)
+    assert len(rollup) == 2
+    # max came before min in the first bucket, min before max in the second
+    assert rollup.points() == [[0, 9.0], [5000, 1.0], [10000, 4.0], [15000, 6.0]]
+    assert rollup.tail() == [20000, 2.0]
+    assert rollup.next_seq == 4
+    assert rollup.points(2) == [[10000, 4.0], [15000, 6.0]]
+    assert rollup.seq_at(10000) == 2
+    assert rollup.max() == 9.0
+
+
+def test_store_publishes_frozen_views():
+    store = HistoryStore(window=60000)
+    store.reset([0])
+    store.add_temperature(0, 1000, 25.0, 0.0, 1000)
+    view = store.publish()
+    store.add_temperature(0, 2000, 26.0, 0.0, 2000)
+    assert len(view.actual[0]) == 1
+    assert len(store.publish().actual[0]) == 2
+    assert store.view() is not view
+
+
+def test_reset_changes_the_epoch():
+    store = HistoryStore()
+    store.reset([0])
+    epoch = store.epoch
+    store.reset([0, -1])
+    assert store.epoch > epoch
+    assert sorted(store.view().actual) == [-1, 0]
+
+
+def test_sink_gets_change_points():
+    store = HistoryStore()
+    store.reset([0])
+    records = []
+    store.sink = lambda *record: records.append(record)
+    for t in (1000, 2000, 3000):
+        store.add_temperature(0, t, 25.0, 200.0, t)
+    assert records == [
+        ("actual", 0, 1000, 25.0), ("target", 0, 1000, 200.0),
+        ("actual", 0, 2000, 25.0),
+        ("actual", 0, 3000, 25.0),
+    ]
+
+
+def test_memory_budget_drops_the_oldest_raw_samples_first():
+    hour = 3600 * 1000
+    store = HistoryStore(memory_budget=64 * 1024)
+    store.reset([0])
+    for t in range(0, hour, 1000):
+        store.add_temperature(0, t, 200.0 + t % 7, 200.0, t)
+    store.enforce_budget(hour)
+    view = store.publish()
+    assert view.data_size() <= 64 * 1024
+    assert view.budget_trims > 0
+    # the raw series is cut first and the newest five minutes are kept
+    assert view.actual[0].first()[0] > 0
+    assert view.actual[0].last()[0] == hour - 1000
+    assert view.rollup("actual", 0, 0).first()[0] == 0
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Ingestion ring overflow, batching and the worker thread
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import logging
+import threading
+
+from octoprint_pidtune.ingest import LINE_RECEIVED, LINE_SENT, IngestionQueue
+
+
+def make_queue(handled: list, **kwargs) -> IngestionQueue:
+    return IngestionQueue(logging.getLogger("test_ingest"),
+                          lambda kind, ts, line, gcode, tags: handled.append((kind, line, gcode, tags)), **kwargs)
+
+
+def test_full_ring_drops_the_oldest_lines():
+    handled = []
+    queue = make_queue(handled, maxlen=3)
+    for i in range(5):
+        queue.push(LINE_RECEIVED, "line %d" % i)
+    assert queue.stats() == {"pending": 3, "pushed": 5, "dropped": 2, "processed": 0, "batches": 0}
+
+    assert queue.drain() == 3
+    assert [line for _, line, _, _ in handled] == ["line 2", "line 3", "line 4"]
+    assert queue.stats()["processed"] == 3
+
+
+def test_gcode_and_tags_reach_the_handler():
+    handled = []
+    queue = make_queue(handled)
+    tags = {"source:plugin", "plugin:pidtune"}
+    queue.push(LINE_SENT, "M303 E0 S200 C8", "M303", tags)
+    queue.drain()
+    assert handled == [(LINE_SENT, "M303 E0 S200 C8", "M303", tags)]
+
+
+def test_drain_is_limited_to_a_batch():
+    handled = []
+    queue = make_queue(handled, batch_size=4)
+    for i in range(10):
+        queue.push(LINE_RECEIVED, "ok")
+    assert [queue.drain() for _ in range(4)] == [4, 4, 2, 0]
+    assert queue.batches == 3
+
+
+def test_handler_errors_do_not_stop_the_batch():
+    handled = []
+
+    def handler(kind, ts, line, gcode, tags):
+        if line == "bad":
+            raise ValueError(line)
+        handled.append(line)
+
+    queue = IngestionQueue(logging.getLogger("test_ingest"), handler)
+    for line in ("first", "bad", "last"):
+        queue.push(LINE_RECEIVED, line)
+    assert queue.drain() == 3
+    assert handled == ["first", "last"]
+
+
+def test_worker_thread_processes_pushed_lines():
+    done = threading.Event()
+    handled = []
+
+    def handler(kind, ts, line, gcode, tags):
+        handled.append(line)
+        if len(handled) == 20:
+            done.set()
+
+    queue = IngestionQueue(logging.getLogger("test_ingest"), handler, idle_timeout=0.05)
+    queue.start()
+    try:
+        for i in range(20):
+            queue.push(LINE_RECEIVED, "line %d" % i)
+        assert done.wait(2)
+    finally:
+        queue.stop()
+    assert handled == ["line %d" % i for i in range(20)]
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Parser tests on lines as Marlin sends them to the received hook
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import logging
+
+from octoprint_pidtune.parser import Parser
+
+
+def make_parser(hotend_count: int = 2) -> Parser:
+    return Parser(logging.getLogger("test_parser"), has_heatedbed=True, hotend_count=hotend_count)
+
+
+def start_tuning(parser: Parser, heater: int):
+    parser.current_heater = heater
+    parser.auto_state_pid("started")
+
+
+def test_autotune_cycle_line():
+    parser = make_parser()
+    start_tuning(parser, 0)
+    assert parser.parse_pid_data(" bias: 92 d: 92 min: 196.32 max: 203.73 Ku: 31.83 Tu: 29.60")
+    tool = parser.get_pids_data()[0]
+    assert (tool["bias"], tool["min"], tool["max"]) == (92, 196.32, 203.73)
+    assert (tool["ku"], tool["tu"]) == (31.83, 29.60)
+
+
+def test_autotune_cycle_line_without_leading_space():
+    parser = make_parser()
+    start_tuning(parser, 1)
+    assert parser.parse_pid_data("bias: 110 d: 110 min: 198.80 max: 201.21")
+    assert parser.get_pids_data()[1]["max"] == 201.21
+
+
+def test_autotune_finished():
+    parser = make_parser()
+    start_tuning(parser, 0)
+    assert parser.parse_pid_data("PID Autotune finished! Put the last Kp, Ki and Kd constants from below into Configuration.h")
+    assert parser.auto_state_pid() == "completed"
+
+
+def test_autotune_failed():
+    parser = make_parser()
+    start_tuning(parser, 0)
+    assert parser.parse_pid_data("PID Autotune failed! Temperature too high")
+    assert parser.auto_state_pid() == "failed"
+
+
+def test_m301_echo_without_trailing_space():
+    parser = make_parser()
+    assert parser.parse_pid_data("echo: M301 P21.73 I1.54 D76.55")
+    tool = parser.get_pids_data()[0]
+    assert (tool["kp"], tool["ki"], tool["kd"]) == (21.73, 1.54, 76.55)
+
+
+def test_m304_from_m503():
+    parser = make_parser()
+    assert parser.parse_pid_data("echo:  M304 P131.06 I11.79 D971.23")
+    bed = parser.get_pids_data()[-1]
+    assert (bed["kp"], bed["ki"], bed["kd"]) == (131.06, 11.79, 971.23)
+
+
+def test_pid_report_goes_to_its_extruder():
+    parser = make_parser()
+    parser.current_heater = 0
+    assert parser.parse_pid_data("echo: e:1 p:19.56 i:1.62 d:59.04")
+    pids = parser.get_pids_data()
+    assert (pids[1]["kp"], pids[1]["ki"], pids[1]["kd"]) == (19.56, 1.62, 59.04)
+    assert pids[0]["kp"] is None
+
+
+def test_temperature_report_is_rejected():
+    parser = make_parser()
+    assert not parser.parse_pid_data(" T:203.12 /210.00 B:60.02 /60.00 @:64 B@:0")
+    assert not parser.parse_pid_data("ok")
+
+
+def test_tuning_lines_are_ignored_outside_autotune():
+    parser = make_parser()
+    assert not parser.parse_pid_data("bias: 110 d: 110 min: 198.80 max: 201.21")
+
+
+def test_unchanged_m301_keeps_snapshot():
+    parser = make_parser()
+    line = "echo: M301 P21.73 I1.54 D76.55"
+    assert parser.parse_pid_data(line)
+    assert parser.last_delta["changes"] == {"kp": 21.73, "ki": 1.54, "kd": 76.55}
+    pids = parser.get_pids_data()
+    tool = pids[0]
+    version = parser.pids_version
+
+    assert parser.parse_pid_data(line)
+    assert parser.last_delta is None
+    assert parser.pids_version == version
+    assert parser.get_pids_data() is pids
+    assert parser.get_pids_data()[0] is tool
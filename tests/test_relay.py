@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Relay autotune state machine on synthetic temperature swings
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import pytest
+
+from octoprint_pidtune.relay import STATE_COMPLETED, STATE_FAILED, RelayAutotune, RelayTuner
+
+
+def ramp(tuner: RelayTuner, now: float, temp: float, to: float) -> tuple:
+    """Moves by one degree per second from ``temp`` to ``to``."""
+    step = 1 if to > temp else -1
+    while temp != to:
+        temp += step
+        now += 1000
+        tuner.update(now, temp)
+    return now, temp
+
+
+def test_target_too_close_to_max_temp():
+    with pytest.raises(ValueError):
+        RelayTuner(0, 260, 275)
+
+
+def test_every_swing_after_heat_up_counts():
+    tuner = RelayTuner(0, 200, 275, cycles=3, hysteresis=1.0)
+    assert tuner.start(0) == "M104 T0 S216"
+    now, temp = ramp(tuner, 0, 25, 210)
+    # back under the band closes the heat-up, then one 24 s swing up to 207 and two 20 s ones up to 205
+    now, temp = ramp(tuner, now, temp, 195)
+    for high in (207, 205, 205):
+        now, temp = ramp(tuner, now, temp, high)
+        now, temp = ramp(tuner, now, temp, 195)
+    assert tuner.state == STATE_COMPLETED
+    assert len(tuner.cycles) == 3
+    assert tuner.result["amplitude"] == pytest.approx((12 + 10 + 10) / 3 / 2)
+    assert tuner.result["tu"] == pytest.approx((24 + 20 + 20) / 3)
+
+
+def test_safety_limit_stops_every_heater():
+    autotune = RelayAutotune([RelayTuner(0, 200, 275), RelayTuner(-1, 60, 120)])
+    autotune.start(0)
+    commands = autotune.update(0, 1000, 271)
+    assert sorted(commands) == ["M104 T0 S0", "M140 S0"]
+    assert autotune.done
+    assert all(tuner.state == STATE_FAILED for tuner in autotune.tuners.values())
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+ETag and gzip handling of the JSON API responses
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import gzip
+import json
+
+import flask
+import pytest
+
+from octoprint_pidtune.responses import (GZIP_MIN_SIZE, is_not_modified, json_response, make_etag,
+                                         not_modified)
+
+
+@pytest.fixture
+def app():
+    return flask.Flask(__name__)
+
+
+def test_etag_depends_on_every_part():
+    assert make_etag(1, 2) == make_etag(1, 2)
+    assert make_etag(1, 2) != make_etag(1, 3)
+    assert make_etag(1, 2).startswith('"') and make_etag(1, 2).endswith('"')
+
+
+def test_if_none_match(app):
+    etag = make_etag("history", 4)
+    with app.test_request_context(headers={"If-None-Match": '"other", %s' % etag}):
+        assert is_not_modified(flask.request, etag)
+    with app.test_request_context(headers={"If-None-Match": "*"}):
+        assert is_not_modified(flask.request, etag)
+    with app.test_request_context(headers={"If-None-Match": '"other"'}):
+        assert not is_not_modified(flask.request, etag)
+    with app.test_request_context():
+        assert not is_not_modified(flask.request, etag)
+
+
+def test_not_modified_keeps_the_etag(app):
+    with app.test_request_context():
+        response = not_modified('"abc"')
+    assert response.status_code == 304
+    assert response.headers["ETag"] == '"abc"'
+    assert response.get_data() == b""
+
+
+def test_small_payload_is_not_compressed(app):
+    with app.test_request_context(headers={"Accept-Encoding": "gzip, deflate"}):
+        response = json_response(flask.request, {"success": True}, etag='"abc"')
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["ETag"] == '"abc"'
+    assert response.mimetype == "application/json"
+    assert json.loads(response.get_data()) == {"success": True}
+
+
+def test_large_payload_is_gzipped_when_accepted(app):
+    payload = {"data": list(range(GZIP_MIN_SIZE))}
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = json_response(flask.request, payload)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert json.loads(gzip.decompress(response.get_data())) == payload
+
+    with app.test_request_context():
+        response = json_response(flask.request, payload)
+    assert "Content-Encoding" not in response.headers
+    assert json.loads(response.get_data()) == payload
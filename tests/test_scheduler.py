@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Autotune queue: start conditions, results, cancel and the per-job deadline
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+from octoprint_pidtune.scheduler import (JOB_CANCELLED, JOB_DONE, JOB_FAILED, JOB_RUNNING, JOB_WAITING,
+                                         AutotuneJob, AutotuneScheduler)
+
+CYCLES = [{"ku": 31.83, "tu": 29.6}, {"ku": 31.9, "tu": 29.5}]
+
+
+def make_scheduler(*jobs, **kwargs) -> tuple:
+    sent = []
+    return AutotuneScheduler(list(jobs), sent.extend, **kwargs), sent
+
+
+def test_cold_heater_starts_right_away():
+    scheduler, sent = make_scheduler(AutotuneJob(0, 200, cycles=5, fan=255))
+    assert scheduler.add_sample(0, 1000, 30.0)
+    assert scheduler.current.state == JOB_RUNNING
+    assert sent == ["M106 S255", "M303 E0 S200 C5"]
+
+
+def test_hot_heater_waits_until_stable():
+    job = AutotuneJob(-1, 100)
+    scheduler, sent = make_scheduler(job)
+    for second in range(20):
+        assert not scheduler.add_sample(-1, second * 1000, 70.0 - second * 0.5)
+    assert job.state == JOB_WAITING
+    for second in range(20, 60):
+        scheduler.add_sample(-1, second * 1000, 60.0)
+    assert job.state == JOB_RUNNING
+    assert sent == ["M303 E-1 S100 C8"]
+
+
+def test_jobs_run_back_to_back():
+    first, second = AutotuneJob(0, 200, fan=255), AutotuneJob(-1, 60)
+    scheduler, sent = make_scheduler(first, second)
+    scheduler.add_sample(0, 1000, 25.0)
+    assert scheduler.finish(0, "completed", CYCLES, 300000)
+    assert first.state == JOB_DONE
+    assert first.result["ku"] == 31.9
+    assert sent[-1] == "M106 S0"
+
+    scheduler.add_sample(-1, 301000, 25.0)
+    assert scheduler.finish(-1, "failed", [], 400000)
+    assert second.state == JOB_FAILED
+    assert scheduler.done
+    assert scheduler.summary()["progress"] == 1.0
+
+
+def test_cancel_stops_the_running_job():
+    running, pending = AutotuneJob(0, 200, fan=255), AutotuneJob(1, 200)
+    scheduler, sent = make_scheduler(running, pending)
+    scheduler.add_sample(0, 1000, 25.0)
+    scheduler.cancel()
+    assert (running.state, pending.state) == (JOB_CANCELLED, JOB_CANCELLED)
+    assert sent[-3:] == ["M108", "M104 T0 S0", "M106 S0"]
+    assert scheduler.done
+
+
+def test_stuck_job_fails_at_its_deadline():
+    stuck, following = AutotuneJob(0, 200, cycles=5, fan=255), AutotuneJob(1, 200)
+    scheduler, sent = make_scheduler(stuck, following, timeout_factor=2.0)
+    scheduler.add_sample(0, 0, 25.0)
+    # 175 degrees at 2 degrees/s then 5 cycles of 40 s
+    assert stuck.deadline == (87.5 + 200) * 2 * 1000
+
+    assert not scheduler.add_sample(0, stuck.deadline, 200.0)
+    assert stuck.state == JOB_RUNNING
+    assert scheduler.add_sample(0, stuck.deadline + 1000, 200.0)
+    assert stuck.state == JOB_FAILED
+    assert stuck.summary()["timed_out"]
+    assert sent[-3:] == ["M108", "M104 T0 S0", "M106 S0"]
+
+    scheduler.add_sample(1, stuck.deadline + 2000, 25.0)
+    assert following.state == JOB_RUNNING
+    assert sent[-1] == "M303 E1 S200 C8"
+    # the late result of the stuck job is not taken for the next one
+    assert not scheduler.finish(0, "completed", CYCLES, stuck.deadline + 3000)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Autotune session recording, storage and replay
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import logging
+import os
+
+from octoprint_pidtune.parser import Parser
+from octoprint_pidtune.sessions import SessionRecorder, SessionReplay, parse_m303
+
+START_MS = 1700000000000.0
+
+
+def make_recorder(tmp_path, **kwargs) -> SessionRecorder:
+    return SessionRecorder(str(tmp_path), logging.getLogger("test_sessions"), **kwargs)
+
+
+def record(recorder: SessionRecorder, command: str, start_ms: float = START_MS) -> dict:
+    session = recorder.start(command, start_ms)
+    for i in range(1, 4):
+        recorder.add_sample(session["heater"], start_ms + i * 1000, 190.0 + i, 200.0)
+    recorder.add_line(start_ms + 3500, " bias: 92 d: 92 min: 196.32 max: 203.73 Ku: 31.83 Tu: 29.60", True)
+    recorder.finish("completed", [{"ku": 31.83, "tu": 29.6}], start_ms + 4000)
+    recorder.add_line(start_ms + 4500, "#define DEFAULT_Kp 21.73", False)
+    recorder.close_if_due(start_ms + 7000)
+    return session
+
+
+def test_parse_m303_in_any_order():
+    assert parse_m303("M303 E1 S210 C8") == {"heater": 1, "target": 210.0, "cycles": 8}
+    assert parse_m303("m303 c5 s60 e-1") == {"heater": -1, "target": 60.0, "cycles": 5}
+    assert parse_m303("M303 S200") == {"heater": 0, "target": 200.0, "cycles": None}
+
+
+def test_ids_stay_unique_within_a_millisecond(tmp_path):
+    recorder = make_recorder(tmp_path)
+    first = record(recorder, "M303 E0 S200 C3")["id"]
+    second = record(recorder, "M303 E0 S200 C3")["id"]
+    bed = record(recorder, "M303 E-1 S60 C3")["id"]
+    assert second == first + "-2"
+    assert bed.endswith("_B")
+    assert first.endswith("_E0")
+
+
+def test_session_is_saved_after_the_grace_period(tmp_path):
+    saved = []
+    recorder = make_recorder(tmp_path, on_saved=saved.append)
+    session = recorder.start("M303 E0 S200 C3", START_MS)
+    recorder.add_sample(0, START_MS + 1000, 191.234, 200.0)
+    recorder.add_sample(1, START_MS + 2000, 50.0, 0.0)
+    recorder.finish("completed", [], START_MS + 3000)
+    recorder.add_line(START_MS + 3500, "Kp: 21.73 Ki: 1.54 Kd: 76.55", False)
+    recorder.close_if_due(START_MS + 4000)
+    assert recorder.active and not saved
+
+    recorder.close_if_due(START_MS + 5000)
+    assert not recorder.active
+    loaded = recorder.load(session["id"])
+    assert saved == [loaded]
+    assert loaded["status"] == "completed"
+    assert loaded["samples"]["dt"] == [1000]
+    assert loaded["samples"]["actual"] == [191.23]
+    assert loaded["result"] == {"kp": 21.73, "ki": 1.54, "kd": 76.55}
+    assert os.path.isfile(os.path.join(str(tmp_path), session["id"] + ".json.gz"))
+
+
+def test_new_start_aborts_the_running_session(tmp_path):
+    recorder = make_recorder(tmp_path)
+    first = recorder.start("M303 E0 S200 C3", START_MS)
+    recorder.add_sample(0, START_MS + 1000, 191.0, 200.0)
+    recorder.start("M303 E1 S200 C3", START_MS + 2000)
+    aborted = recorder.load(first["id"])
+    assert aborted["status"] == "aborted"
+    assert aborted["finished"] == int(START_MS + 1000)
+
+
+def test_list_is_newest_first_and_pruned(tmp_path):
+    recorder = make_recorder(tmp_path, max_sessions=2)
+    ids = [record(recorder, "M303 E0 S200 C3", START_MS + i * 60000)["id"] for i in range(3)]
+    listed = recorder.list()
+    assert [s["id"] for s in listed] == ids[:0:-1]
+    assert listed[0]["command"] == "M303 E0 S200 C3"
+    assert recorder.load(ids[0]) is None
+    assert recorder.load("../escape") is None
+
+
+def test_replay_feeds_parser_and_history(tmp_path):
+    recorder = make_recorder(tmp_path)
+    session = recorder.load(record(recorder, "M303 E0 S200 C3")["id"])
+    parser = Parser(logging.getLogger("test_sessions"), has_heatedbed=True, hotend_count=1)
+    frames = []
+    replay = SessionReplay(session, parser, lambda h, p, progress, done: frames.append((progress, done, len(h.actual[0]))), speed=0)
+    replay.run()
+
+    progress, done, samples = frames[-1]
+    assert (progress, done) == (1.0, True)
+    assert samples == 3
+    assert parser.get_pids_data()[0]["ku"] == 31.83
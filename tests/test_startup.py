@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Plugin startup and shutdown with stub printer, settings and plugin manager
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import time
+
+import pytest
+
+import plugin_stubs
+from octoprint_pidtune import PidtunePlugin
+from octoprint_pidtune.ingest import LINE_RECEIVED, LINE_SENT
+
+
+def make_plugin(tmp_path) -> PidtunePlugin:
+    return plugin_stubs.make_plugin(data_folder=str(tmp_path))
+
+
+def test_on_after_startup_starts_everything(tmp_path):
+    plugin = make_plugin(tmp_path)
+    plugin.on_after_startup()
+    try:
+        assert plugin.started
+        assert plugin._printer.callbacks
+        assert plugin._parser is not None
+        assert plugin._stream_timer is not None
+        assert plugin._stream_cursor["epoch"] == plugin.history.epoch
+
+        now = time.time()
+        plugin.process_temp_data({"data": {"serverTime": now, "temps": [
+            {"time": int(now), "tool0": {"actual": 25.0, "target": 0.0}, "bed": {"actual": 24.0, "target": 0.0}}
+        ]}})
+        assert len(plugin.history.view().actual[0]) == 1
+        assert [s["id"] for s in plugin.updateplot()][:2] == ["actual:0", "target:0"]
+    finally:
+        plugin.on_shutdown()
+    assert plugin._stream_timer is None
+
+
+def test_update_ignores_cursor_of_another_tier(tmp_path):
+    plugin = make_plugin(tmp_path)
+    plugin.on_after_startup()
+    try:
+        now = time.time()
+        for i in range(3):
+            plugin.process_temp_data({"data": {"serverTime": now + i, "temps": [
+                {"time": int(now) + i, "tool0": {"actual": 25.0 + i, "target": 0.0}, "bed": {"actual": 24.0, "target": 0.0}}
+            ]}})
+        history = plugin.history.view()
+        raw = plugin._history_cursor(plugin.updateplot(history=history), history)
+        assert [len(s["data"]) for s in plugin.updateplot(raw) if s["id"] == "actual:0"] == [0]
+
+        rollup = dict(raw, tier="10s")
+        actual = [s for s in plugin.updateplot(rollup) if s["id"] == "actual:0"][0]
+        assert actual["start"] == actual["first"]
+        assert len(actual["data"]) == 3
+    finally:
+        plugin.on_shutdown()
+
+
+def test_shutdown_switches_relay_heaters_off(tmp_path):
+    plugin = make_plugin(tmp_path)
+    plugin.on_after_startup()
+    plugin.start_relay_autotune([{"heater": 0, "target": 200}, {"heater": -1, "target": 60}])
+    plugin.on_shutdown()
+    assert plugin._relay.done
+    assert plugin._printer.sent[-2:] == ["M104 T0 S0", "M140 S0"]
+
+
+def test_disconnect_cancels_autotune_queue(tmp_path):
+    plugin = make_plugin(tmp_path)
+    plugin.on_after_startup()
+    try:
+        plugin.start_autotune_queue([{"heater": 0, "target": 200}])
+        plugin.process_state_data({"data": {"state": {"flags": {"closedOrError": True, "operational": False}}}})
+        assert plugin._scheduler.done
+        assert plugin._scheduler.cancelled
+    finally:
+        plugin.on_shutdown()
+
+
+def test_relay_refused_during_firmware_autotune(tmp_path):
+    plugin = make_plugin(tmp_path)
+    plugin.on_after_startup()
+    try:
+        plugin._parser.start_tuning(0)
+        with pytest.raises(ValueError):
+            plugin.start_relay_autotune([{"heater": 0, "target": 200}])
+        assert plugin._relay is None
+    finally:
+        plugin.on_shutdown()
+
+
+def run_converging_autotune(plugin, tags=None):
+    plugin.process_ingested_line(LINE_SENT, time.time(), "M303 E0 S200 C8", "M303", tags)
+    for _ in range(4):
+        plugin.process_ingested_line(LINE_RECEIVED, time.time(), " bias: 92 d: 92 min: 196.32 max: 203.73 Ku: 31.83 Tu: 29.60")
+
+
+def test_early_stop_is_off_by_default(tmp_path):
+    plugin = make_plugin(tmp_path)
+    plugin.on_after_startup()
+    try:
+        assert not plugin.early_stop
+        run_converging_autotune(plugin, {"source:plugin", "plugin:pidtune"})
+        assert "M108" not in plugin._printer.sent
+    finally:
+        plugin.on_shutdown()
+
+
+def test_early_stop_only_stops_own_autotunes(tmp_path):
+    plugin = make_plugin(tmp_path)
+    plugin._settings.values["early_stop"] = True
+    plugin.on_after_startup()
+    try:
+        run_converging_autotune(plugin, {"source:api"})
+        assert "M108" not in plugin._printer.sent
+        assert plugin._parser.auto_state_pid() == "started"
+
+        run_converging_autotune(plugin, {"source:plugin", "plugin:pidtune"})
+        assert "M108" in plugin._printer.sent
+        assert plugin._parser.auto_state_pid() == "converged"
+    finally:
+        plugin.on_shutdown()
+
+
+def test_fan_speeds_are_published_with_the_history(tmp_path):
+    plugin = make_plugin(tmp_path)
+    plugin.on_after_startup()
+    try:
+        plugin.parse_gcode("M106 P1 S255", "M106")
+        view = plugin.history.view()
+        now = time.time()
+        plugin.process_temp_data({"data": {"serverTime": now, "temps": [
+            {"time": int(now), "tool0": {"actual": 25.0, "target": 0.0},
+             "tool1": {"actual": 25.0, "target": 0.0}, "bed": {"actual": 24.0, "target": 0.0}}
+        ]}})
+        assert view.fan_speeds == {0: 0}
+        assert plugin.history.view().fan_speeds == {0: 0, 1: 100}
+        assert [s["id"] for s in plugin.updateplot() if s["id"].startswith("fan:")] == ["fan:0", "fan:1"]
+    finally:
+        plugin.on_shutdown()
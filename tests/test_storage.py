@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+SegmentStore writes, range queries and maintenance on a temporary folder
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import time
+
+from octoprint_pidtune.storage import SegmentStore
+
+
+def make_store(tmp_path, **kwargs) -> SegmentStore:
+    kwargs.setdefault("segment_seconds", 60)
+    return SegmentStore(str(tmp_path), **kwargs)
+
+
+def test_unchanged_target_is_in_every_window(tmp_path):
+    store = make_store(tmp_path)
+    store.record("target", 0, 1000, 200.0)
+    store.record("fan", 0, 1000, 0.5)
+    for second in range(1, 180):
+        store.record("actual", 0, second * 1000, 190.0 + second / 100)
+    store.flush()
+
+    # same segment as the change-point
+    result = store.query(30000, 40000)
+    assert result["target:0"] == [[30000, 200.0]]
+    assert result["fan:0"] == [[30000, 0.5]]
+    assert len(result["actual:0"]) == 11
+
+    # two segments later, found through the keyframe
+    result = store.query(150000, 170000, series=["target:0"])
+    assert list(result) == ["target:0"]
+    assert result["target:0"] == [[150000, 200.0]]
+
+
+def test_target_change_inside_window(tmp_path):
+    store = make_store(tmp_path)
+    store.record("target", 0, 1000, 0.0)
+    store.record("target", 0, 100000, 210.0)
+    store.flush()
+    assert store.query(90000, 110000)["target:0"] == [[90000, 0.0], [100000, 210.0]]
+
+
+def test_compacted_twin_is_read_instead_of_raw_segment(tmp_path):
+    store = make_store(tmp_path)
+    for second in range(10):
+        store.record("actual", 0, second * 1000, 190.0 + second)
+    store.flush()
+    (_, path, _), = store.segments()
+    with open(path, "rb") as raw, open(path[:-len(".bin")] + ".c.bin", "wb") as twin:
+        twin.write(raw.read())
+
+    assert len(store.segments()) == 2
+    assert len(store.query(0, 60000)["actual:0"]) == 10
+
+
+def test_maintain_compacts_then_deletes_old_segments(tmp_path):
+    store = make_store(tmp_path, compact_bucket_seconds=10)
+    for second in range(60):
+        store.record("actual", 0, second * 1000, 200.0 + (second % 10))
+    store.flush()
+
+    store.maintain(now=3 * 3600)
+    (_, _, compacted), = store.segments()
+    assert compacted
+    # min and max of every 10 s bucket
+    expected = []
+    for bucket in range(6):
+        expected += [[bucket * 10000, 200.0], [bucket * 10000 + 9000, 209.0]]
+    assert store.query(0, 60000)["actual:0"] == expected
+
+    store.maintain(now=8 * 24 * 3600)
+    assert store.segments() == []
+
+
+def test_stop_flushes_buffered_records(tmp_path):
+    store = make_store(tmp_path)
+    store.start_maintenance()
+    now_ms = int(time.time()) * 1000
+    store.record("actual", 0, now_ms, 190.0)
+    store.stop()
+    assert store.disk_usage() > 0
+    assert store.query(now_ms - 1000, now_ms + 1000)["actual:0"] == [[now_ms, 190.0]]
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+End-to-end autotune of every heater against the virtual Marlin printer
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import pytest
+
+from bench_virtual_autotune import autotune
+
+# Gains of the simulated heaters; the simulation is deterministic.
+FIRMWARE_KP = {0: 11.730, 1: 10.584, -1: 46.182}
+RELAY_KP = {0: 10.222, 1: 9.390, -1: 32.580}
+
+
+def test_firmware_queue_tunes_every_heater():
+    outcome = autotune("queue")
+    jobs = {job["heater"]: job for job in outcome["results"]}
+    assert sorted(jobs) == [-1, 0, 1]
+    for heater, kp in FIRMWARE_KP.items():
+        job = jobs[heater]
+        assert job["state"] == "done"
+        assert job["cycles_done"] == 8
+        assert job["result"]["kp"] == pytest.approx(kp, rel=0.01)
+        assert job["result"]["ki"] > 0 and job["result"]["kd"] > 0
+    # one M303 per heater, started back to back
+    assert outcome["counters"]["sent"] == 3
+    assert outcome["marlin"].ms < 30 * 60 * 1000
+    assert outcome["wall"] < 30
+
+
+def test_relay_tunes_every_heater_at_once():
+    outcome = autotune("relay")
+    tuners = {tuner["heater"]: tuner for tuner in outcome["results"]}
+    for heater, kp in RELAY_KP.items():
+        tuner = tuners[heater]
+        assert tuner["state"] == "completed"
+        assert tuner["cycles"] == 8
+        assert tuner["result"]["kp"] == pytest.approx(kp, rel=0.01)
+    # within 30 % of the firmware gains of the same heaters
+    for heater, kp in FIRMWARE_KP.items():
+        assert tuners[heater]["result"]["kp"] == pytest.approx(kp, rel=0.3)
+    # the last target each heater got switches it off
+    last = {}
+    for command in outcome["plugin"]._printer.sent:
+        heater, _, target = command.rpartition(" ")
+        last[heater] = target
+    assert last == {"M104 T0": "S0", "M104 T1": "S0", "M140": "S0"}
+    # the heaters run side by side, so it takes less printer time than one after the other
+    assert outcome["marlin"].ms < 20 * 60 * 1000
+    assert outcome["wall"] < 30
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+"""
+Base64 encoding of graph series as the frontend decodes it
+"""
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = (
+    "Copyright (C) 2022 Nicolas Grimaud - Released under terms of the AGPLv3 License"
+)
+
+import base64
+import struct
+
+from octoprint_pidtune.wire import encode_columns, encode_points
+
+
+def decode(encoded: dict) -> list:
+    """Same steps as the frontend: little-endian deltas from t0, float32 values."""
+    count = encoded["n"]
+    deltas = struct.unpack("<%d%s" % (count - 1, {2: "H", 4: "I", 8: "d"}[encoded["dtw"]]),
+                           base64.b64decode(encoded["dt"]))
+    values = struct.unpack("<%df" % count, base64.b64decode(encoded["v"]))
+    times = [encoded["t0"]]
+    for delta in deltas:
+        times.append(times[-1] + delta)
+    return [[t, v] for t, v in zip(times, values)]
+
+
+def test_empty_series():
+    assert encode_columns([], []) == {"n": 0, "t0": 0, "dtw": 2, "dt": "", "v": ""}
+
+
+def test_round_trip_with_short_deltas():
+    points = [[1700000000000, 20.5], [1700000000250, 21.0], [1700000001250, 21.25]]
+    encoded = encode_points(points)
+    assert (encoded["n"], encoded["t0"], encoded["dtw"]) == (3, 1700000000000, 2)
+    assert decode(encoded) == points
+
+
+def test_float_times_are_truncated_to_ms():
+    assert decode(encode_columns([1000.7, 2000.2], [1.0, 2.0])) == [[1000, 1.0], [2000, 2.0]]
+
+
+def test_delta_width_grows_with_the_gaps():
+    hour = 3600 * 1000
+    assert encode_columns([0, 0xFFFF], [0, 0])["dtw"] == 2
+    assert encode_columns([0, 0x10000], [0, 0])["dtw"] == 4
+    wide = encode_columns([0, hour, 0x100000000 + hour], [1.0, 2.0, 3.0])
+    assert wide["dtw"] == 8
+    assert decode(wide) == [[0, 1.0], [hour, 2.0], [0x100000000 + hour, 3.0]]